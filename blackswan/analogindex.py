@@ -0,0 +1,179 @@
+import numpy as np
+
+from blackswan.analogsearch import Analogs, dayofyear, _date_array, _flatten, _rerank, analog_correlations
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+class AnalogIndex(object):
+    """
+    Nearest neighbour index of the principal components of an archive.
+
+    The archive days are partitioned by day of the year in buckets of ``bucket`` days
+    with one KD-tree per bucket, so the seasonal window of a query only touches
+    the buckets around the day of the simulation.
+    """
+
+    def __init__(self, pcs, dates, bucket=10, doy=None):
+        """
+        :param pcs: principal components of the archive (time, modes), see analogsearch.eof_basis
+        :param dates: dates of the archive
+        :param bucket: number of days of the year in each bucket
+        :param doy: day of the year of the archive days (default: see analogsearch.dayofyear)
+        """
+        from scipy.spatial import cKDTree
+
+        self.pcs = np.asarray(pcs, dtype=float)
+        self.doy = dayofyear(dates) if doy is None else np.asarray(doy)
+        self.bucket = int(bucket)
+        nbuckets = int(np.ceil(366. / self.bucket))
+        buckets = (self.doy - 1) // self.bucket
+        self.members = [np.where(buckets == b)[0] for b in range(nbuckets)]
+        self.trees = [cKDTree(self.pcs[m]) if len(m) > 0 else None for m in self.members]
+        LOGGER.info('analogs index built with %s buckets of %s days', nbuckets, self.bucket)
+
+    def __len__(self):
+        return self.pcs.shape[0]
+
+    def _buckets(self, doy, seasonwin):
+        """
+        returns the buckets touched by the seasonal window of a day of the year
+        and whether they are completely inside the window
+        """
+        if seasonwin >= 183:
+            return [(b, True) for b in range(len(self.members))]
+        days = (doy - 1 + np.arange(-seasonwin, seasonwin + 1)) % 366
+        result = []
+        for b in np.unique(days // self.bucket):
+            first = b * self.bucket + 1
+            last = min(first + self.bucket - 1, 366)
+            inside = all(min(abs(d - doy), 366 - abs(d - doy)) <= seasonwin for d in [first, last])
+            result.append((b, inside))
+        return result
+
+    def query(self, pcs, doy, k, seasonwin=30, limit=None):
+        """
+        finds the nearest archive days of a day within the seasonal window
+
+        :param pcs: principal components of the day (modes)
+        :param doy: day of the year of the day (see analogsearch.dayofyear)
+        :param k: number of neighbours
+        :param seasonwin: number of days before and after the day of the year
+        :param limit: largest archive index allowed as neighbour
+
+        :return tuple: archive indices and euclidean distances of the neighbours,
+                       nearest first (padded with -1 and inf)
+        """
+        limit = len(self) - 1 if limit is None else limit
+        # neighbours beyond the limit are dropped, so ask each tree for more
+        extra = len(self) - 1 - limit
+        index = []
+        dist = []
+        for b, inside in self._buckets(doy, seasonwin):
+            members = self.members[b]
+            if len(members) == 0:
+                continue
+            if inside:
+                kk = min(k + extra, len(members))
+                d, i = self.trees[b].query(pcs, k=kk)
+                index.append(members[np.atleast_1d(i)])
+                dist.append(np.atleast_1d(d))
+            else:
+                # the seasonal window cuts through the bucket: search the days inside directly
+                diff = np.abs(self.doy[members] - doy)
+                sel = members[np.minimum(diff, 366 - diff) <= seasonwin]
+                delta = self.pcs[sel] - pcs
+                index.append(sel)
+                dist.append(np.sqrt(np.einsum('ij,ij->i', delta, delta)))
+
+        found = np.full(k, -1, dtype=int)
+        best = np.full(k, np.inf)
+        if index:
+            index = np.concatenate(index)
+            dist = np.concatenate(dist)
+            keep = index <= limit
+            index, dist = index[keep], dist[keep]
+            order = np.argsort(dist)[:k]
+            found[:len(order)] = index[order]
+            best[:len(order)] = dist[order]
+        return found, best
+
+
+def find_analogs_index(sim, arc, sim_dates, arc_dates, ann_index, basis,
+                       nanalog=20, seasonwin=30, timewin=1, distfun='rms',
+                       calccor=True, rerank=0, arc_ranks=None):
+    """
+    Searches the analogs of the simulation fields with the nearest neighbour index
+    of the archive. The candidates are found on the principal components and ranked
+    again on the full fields, if rerank is given or the distances are averaged over
+    a time window.
+
+    :param sim: simulation fields (time, lat, lon) or (time, gridpoints)
+    :param arc: archive fields (time, lat, lon) or (time, gridpoints)
+    :param sim_dates: dates of the simulation fields
+    :param arc_dates: dates of the archive fields
+    :param ann_index: AnalogIndex of the archive
+    :param basis: EOFBasis of the archive (see analogsearch.eof_basis)
+    :param nanalog: number of analogs to detect
+    :param seasonwin: number of days before and after the simulation day
+                      in which analogs are picked
+    :param timewin: number of days following the analog day the distance is averaged
+    :param distfun: distance function ('rms' or 'euclidean')
+    :param calccor: calculate rank correlation for analog fields (True/False)
+    :param rerank: number of candidates ranked again on the full fields
+    :param arc_ranks: ranks of the archive fields at the grid points with values
+                      (see analogsearch.field_ranks)
+
+    :return Analogs: structured result
+    """
+    if distfun not in ['rms', 'euclidean']:
+        raise Exception('analogs index not available for %s distance' % distfun)
+
+    arc = _flatten(arc)[:, basis.valid]
+    sim = _flatten(sim)[:, basis.valid]
+    nsim, narc = sim.shape[0], arc.shape[0]
+    nanalog = int(min(nanalog, narc))
+    timewin = max(int(timewin), 1)
+    ncand = int(min(max(rerank, nanalog), narc))
+    scale = 1. / np.sqrt(sim.shape[1]) if distfun == 'rms' else 1.
+
+    sim_pcs = np.dot(sim - basis.mean, basis.eofs.T)
+    sim_doy = dayofyear(sim_dates)
+
+    index = np.zeros((nsim, nanalog), dtype=int)
+    dists = np.zeros((nsim, nanalog))
+
+    for i in range(nsim):
+        win = min(timewin, nsim - i)
+        cand, dist = ann_index.query(sim_pcs[i], sim_doy[i], ncand, seasonwin=seasonwin, limit=narc - win)
+        if ncand > nanalog or timewin > 1:
+            dist = _rerank(sim, arc, i, cand[None, :], dist[None, :], timewin, distfun)[0]
+        else:
+            dist = dist * scale
+        order = np.argsort(dist)[:nanalog]
+        index[i] = cand[order]
+        dists[i] = dist[order]
+
+    if arc_ranks is not None and arc_ranks.shape[1] != arc.shape[1]:
+        arc_ranks = None
+    cors = analog_correlations(sim, arc, index, arc_ranks=arc_ranks) if calccor else None
+
+    if np.isinf(dists).any():
+        LOGGER.warning('less than %s analogs found in seasonal window for some days', nanalog)
+
+    return Analogs(dates=list(sim_dates), index=index, analogs=_date_array(arc_dates)[index],
+                   distances=dists, correlations=cors)
+
+
+def recall(result, exact):
+    """
+    fraction of the exact analogs found by an approximate search
+
+    :param result: Analogs of the approximate search
+    :param exact: Analogs of the exact search (analogsearch.find_analogs)
+
+    :return float: recall (0 - 1)
+    """
+    found = [len(np.intersect1d(a, e)) for a, e in zip(result.index, exact.index)]
+    return float(np.sum(found)) / exact.index.size
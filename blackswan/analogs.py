@@ -207,6 +207,303 @@ def get_configfile(files,
     config.close()
     return config_file
 
+
+def read_configfile(configfile):
+    """
+    Reads the CASTf90 configuration file written by get_configfile.
+
+    :param configfile: configuration file
+
+    :return dict: parameters, file paths are absolute
+    """
+    curdir = os.path.dirname(os.path.abspath(configfile))
+    params = {}
+    with open(configfile) as fp:
+        for line in fp:
+            line = line.strip()
+            if line.startswith('!') or '%' not in line or '=' not in line:
+                continue
+            key, value = line.split('%', 1)[1].split('=', 1)
+            key, value = key.strip(), value.strip()
+            if value.startswith('"'):
+                value = value.strip('"')
+            elif value.upper() in ['.TRUE.', '.FALSE.']:
+                value = value.upper() == '.TRUE.'
+            else:
+                value = int(value)
+            params[key] = value
+
+    for key in ['archivefile', 'simulationfile', 'outputfile', 'seacycfilebase', 'seacycfilesim']:
+        if key in params:
+            params[key] = os.path.join(curdir, params[key])
+    return params
+
+
+def _read_fields(resource, varname):
+    """
+    returns fields and dates of a variable in a netCDF file
+    """
+    from netCDF4 import Dataset
+
+    ds = Dataset(resource)
+    data = ds.variables[varname][:]
+    ds.close()
+    if data.ndim == 4:
+        data = data[:, 0, :, :]
+
+    try:
+        times = get_time(resource)
+    except Exception:
+        LOGGER.debug('Not standard calendar')
+        times = get_time_nc(resource)
+    return data, times
+
+
+def prepare_archive(resource, varname, seasoncyc_base=None, cycsmooth=91):
+    """
+    Reads the archive fields and removes the seasonal cycle.
+
+    :param resource: netCDF file of the reference period
+    :param varname: variable name
+    :param seasoncyc_base: netCDF file with the seasonal cycle (see seacyc), None for no normalization
+    :param cycsmooth: smoothing window for the seasonal cycle in days
+
+    :return Archive: prepared archive (see blackswan.archivestore)
+    """
+    from netCDF4 import Dataset
+    from blackswan.archivestore import Archive
+    from blackswan.analogsearch import date_ints, dayofyear, seasonal_cycle, remove_cycle, field_ranks
+    from blackswan.utils import get_index_lat, get_index_lon
+
+    data, dates = _read_fields(resource, varname)
+    shape = data.shape
+
+    ds = Dataset(resource)
+    try:
+        dims = ds.variables[varname].dimensions
+        lat = ds.variables[dims[get_index_lat(resource, variable=varname)]][:]
+        lon = ds.variables[dims[get_index_lon(resource, variable=varname)]][:]
+    except Exception:
+        msg = 'failed to find the latitudes and longitudes of %s' % varname
+        LOGGER.exception(msg)
+        raise Exception(msg)
+    finally:
+        ds.close()
+
+    if seasoncyc_base is not None:
+        base, base_dates = _read_fields(seasoncyc_base, varname)
+        cycle = seasonal_cycle(base, base_dates, cycsmooth=cycsmooth)
+        data = remove_cycle(data, dates, cycle).reshape(shape)
+    else:
+        cycle = None
+        data = np.ma.filled(np.ma.asarray(data, dtype=float), np.nan)
+
+    # ranks of the fields for the rank correlation of the analogs
+    fields = data.astype(np.float32).reshape(shape[0], -1)
+    ranks = field_ranks(fields[:, ~np.isnan(fields).any(axis=0)])
+
+    return Archive(data=data.astype(np.float32), dates=date_ints(dates),
+                   lat=np.asarray(lat), lon=np.asarray(lon),
+                   cycle=cycle.astype(np.float32) if cycle is not None else None,
+                   doy=dayofyear(dates), ranks=ranks)
+
+
+def call_castf90(configfiles, workers=1, status=None):
+    """
+    Runs the CASTf90 analogs search ``analogue.out configfile`` for several
+    configuration files concurrently. The OpenMP/MKL threads of the runs share
+    the cores of the machine.
+
+    :param configfiles: list of configuration files (see get_configfile)
+    :param workers: maximum number of concurrent runs
+    :param status: function called with the position of each finished run
+
+    :return list: outputs of the runs
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+    from subprocess import check_output, STDOUT
+
+    workers = max(1, min(int(workers), len(configfiles)))
+    threads = max(1, cpu_count() // workers)
+    env = os.environ.copy()
+    for key in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS']:
+        env[key] = str(min(threads, int(env.get(key, threads))))
+
+    def _run(i):
+        cmd = ['analogue.out', configfiles[i]]
+        LOGGER.debug("castf90 command: %s", cmd)
+        return i, check_output(cmd, stderr=STDOUT, env=env)
+
+    outputs = [None] * len(configfiles)
+    pool = ThreadPool(workers)
+    try:
+        for i, output in pool.imap_unordered(_run, range(len(configfiles))):
+            outputs[i] = output
+            if status is not None:
+                status(i)
+    finally:
+        pool.close()
+        pool.join()
+    return outputs
+
+
+def run_analogs(configfile, **kwargs):
+    """
+    In-process replacement for the CASTf90 call ``analogue.out configfile``.
+    The analogs are searched with blackswan.analogsearch and written to the
+    output file of the configuration in the CASTf90 text format.
+
+    :param configfile: configuration file (see get_configfile)
+    :param kwargs: options of search_analogs
+
+    :return str: analogs output file
+    """
+    from blackswan.analogsearch import write_analogs
+
+    result = search_analogs(configfile, **kwargs)
+    output_file = read_configfile(configfile)['outputfile']
+    return write_analogs(result, output_file, binary=True)
+
+
+def run_analogs_batch(configfiles):
+    """
+    In-process replacement for several CASTf90 calls with the same search settings,
+    e.g. one simulation compared to several reference periods. Each distinct archive
+    and simulation is read once and the analogs of all configurations sharing a
+    simulation are searched in one pass (see blackswan.analogsearch.find_analogs_batch).
+
+    :param configfiles: list of configuration files (see get_configfile)
+
+    :return list: analogs output files
+    """
+    from blackswan.analogsearch import find_analogs_batch, write_analogs
+    from blackswan.analogsearch import seasonal_cycle, remove_cycle
+
+    params = [read_configfile(c) for c in configfiles]
+    settings = ['varname', 'nanalog', 'seasonwin', 'timewin', 'distfun', 'calccor', 'seacyc', 'cycsmooth']
+    if any(p.get(key) != params[0].get(key) for p in params for key in settings):
+        LOGGER.info('search settings differ, searching the analogs of each configuration')
+        return [run_analogs(c) for c in configfiles]
+
+    first = params[0]
+    varname = first['varname']
+    seacyc = first.get('seacyc') is True
+    cycsmooth = first.get('cycsmooth', 91)
+
+    archives = {}
+    sims = {}
+    groups = {}
+    for i, p in enumerate(params):
+        arc_key = (p['archivefile'], p['seacycfilebase'] if seacyc else None)
+        if arc_key not in archives:
+            archives[arc_key] = prepare_archive(p['archivefile'], varname, seasoncyc_base=arc_key[1],
+                                                cycsmooth=cycsmooth)
+        sim_key = (p['simulationfile'], p['seacycfilesim'] if seacyc else None)
+        if sim_key not in sims:
+            sim, sim_dates = _read_fields(p['simulationfile'], varname)
+            if seacyc:
+                cyc, cyc_dates = _read_fields(p['seacycfilesim'], varname)
+                cycle = seasonal_cycle(cyc, cyc_dates, cycsmooth=cycsmooth)
+                sim = remove_cycle(sim, sim_dates, cycle).reshape(sim.shape)
+            sims[sim_key] = (sim, sim_dates)
+        groups.setdefault(sim_key, []).append((i, arc_key))
+
+    output_files = [None] * len(params)
+    for sim_key, members in groups.items():
+        sim, sim_dates = sims[sim_key]
+        arcs = [archives[arc_key] for _, arc_key in members]
+        results = find_analogs_batch([sim], [a.data for a in arcs], [sim_dates], [a.dates for a in arcs],
+                                     nanalog=first.get('nanalog', 20),
+                                     seasonwin=first.get('seasonwin', 30),
+                                     timewin=first.get('timewin', 1),
+                                     distfun=first.get('distfun', 'rms'),
+                                     calccor=first.get('calccor', True),
+                                     arcs_doy=[a.doy for a in arcs])[0]
+        for (i, _), result in zip(members, results):
+            output_files[i] = write_analogs(result, params[i]['outputfile'], binary=True)
+    LOGGER.info('analogs of %s configurations searched with %s archives', len(params), len(archives))
+    return output_files
+
+
+def search_analogs(configfile, archive=None, basis=None, rerank=0, ann_index=None, previous=None):
+    """
+    Searches the analogs for the configuration of a CASTf90 call.
+
+    :param configfile: configuration file (see get_configfile)
+    :param archive: prepared Archive (see prepare_archive). If given, the archive file of the
+                    configuration is not read and the simulation is normalized with the
+                    seasonal cycle of the archive.
+    :param basis: EOFBasis of the archive data for the EOF reduced search
+                  (see blackswan.analogsearch.eof_basis)
+    :param rerank: number of candidates of the reduced search ranked again on the full fields
+    :param ann_index: AnalogIndex of the archive principal components (see blackswan.analogindex).
+                      If given, the analogs are picked with the index instead of an exact search.
+    :param previous: Analogs of an earlier search with the same archive and settings.
+                     Only the simulation days not found in it are searched.
+
+    :return Analogs: analogs of the simulation days
+    """
+    from blackswan.analogsearch import find_analogs, seasonal_cycle, remove_cycle
+    from blackswan.analogsearch import reusable_days, concat_analogs, take_days
+
+    params = read_configfile(configfile)
+    varname = params['varname']
+    seacyc = params.get('seacyc') is True
+    cycsmooth = params.get('cycsmooth', 91)
+
+    if archive is None:
+        archive = prepare_archive(params['archivefile'], varname,
+                                  seasoncyc_base=params['seacycfilebase'] if seacyc else None,
+                                  cycsmooth=cycsmooth)
+
+    sim, sim_dates = _read_fields(params['simulationfile'], varname)
+    shape = sim.shape[1:]
+
+    if seacyc:
+        if archive.cycle is not None and params.get('seacycfilesim') in [None, params.get('seacycfilebase')]:
+            cycle = archive.cycle
+        else:
+            cyc, cyc_dates = _read_fields(params['seacycfilesim'], varname)
+            cycle = seasonal_cycle(cyc, cyc_dates, cycsmooth=cycsmooth)
+        sim = remove_cycle(sim, sim_dates, cycle).reshape((-1,) + shape)
+        LOGGER.debug('seasonal cycle removed')
+
+    distfun = params.get('distfun', 'rms')
+    reused = None
+    if previous is not None:
+        rows = reusable_days(previous, sim_dates, timewin=params.get('timewin', 1))
+        if len(rows) > 0:
+            reused = take_days(previous, rows)
+            sim = sim[len(rows):]
+            sim_dates = sim_dates[len(rows):]
+        LOGGER.info('analogs of %s simulation days taken from previous search', len(rows))
+        if len(sim_dates) == 0:
+            return reused
+
+    if ann_index is not None and basis is not None and distfun in ['rms', 'euclidean']:
+        from blackswan.analogindex import find_analogs_index
+        result = find_analogs_index(sim, archive.data, sim_dates, archive.dates, ann_index, basis,
+                                    nanalog=params.get('nanalog', 20),
+                                    seasonwin=params.get('seasonwin', 30),
+                                    timewin=params.get('timewin', 1),
+                                    distfun=distfun,
+                                    calccor=params.get('calccor', True),
+                                    rerank=rerank, arc_ranks=archive.ranks)
+    else:
+        result = find_analogs(sim, archive.data, sim_dates, archive.dates,
+                              nanalog=params.get('nanalog', 20),
+                              seasonwin=params.get('seasonwin', 30),
+                              timewin=params.get('timewin', 1),
+                              distfun=distfun,
+                              calccor=params.get('calccor', True),
+                              basis=basis, rerank=rerank, arc_doy=archive.doy,
+                              arc_ranks=archive.ranks)
+    LOGGER.info('analogs found for %s simulation days', len(result.dates))
+    if reused is not None:
+        result = concat_analogs([reused, result])
+    return result
+
 # def subset(resource=[], bbox='-80,50,22.5,70'):
 #   """
 #    OBSOLETE
@@ -321,49 +618,23 @@ def reformat_analogs(analogs, prefix='modified-analogfile.tsv'):
     """
     Reformats analogs results file for analogues viewer code.
 
-    :param analogs: output from analog_detection process
+    :param analogs: output from analog_detection process (text or binary, see load_analogs)
 
     :return str: reformatted analogs file for analogues viewer
     """
-    # import numpy as np
     import pandas as pd
+    from blackswan.analogsearch import load_analogs
 
     try:
-        num_cols = 3  # dateAnlg, Dis, Corr
-
-        # Create dataframe and read in output csv file of analogs process
-        dfS = pd.DataFrame()
-        dfS = pd.read_csv(analogs, delimiter=r"\s+", index_col=0)
-
-        # Find number of analogues
-        num_analogues = int((dfS.shape[1]) / 3)
-        # LOGGER.debug('num_analogues: %s', num_analogues)
-
-        # Define temporary df
-        df_anlg = dfS.iloc[:, 0:num_analogues]  # store only anlg dates
-        df_dis = dfS.iloc[:, num_analogues:2 * num_analogues]  # store only dis
-        df_corr = dfS.iloc[:, 2 * num_analogues:3 *
-                           num_analogues]  # store only corr
-
-        # remove index name before stacking
-        df_anlg.index.name = ""
-        df_dis.index.name = ""
-        df_corr.index.name = ""
-
-        dateStack = df_anlg.stack()
-        disStack = df_dis.stack().abs()  # raw values < 0 so take abs
-        corrStack = df_corr.stack()
-
-        # Create df of correct dimensions (n x num_cols) using dfS
-        df_all = dfS.iloc[:, 0:num_cols]  # NB data are placeholders
-        # Rename cols
-        df_all.columns = ['dateAnlg', 'Dis', 'Corr']
-        # Replicate each row 20 times (for dcjs format)
-        df_all = df_all.loc[np.repeat(df_all.index.values, num_analogues)]
-        # Replace data placeholders with correct values
-        df_all['dateAnlg'] = list(dateStack)
-        df_all['Dis'] = list(disStack)
-        df_all['Corr'] = list(corrStack)
+        result = load_analogs(analogs)
+        num_analogues = result.analogs.shape[1]
+
+        # one row per analog (for dcjs format)
+        df_all = pd.DataFrame({'dateAnlg': result.analogs.ravel(),
+                               'Dis': np.abs(result.distances.ravel()),  # raw values < 0 so take abs
+                               'Corr': result.correlations.ravel()},
+                              index=np.repeat(result.dates, num_analogues),
+                              columns=['dateAnlg', 'Dis', 'Corr'])
         # Name index col
         df_all.index.name = 'dateRef'
 
@@ -461,24 +732,18 @@ def plot_analogs(configfile='config.txt', soutpdf='Analogs.pdf', simday='all', *
         # total_simmin = np.min(simvar)
         # total_simmax = np.max(simvar)
 
-        cont = [line.rstrip('\n') for line in open(analogfile)]
+        from blackswan.analogsearch import load_analogs
+        result = load_analogs(analogfile)
 
         Nlin = 30
 
-        for idx, item in enumerate(cont[1:]):
-            ana = item.split()
+        for idx in range(len(result.dates)):
+            ana = ['%08d' % result.dates[idx]] + ['%08d' % d for d in result.analogs[idx, :nanalog]]
             sim_date = dt.strptime(ana[0], '%Y%m%d')
             an_dates = []
             for dat in ana[1:1+nanalog]: an_dates.append(dt.strptime(dat, '%Y%m%d'))
 
-            c_dists = ana[1+nanalog:1+2*nanalog]
-            c_cors = ana[1+2*nanalog:]
-            dists = np.zeros((nanalog), dtype=float)
-            cors = np.zeros((nanalog), dtype=float)
-
-            for i in range(0, nanalog):
-                dists[i] = float(c_dists[i])
-                cors[i] = float(c_cors[i])
+            cors = np.asarray(result.correlations[idx, :nanalog], dtype=float)
 
             # min_dist = np.min(dists)
             # max_corr = np.max(cors)
@@ -0,0 +1,869 @@
+import os
+import numbers
+
+import numpy as np
+
+from collections import namedtuple
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+_DISTANCES_ = ['rms', 'euclidean', 'mahalanobis', 'cosine', 'S1']
+
+# cumulative day count at the start of each month for a leap year
+_MONTH_START_ = [0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335]
+
+Analogs = namedtuple('Analogs', ['dates', 'index', 'analogs', 'distances', 'correlations'])
+Analogs.__doc__ = """
+Result of an analog search.
+
+dates: simulation dates (nsim)
+index: row index of the analogs in the archive (nsim, nanalog)
+analogs: archive dates of the analogs (nsim, nanalog)
+distances: distance of each analog, best analog first (nsim, nanalog)
+correlations: spatial rank correlation of each analog or None (nsim, nanalog)
+"""
+
+EOFBasis = namedtuple('EOFBasis', ['mean', 'eofs', 'pcs', 'valid'])
+EOFBasis.__doc__ = """
+Leading EOFs of a reference archive.
+
+mean: mean field of the archive (gridpoints)
+eofs: leading EOFs (modes, gridpoints)
+pcs: principal components of the archive fields (time, modes)
+valid: mask of the grid points used (all gridpoints)
+"""
+
+
+def date_ints(dates):
+    """
+    returns dates as integers in the form YYYYMMDD
+
+    :param dates: list of datetime (or netcdftime) objects or integers YYYYMMDD
+
+    :return numpy.array: dates as int32
+    """
+    if isinstance(dates, np.ndarray) and dates.dtype.kind in 'iu':
+        return dates.astype(np.int32)
+    return np.array([d if isinstance(d, numbers.Integral) else d.year * 10000 + d.month * 100 + d.day
+                     for d in dates], dtype=np.int32)
+
+
+def _date_array(dates):
+    """
+    returns dates as array which can be indexed with the analogs index,
+    integer dates YYYYMMDD are kept as integers
+    """
+    if isinstance(dates, np.ndarray) and dates.dtype.kind in 'iu':
+        return dates
+    return np.array(dates, dtype=object)
+
+
+def get_calendar(dates, default='standard'):
+    """
+    returns the calendar of a list of netcdftime objects
+
+    :param dates: list of datetime (or netcdftime) objects or integers YYYYMMDD
+    :param default: calendar of dates without calendar information
+
+    :return str: calendar
+    """
+    if isinstance(dates, np.ndarray) and dates.dtype.kind in 'iu':
+        return default
+    calendar = getattr(dates[0], 'calendar', None) if len(dates) > 0 else None
+    return calendar or default
+
+
+def dayofyear(dates, calendar=None):
+    """
+    returns the day of the year for a list of dates. The days are counted
+    as in a leap year, so the 1st of March is always day 61 (also for the
+    noleap calendar). The days of the 360_day calendar are spread over the
+    366 days of a leap year.
+
+    :param dates: list of datetime (or netcdftime) objects or integers YYYYMMDD
+    :param calendar: calendar of the dates (default: from the netcdftime objects)
+
+    :return numpy.array: day of the year (1 - 366)
+    """
+    if calendar is None:
+        calendar = get_calendar(dates)
+    ints = date_ints(dates)
+    month = ints // 100 % 100
+    day = ints % 100
+    if calendar == '360_day':
+        doy = (month - 1) * 30 + day
+        return (np.floor((doy - 0.5) * 366. / 360.) + 1).astype(int)
+    return np.array(_MONTH_START_)[month - 1] + day
+
+
+def season_runs(arc_doy, sim_doy, seasonwin, tile=None):
+    """
+    returns the ranges of consecutive archive days in the seasonal window of
+    any of the simulation days. The candidates are found with one lookup of
+    the days of the year in the seasonal window.
+
+    :param arc_doy: day of the year of the archive days (see dayofyear)
+    :param sim_doy: day of the year of the simulation days
+    :param seasonwin: number of days before and after the simulation day
+    :param tile: maximum number of archive days of a range
+
+    :return list: ranges (first, last) of archive days, last not included
+    """
+    inside = np.zeros(366, dtype=bool)
+    offsets = np.arange(-seasonwin, seasonwin + 1) if seasonwin < 183 else np.arange(366)
+    inside[(np.unique(sim_doy)[:, None] - 1 + offsets[None, :]) % 366] = True
+    candidate = np.concatenate([[False], inside[np.asarray(arc_doy) - 1], [False]])
+    edges = np.flatnonzero(np.diff(candidate.astype(np.int8)))
+    runs = []
+    for first, last in zip(edges[::2], edges[1::2]):
+        step = last - first if tile is None else tile
+        runs.extend((int(f), int(min(f + step, last))) for f in range(first, last, step))
+    return runs
+
+
+def _flatten(data):
+    """
+    returns the fields as 2D array (time, gridpoints) in float64
+    """
+    data = np.ma.filled(np.ma.asarray(data, dtype=float), np.nan)
+    return data.reshape(data.shape[0], -1)
+
+
+def smooth_cycle(cycle, cycsmooth=91):
+    """
+    smoothes a seasonal cycle with a circular running mean
+
+    :param cycle: seasonal cycle (days, gridpoints)
+    :param cycsmooth: smoothing window in days (odd integer)
+
+    :return numpy.array: smoothed seasonal cycle
+    """
+    ndays = cycle.shape[0]
+    half = min(int(cycsmooth) // 2, (ndays - 1) // 2)
+    if half < 1:
+        return cycle
+    padded = np.concatenate([cycle[-half:], cycle, cycle[:half]], axis=0)
+    csum = np.cumsum(padded, axis=0)
+    csum = np.concatenate([np.zeros((1,) + cycle.shape[1:]), csum], axis=0)
+    width = 2 * half + 1
+    return (csum[width:] - csum[:-width]) / width
+
+
+def seasonal_cycle(data, dates, cycsmooth=91):
+    """
+    calculates the smoothed mean seasonal cycle of the given fields
+
+    :param data: fields (time, ...)
+    :param dates: dates of the fields
+    :param cycsmooth: smoothing window in days
+
+    :return numpy.array: seasonal cycle (366, gridpoints)
+    """
+    dat = _flatten(data)
+    doy = dayofyear(dates) - 1
+    cycle = np.zeros((366, dat.shape[1]))
+    count = np.zeros(366)
+    np.add.at(cycle, doy, dat)
+    np.add.at(count, doy, 1)
+    present = count > 0
+    cycle[present] /= count[present][:, None]
+    # days missing in the input (e.g. 29th of February) are interpolated
+    if not present.all():
+        days = np.arange(366)
+        for i in range(cycle.shape[1]):
+            cycle[~present, i] = np.interp(days[~present], days[present], cycle[present, i], period=366)
+    return smooth_cycle(cycle, cycsmooth=cycsmooth)
+
+
+def remove_cycle(data, dates, cycle):
+    """
+    subtracts the seasonal cycle from the fields
+
+    :param data: fields (time, ...)
+    :param dates: dates of the fields
+    :param cycle: seasonal cycle (366, gridpoints), see seasonal_cycle
+
+    :return numpy.array: anomalies (time, gridpoints)
+    """
+    return _flatten(data) - cycle[dayofyear(dates) - 1]
+
+
+def eof_basis(arc, variance=0.9, max_modes=None):
+    """
+    calculates the leading EOFs of the archive fields with a truncated SVD
+
+    :param arc: archive fields (time, lat, lon) or (time, gridpoints)
+    :param variance: fraction of the variance retained by the leading EOFs
+    :param max_modes: maximum number of EOFs
+
+    :return EOFBasis: EOFs and principal components of the archive
+    """
+    arc = _flatten(arc)
+    valid = ~np.isnan(arc).any(axis=0)
+    arc = arc[:, valid]
+    mean = arc.mean(axis=0)
+    u, s, vt = np.linalg.svd(arc - mean, full_matrices=False)
+    explained = np.cumsum(s ** 2) / max(np.sum(s ** 2), np.finfo(float).tiny)
+    nmodes = min(int(np.searchsorted(explained, variance)) + 1, len(s))
+    if max_modes is not None:
+        nmodes = min(nmodes, int(max_modes))
+    LOGGER.info('%s EOFs retain %.1f%% of the archive variance',
+                nmodes, 100. * explained[nmodes - 1])
+    return EOFBasis(mean=mean, eofs=vt[:nmodes], pcs=u[:, :nmodes] * s[:nmodes], valid=valid)
+
+
+def project(data, basis):
+    """
+    projects fields onto the EOFs of an archive
+
+    :param data: fields (time, lat, lon) or (time, gridpoints)
+    :param basis: EOFBasis, see eof_basis
+
+    :return numpy.array: principal components (time, modes)
+    """
+    return np.dot(_flatten(data)[:, basis.valid] - basis.mean, basis.eofs.T)
+
+
+def _prepare(arc, distfun):
+    """
+    precomputes the archive dependent terms of the distance function
+    """
+    prep = {}
+    if distfun in ['rms', 'euclidean']:
+        prep['arc'] = arc
+        prep['sq'] = np.einsum('ij,ij->i', arc, arc)
+    elif distfun == 'cosine':
+        norm = np.sqrt(np.einsum('ij,ij->i', arc, arc))
+        norm[norm == 0] = 1.
+        prep['arc'] = arc / norm[:, None]
+    elif distfun == 'mahalanobis':
+        # whitening with the principal components of the archive:
+        # the mahalanobis distance is the euclidean distance of the whitened fields
+        mean = arc.mean(axis=0)
+        _, s, vt = np.linalg.svd(arc - mean, full_matrices=False)
+        keep = s > s[0] * 1e-10
+        scale = s[keep] / np.sqrt(max(arc.shape[0] - 1, 1))
+        prep['mean'] = mean
+        prep['white'] = vt[keep].T / scale
+        white = np.dot(arc - mean, prep['white'])
+        prep['arc'] = white
+        prep['sq'] = np.einsum('ij,ij->i', white, white)
+    elif distfun == 'S1':
+        prep['arc'] = arc
+    else:
+        raise Exception('distance function %s not known' % distfun)
+    return prep
+
+
+def _s1(sim, arc, shape):
+    """
+    Teweles and Wobus S1 score of sim (n, gridpoints) against arc (m, gridpoints)
+    """
+    sim = sim.reshape((sim.shape[0],) + shape)
+    arc = arc.reshape((arc.shape[0],) + shape)
+    sdx, sdy = np.diff(sim, axis=-1), np.diff(sim, axis=-2)
+    adx, ady = np.diff(arc, axis=-1), np.diff(arc, axis=-2)
+    dist = np.empty((sim.shape[0], arc.shape[0]))
+    for i in range(sim.shape[0]):
+        num = np.nansum(np.abs(adx - sdx[i]), axis=(-2, -1)) + np.nansum(np.abs(ady - sdy[i]), axis=(-2, -1))
+        den = np.nansum(np.maximum(np.abs(adx), np.abs(sdx[i])), axis=(-2, -1)) + \
+            np.nansum(np.maximum(np.abs(ady), np.abs(sdy[i])), axis=(-2, -1))
+        dist[i] = 100. * num / den
+    return dist
+
+
+def distances(sim, prep, distfun='rms', shape=None):
+    """
+    calculates the distances between simulation fields and the archive
+
+    :param sim: simulation fields (n, gridpoints)
+    :param prep: prepared archive, see _prepare
+    :param distfun: distance function (see _DISTANCES_)
+    :param shape: shape (lat, lon) of the fields, needed for S1
+
+    :return numpy.array: distance matrix (n, m)
+    """
+    arc = prep['arc']
+    if distfun in ['rms', 'euclidean', 'mahalanobis']:
+        if distfun == 'mahalanobis':
+            sim = np.dot(sim - prep['mean'], prep['white'])
+        d2 = np.einsum('ij,ij->i', sim, sim)[:, None] + prep['sq'][None, :] - 2. * np.dot(sim, arc.T)
+        np.maximum(d2, 0., out=d2)
+        if distfun == 'rms':
+            d2 /= sim.shape[1]
+        dist = np.sqrt(d2)
+    elif distfun == 'cosine':
+        norm = np.sqrt(np.einsum('ij,ij->i', sim, sim))
+        norm[norm == 0] = 1.
+        dist = 1. - np.dot(sim / norm[:, None], arc.T)
+    else:
+        dist = _s1(sim, arc, shape)
+    return dist
+
+
+def _rank(data):
+    """
+    ranks the values of each field (last axis)
+    """
+    return np.argsort(np.argsort(data, axis=-1), axis=-1).astype(float)
+
+
+def field_ranks(data):
+    """
+    ranks of the values of each field, e.g. to be kept with a prepared archive
+
+    :param data: fields (time, gridpoints)
+
+    :return numpy.array: ranks as int16 (int32 for more than 32767 gridpoints)
+    """
+    dtype = np.int16 if data.shape[-1] < 2 ** 15 else np.int32
+    return np.argsort(np.argsort(data, axis=-1), axis=-1).astype(dtype)
+
+
+def rank_correlation(sim, arc):
+    """
+    spearman rank correlation between a field and a set of fields
+
+    :param sim: field (gridpoints)
+    :param arc: fields (n, gridpoints)
+
+    :return numpy.array: correlations (n)
+    """
+    npts = sim.shape[-1]
+    d = _rank(arc) - _rank(sim)[None, :]
+    return 1. - 6. * np.einsum('ij,ij->i', d, d) / (npts * (npts ** 2 - 1.))
+
+
+def analog_correlations(sim, arc, index, arc_ranks=None, block=64):
+    """
+    spearman rank correlations between the simulation fields and their analogs,
+    calculated for all analogs of a block of simulation days at once
+
+    :param sim: simulation fields (nsim, gridpoints)
+    :param arc: archive fields (narc, gridpoints)
+    :param index: row index of the analogs in the archive (nsim, nanalog)
+    :param arc_ranks: ranks of the archive fields (see field_ranks). If not given,
+                      only the ranks of the analog fields are calculated.
+    :param block: number of simulation days processed at once
+
+    :return numpy.array: correlations (nsim, nanalog)
+    """
+    npts = sim.shape[-1]
+    index = np.asarray(index)
+    if arc_ranks is None:
+        rows, inverse = np.unique(index.ravel(), return_inverse=True)
+        index = inverse.reshape(index.shape)
+        arc_ranks = field_ranks(arc[rows])
+    sim_ranks = _rank(sim)
+    cors = np.empty(index.shape)
+    for start in range(0, sim.shape[0], block):
+        stop = min(start + block, sim.shape[0])
+        d = arc_ranks[index[start:stop]] - sim_ranks[start:stop, None, :]
+        cors[start:stop] = 1. - 6. * np.einsum('ijk,ijk->ij', d, d) / (npts * (npts ** 2 - 1.))
+    return cors
+
+
+def _rerank(sim, arc, start, index, dist, timewin, distfun):
+    """
+    recalculates the time window averaged distances of the candidate analogs
+    (rows, candidates) of the simulation days from start on in the full space
+    """
+    nsim = sim.shape[0]
+    exact = np.full(dist.shape, np.inf)
+    for i in range(index.shape[0]):
+        cand = index[i][np.isfinite(dist[i])]
+        win = min(timewin, nsim - start - i)
+        total = np.zeros(len(cand))
+        for k in range(win):
+            diff = arc[cand + k] - sim[start + i + k]
+            total += np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        if distfun == 'rms':
+            total /= np.sqrt(sim.shape[1])
+        exact[i][np.isfinite(dist[i])] = total / win
+    return exact
+
+
+def _diagonal_sums(dist, nrows, ncols, timewin):
+    """
+    sums dist[i + k, j + k] over k < min(timewin, len(dist) - i) for i < nrows and
+    j < ncols with cumulative sums along the diagonals, so the cost does not depend
+    on timewin. Sums reaching beyond the last column of dist are not defined.
+    """
+    from numpy.lib.stride_tricks import as_strided
+
+    nr, width = dist.shape
+    length = nr + width
+    # sheared copy: row r + 1 holds dist[r] shifted by nr - r, so diagonals become columns
+    sheared = np.zeros((nr + 1, length))
+    step = sheared.strides[1]
+    view = as_strided(sheared.ravel()[length + nr:], shape=(nr, width), strides=((length - 1) * step, step))
+    view[:] = dist
+    csum = np.cumsum(sheared, axis=0)
+    flat = csum.ravel()
+
+    def diagonal(row, i0, i1):
+        # csum[i + row, nr - i + j] for i0 <= i < i1 and j < ncols
+        offset = row * length + nr + i0 * (length - 1)
+        return as_strided(flat[offset:], shape=(i1 - i0, ncols), strides=((length - 1) * step, step))
+
+    sums = np.empty((nrows, ncols))
+    # rows with the full time window
+    full = max(min(nrows, nr - timewin + 1), 0)
+    if full > 0:
+        sums[:full] = diagonal(timewin, 0, full) - diagonal(0, 0, full)
+    # rows at the end of the simulation with a shorter window
+    for i in range(full, nrows):
+        w = nr - i
+        sums[i] = diagonal(w, i, i + 1)[0] - diagonal(0, i, i + 1)[0]
+    return sums
+
+
+def _time_window(dist, start, nrows, nsim, timewin, ncols=None):
+    """
+    averages the distances of the simulation days start .. start + nrows over the
+    following days. dist holds the distances of the simulation days from start on
+    including the following timewin - 1 days, to the ncols candidate archive days
+    and the following archive days (if any).
+    """
+    width = dist.shape[1]
+    ncols = width if ncols is None else ncols
+    if timewin == 1:
+        return np.array(dist[:nrows, :ncols], dtype=float)
+
+    missing = np.isnan(dist)
+    has_missing = missing.any()
+    if has_missing:
+        dist = np.where(missing, 0., dist)
+    win = _diagonal_sums(dist, nrows, ncols, timewin)
+    if has_missing:
+        win[_diagonal_sums(missing.astype(float), nrows, ncols, timewin) > 0] = np.nan
+
+    # window length of each simulation day and candidates without all following days
+    count = np.minimum(timewin, nsim - start - np.arange(nrows))
+    win /= count[:, None]
+    win[np.arange(ncols)[None, :] + count[:, None] > width] = np.inf
+    return win
+
+
+def _season_window(win, sim_doy, arc_doy, seasonwin):
+    """
+    excludes the candidates outside of the seasonal window (in place)
+    """
+    diff = np.abs(sim_doy[:, None] - arc_doy[None, :])
+    diff = np.minimum(diff, 366 - diff)
+    win[diff > seasonwin] = np.inf
+    win[np.isnan(win)] = np.inf
+
+
+def _smallest(win, k):
+    """
+    returns the columns and values of the k smallest values of each row (unsorted)
+    """
+    idx = np.argpartition(win, k - 1, axis=1)[:, :k]
+    return idx, np.take_along_axis(win, idx, axis=1)
+
+
+def _merge(index, dist, tile_index, tile_dist, k):
+    """
+    merges the running k best candidates with the candidates of a tile
+    """
+    index = np.concatenate([index, tile_index], axis=1)
+    sel, dist = _smallest(np.concatenate([dist, tile_dist], axis=1), k)
+    return np.take_along_axis(index, sel, axis=1), dist
+
+
+def _prep_tile(prep, first, last):
+    """
+    returns the prepared archive days first .. last - 1 (see _prepare)
+    """
+    tile = dict(prep)
+    for key in ['arc', 'sq']:
+        if key in prep:
+            tile[key] = prep[key][first:last]
+    return tile
+
+
+def tile_size(nrows, memory=None, fraction=0.25):
+    """
+    returns the number of archive days processed at once, so that the distance
+    tiles of a block of simulation days fit in the available memory
+
+    :param nrows: number of simulation days processed at once
+    :param memory: memory for the tiles in bytes (default: fraction of the available memory)
+    :param fraction: fraction of the available memory used for the tiles
+
+    :return int: number of archive days
+    """
+    if memory is None:
+        import psutil
+        memory = psutil.virtual_memory().available * fraction
+    # distances, time window average and seasonal window mask of float64
+    return max(int(memory // (nrows * 8 * 4)), 1)
+
+
+def find_analogs(sim, arc, sim_dates, arc_dates,
+                 nanalog=20, seasonwin=30, timewin=1, distfun='rms',
+                 calccor=True, block=None, basis=None, rerank=0, tile=None, arc_doy=None,
+                 arc_ranks=None):
+    """
+    Searches the analogs of the simulation fields in the archive.
+
+    The distances are calculated in tiles of block simulation days and tile
+    archive days. Only the best candidates of each simulation day are kept
+    between the tiles, so the memory needed depends on the tile size only.
+    Archive days outside the seasonal window of a block are skipped.
+
+    :param sim: simulation fields (time, lat, lon) or (time, gridpoints)
+    :param arc: archive fields in which the analogs are picked
+    :param sim_dates: dates of the simulation fields
+    :param arc_dates: dates of the archive fields
+    :param nanalog: number of analogs to detect
+    :param seasonwin: number of days before and after the simulation day
+                      in which analogs are picked
+    :param timewin: number of days following the analog day the distance is averaged
+    :param distfun: distance function (see _DISTANCES_)
+    :param calccor: calculate rank correlation for analog fields (True/False)
+    :param block: number of simulation days processed at once
+                  (default: length of the seasonal window)
+    :param basis: EOFBasis of the archive (see eof_basis). If given, the distances
+                  are calculated on the principal components (rms and euclidean only)
+    :param rerank: number of candidates found on the principal components, which are
+                   ranked again with the distances of the full fields (0 for no reranking)
+    :param tile: number of archive days processed at once (default: see tile_size)
+    :param arc_doy: day of the year of the archive days (default: see dayofyear)
+    :param arc_ranks: ranks of the archive fields at the grid points with values (see field_ranks)
+
+    :return Analogs: structured result
+    """
+    if distfun not in _DISTANCES_:
+        raise Exception('distance function %s not known' % distfun)
+    if basis is not None and distfun not in ['rms', 'euclidean']:
+        LOGGER.warning('EOF reduced search not available for %s distance, using full fields', distfun)
+        basis = None
+
+    shape = np.shape(arc)[1:]
+    arc = _flatten(arc)
+    sim = _flatten(sim)
+    if basis is not None:
+        arc = arc[:, basis.valid]
+        sim = sim[:, basis.valid]
+    elif distfun != 'S1':
+        # skip grid points without values (e.g. masked land points)
+        valid = ~(np.isnan(arc).any(axis=0) | np.isnan(sim).any(axis=0))
+        arc = arc[:, valid]
+        sim = sim[:, valid]
+
+    nsim, narc = sim.shape[0], arc.shape[0]
+    nanalog = int(min(nanalog, narc))
+    timewin = max(int(timewin), 1)
+    halo = timewin - 1
+
+    sim_doy = dayofyear(sim_dates)
+    if arc_doy is None:
+        arc_doy = dayofyear(arc_dates)
+    arc_dates = _date_array(arc_dates)
+
+    if basis is not None:
+        # euclidean distances of the principal components
+        prep = _prepare(basis.pcs, 'euclidean')
+        sim_pcs = np.dot(sim - basis.mean, basis.eofs.T)
+        scale = 1. / np.sqrt(sim.shape[1]) if distfun == 'rms' else 1.
+        ncand = int(min(max(rerank, nanalog), narc))
+    else:
+        prep = _prepare(arc, distfun)
+        ncand = nanalog
+
+    index = np.zeros((nsim, nanalog), dtype=int)
+    dists = np.zeros((nsim, nanalog))
+    cors = None
+
+    if block is None:
+        # small blocks of consecutive days keep the seasonal window of the block narrow
+        block = max(2 * int(seasonwin) + 1, 32)
+    if tile is None:
+        tile = tile_size(min(block, nsim) + halo)
+    tile = max(int(tile), 1)
+    if tile < narc:
+        LOGGER.debug('archive processed in tiles of %s days', tile)
+
+    for start in range(0, nsim, block):
+        stop = min(start + block, nsim)
+        nrows = stop - start
+        rows = sim_pcs[start:min(stop + halo, nsim)] if basis is not None else sim[start:min(stop + halo, nsim)]
+
+        idx = np.zeros((nrows, ncand), dtype=int)
+        part = np.full((nrows, ncand), np.inf)
+        for first, last in season_runs(arc_doy, sim_doy[start:stop], seasonwin, tile=tile):
+            # the following days of the last candidates are needed for the time window
+            tile_prep = _prep_tile(prep, first, min(last + halo, narc))
+            if basis is not None:
+                dist = scale * distances(rows, tile_prep, distfun='euclidean')
+            else:
+                dist = distances(rows, tile_prep, distfun=distfun, shape=shape)
+
+            win = _time_window(dist, start, nrows, nsim, timewin, ncols=last - first)
+            del dist
+            _season_window(win, sim_doy[start:stop], arc_doy[first:last], seasonwin)
+            tile_idx, tile_part = _smallest(win, min(ncand, last - first))
+            idx, part = _merge(idx, part, tile_idx + first, tile_part, ncand)
+
+        if ncand > nanalog:
+            part = _rerank(sim, arc, start, idx, part, timewin, distfun)
+            best, part = _smallest(part, nanalog)
+            idx = np.take_along_axis(idx, best, axis=1)
+        order = np.argsort(part, axis=1)
+        index[start:stop] = np.take_along_axis(idx, order, axis=1)
+        dists[start:stop] = np.take_along_axis(part, order, axis=1)
+
+    if calccor:
+        if arc_ranks is not None and arc_ranks.shape[1] != arc.shape[1]:
+            LOGGER.debug('archive ranks do not match the grid points used, ranks not used')
+            arc_ranks = None
+        cors = analog_correlations(sim, arc, index, arc_ranks=arc_ranks)
+
+    if np.isinf(dists).any():
+        LOGGER.warning('less than %s analogs found in seasonal window for some days', nanalog)
+
+    return Analogs(dates=list(sim_dates), index=index, analogs=arc_dates[index],
+                   distances=dists, correlations=cors)
+
+
+def find_analogs_batch(sims, arcs, sims_dates, arcs_dates,
+                       nanalog=20, seasonwin=30, timewin=1, distfun='rms',
+                       calccor=True, block=256, arcs_doy=None):
+    """
+    Searches the analogs of several simulations in several archives in one pass.
+    Each archive is prepared once and the distances of a block of simulation days
+    to all archives are calculated with one matrix product (except mahalanobis,
+    which depends on the archive statistics).
+
+    Grid points without values in any of the fields are skipped for all pairs.
+
+    :param sims: list of simulation fields (time, lat, lon) or (time, gridpoints)
+    :param arcs: list of archive fields on the same grid
+    :param sims_dates: list of the dates of the simulation fields
+    :param arcs_dates: list of the dates of the archive fields
+    :param nanalog: number of analogs to detect
+    :param seasonwin: number of days before and after the simulation day
+                      in which analogs are picked
+    :param timewin: number of days following the analog day the distance is averaged
+    :param distfun: distance function (see _DISTANCES_)
+    :param calccor: calculate rank correlation for analog fields (True/False)
+    :param block: number of simulation days processed at once
+    :param arcs_doy: list of the day of the year of the archive days (default: see dayofyear)
+
+    :return list: Analogs of each pair, result[i][j] for sims[i] in arcs[j]
+    """
+    if distfun not in _DISTANCES_:
+        raise Exception('distance function %s not known' % distfun)
+
+    shape = np.shape(arcs[0])[1:]
+    arcs = [_flatten(a) for a in arcs]
+    sims = [_flatten(a) for a in sims]
+    if distfun != 'S1':
+        valid = ~np.any([np.isnan(a).any(axis=0) for a in arcs + sims], axis=0)
+        arcs = [a[:, valid] for a in arcs]
+        sims = [a[:, valid] for a in sims]
+
+    sizes = [a.shape[0] for a in arcs]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    timewin = max(int(timewin), 1)
+    halo = timewin - 1
+    if arcs_doy is None:
+        arcs_doy = [dayofyear(d) for d in arcs_dates]
+
+    if distfun == 'mahalanobis':
+        preps = [_prepare(a, distfun) for a in arcs]
+    else:
+        # the archives are stacked, so a single matrix product serves all of them
+        preps = [_prepare(np.concatenate(arcs), distfun)]
+
+    results = []
+    for sim, sim_dates in zip(sims, sims_dates):
+        nsim = sim.shape[0]
+        sim_doy = dayofyear(sim_dates)
+        pairs = []
+        for j, narc in enumerate(sizes):
+            nan_j = int(min(nanalog, narc))
+            pairs.append((np.zeros((nsim, nan_j), dtype=int), np.zeros((nsim, nan_j))))
+
+        for start in range(0, nsim, block):
+            stop = min(start + block, nsim)
+            nrows = stop - start
+            rows = sim[start:min(stop + halo, nsim)]
+            if len(preps) == 1:
+                stacked = distances(rows, preps[0], distfun=distfun, shape=shape)
+                dist = [stacked[:, offsets[j]:offsets[j + 1]] for j in range(len(arcs))]
+            else:
+                dist = [distances(rows, prep, distfun=distfun, shape=shape) for prep in preps]
+
+            for j, (index, dists) in enumerate(pairs):
+                win = _time_window(dist[j], start, nrows, nsim, timewin)
+                _season_window(win, sim_doy[start:stop], arcs_doy[j], seasonwin)
+                idx, part = _smallest(win, index.shape[1])
+                order = np.argsort(part, axis=1)
+                index[start:stop] = np.take_along_axis(idx, order, axis=1)
+                dists[start:stop] = np.take_along_axis(part, order, axis=1)
+
+        result = []
+        for (index, dists), arc, arc_dates in zip(pairs, arcs, arcs_dates):
+            cors = analog_correlations(sim, arc, index) if calccor else None
+            if np.isinf(dists).any():
+                LOGGER.warning('less than %s analogs found in seasonal window for some days', nanalog)
+            result.append(Analogs(dates=list(sim_dates), index=index,
+                                  analogs=_date_array(arc_dates)[index],
+                                  distances=dists, correlations=cors))
+        results.append(result)
+    return results
+
+
+def reusable_days(previous, sim_dates, timewin=1):
+    """
+    finds the leading simulation days whose analogs were already searched in a
+    previous search with the same archive and settings. Days at the end of the
+    previous search are searched again, since their time window was incomplete.
+
+    :param previous: Analogs of the previous search
+    :param sim_dates: dates of the simulation fields
+    :param timewin: number of days following the analog day the distance is averaged
+
+    :return numpy.array: rows of the leading simulation days in the previous result
+    """
+    timewin = max(int(timewin), 1)
+    position = dict((d, i) for i, d in enumerate(date_ints(previous.dates)))
+    nprev = len(position)
+    dates = date_ints(sim_dates)
+    rows = []
+    for i, d in enumerate(dates):
+        row = position.get(d)
+        if row is None or row + timewin > nprev or i + timewin > len(dates):
+            break
+        if rows and row != rows[-1] + 1:
+            break
+        rows.append(row)
+    return np.array(rows, dtype=int)
+
+
+def concat_analogs(results):
+    """
+    concatenates the results of searches for consecutive simulation periods
+
+    :param results: list of Analogs
+
+    :return Analogs: result for all simulation days (dates as integers YYYYMMDD)
+    """
+    cors = [r.correlations for r in results]
+    if any(c is None for c in cors):
+        cors = None
+    else:
+        cors = np.concatenate(cors)
+    analogs = [date_ints(r.analogs.ravel()).reshape(r.analogs.shape) for r in results]
+    return Analogs(dates=np.concatenate([date_ints(r.dates) for r in results]),
+                   index=np.concatenate([r.index for r in results]),
+                   analogs=np.concatenate(analogs),
+                   distances=np.concatenate([r.distances for r in results]),
+                   correlations=cors)
+
+
+def take_days(result, rows):
+    """
+    returns the result for a selection of simulation days
+
+    :param result: Analogs
+    :param rows: rows of the simulation days
+
+    :return Analogs: result for the selected days
+    """
+    return Analogs(dates=date_ints(result.dates)[rows], index=result.index[rows],
+                   analogs=result.analogs[rows], distances=result.distances[rows],
+                   correlations=result.correlations[rows] if result.correlations is not None else None)
+
+
+def write_analogs(result, output_file='output.txt', binary=False):
+    """
+    writes the analogs as multi-column text file in the format of CASTf90
+
+    :param result: Analogs as returned by find_analogs
+    :param output_file: name of the text file
+    :param binary: if True, the analogs are also written in the binary format (see save_analogs)
+                   after the text file, so load_analogs reads the binary file
+
+    :return str: output_file
+    """
+    nanalog = result.index.shape[1]
+    cors = result.correlations
+    if cors is None:
+        cors = np.full(result.distances.shape, np.nan)
+
+    dates = date_ints(result.dates)
+    analogs = date_ints(result.analogs.ravel()).reshape(result.analogs.shape)
+
+    with open(output_file, 'w') as fp:
+        header = ['date'] + ['dateAnlg%s' % (i + 1) for i in range(nanalog)] + \
+            ['dis%s' % (i + 1) for i in range(nanalog)] + ['cor%s' % (i + 1) for i in range(nanalog)]
+        fp.write(' '.join(header) + '\n')
+        for i, date in enumerate(dates):
+            line = ['%08d' % date] + ['%08d' % d for d in analogs[i]] + \
+                ['%.6f' % d for d in result.distances[i]] + ['%.6f' % c for c in cors[i]]
+            fp.write(' '.join(line) + '\n')
+    if binary:
+        save_analogs(result, binary_file(output_file))
+    return output_file
+
+
+def binary_file(output_file):
+    """
+    returns the name of the binary analogs file belonging to a text analogs file
+    """
+    return os.path.splitext(output_file)[0] + '.npz'
+
+
+def save_analogs(result, filename):
+    """
+    writes the analogs in the compact binary format: dates as int32 YYYYMMDD,
+    distances and correlations as float32 (nsim, nanalog)
+
+    :param result: Analogs as returned by find_analogs
+    :param filename: name of the .npz file
+
+    :return str: filename
+    """
+    cors = result.correlations
+    if cors is None:
+        cors = np.full(np.shape(result.distances), np.nan)
+    with open(filename, 'wb') as fp:
+        np.savez(fp,
+                 dates=date_ints(result.dates),
+                 analogs=date_ints(np.ravel(result.analogs)).reshape(np.shape(result.analogs)),
+                 distances=np.asarray(result.distances, dtype=np.float32),
+                 correlations=np.asarray(cors, dtype=np.float32))
+    return filename
+
+
+def load_analogs(filename):
+    """
+    reads analogs from the binary format (see save_analogs) or from the multi-column
+    text format of CASTf90. For a text file, the binary file of the same name is read
+    instead, if it exists and is not older.
+
+    :param filename: analogs file (.npz or text)
+
+    :return Analogs: analogs with dates as integers YYYYMMDD (index is None)
+    """
+    npz_file = binary_file(filename)
+    if not filename.endswith('.npz') and os.path.exists(npz_file) \
+            and os.path.getmtime(npz_file) >= os.path.getmtime(filename):
+        filename = npz_file
+
+    if filename.endswith('.npz'):
+        with np.load(filename) as npz:
+            return Analogs(dates=npz['dates'], index=None, analogs=npz['analogs'],
+                           distances=npz['distances'], correlations=npz['correlations'])
+
+    table = np.atleast_2d(np.loadtxt(filename, skiprows=1))
+    nanalog = (table.shape[1] - 1) // 3
+    return Analogs(dates=table[:, 0].astype(np.int32), index=None,
+                   analogs=table[:, 1:1 + nanalog].astype(np.int32),
+                   distances=table[:, 1 + nanalog:1 + 2 * nanalog],
+                   correlations=table[:, 1 + 2 * nanalog:1 + 3 * nanalog])
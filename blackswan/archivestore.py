@@ -0,0 +1,299 @@
+import os
+import hashlib
+import pickle
+import uuid
+
+import numpy as np
+
+from collections import namedtuple
+
+from blackswan import config
+from blackswan.cachemanager import prune, touch
+from blackswan.analogsearch import Analogs, EOFBasis, dayofyear
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+Archive = namedtuple('Archive', ['data', 'dates', 'lat', 'lon', 'cycle', 'doy', 'ranks'])
+Archive.__new__.__defaults__ = (None, None)
+Archive.__doc__ = """
+Prepared reference archive for the analogs search.
+
+data: normalized fields as float32 (time, lat, lon)
+dates: dates as integers YYYYMMDD (time)
+lat: latitudes
+lon: longitudes
+cycle: smoothed seasonal cycle (366, gridpoints) removed from the data or None
+doy: day of the year in the calendar of the archive (time), see analogsearch.dayofyear
+ranks: ranks of the fields at the grid points with values (time, gridpoints) or None,
+       see analogsearch.field_ranks
+"""
+
+
+def archive_key(dataset, variable, level, bbox, period, normalize):
+    """
+    returns the key of a prepared archive in the store
+
+    :param dataset: reanalyses dataset (e.g. 'NCEP' or '20CRV2c_day')
+    :param variable: variable name
+    :param level: vertical level or None
+    :param bbox: bounding box [min_lon, min_lat, max_lon, max_lat]
+    :param period: [start, end] dates of the reference period
+    :param normalize: normalization method ('None', 'base', ...)
+
+    :return str: key
+    """
+    period = [p.isoformat().strip().split("T")[0] for p in period]
+    bbox = ['%.2f' % float(b) for b in bbox]
+    desc = '%s|%s|%s|%s|%s|%s' % (dataset, variable, level, ','.join(bbox), '_'.join(period), normalize)
+    return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+
+def search_key(key, nanalog, seasonwin, timewin, distfun, *options):
+    """
+    returns the key of the analogs search results of a prepared archive in the store
+
+    :param key: archive key (see archive_key)
+    :param nanalog: number of analogs
+    :param seasonwin: seasonal window
+    :param timewin: time window
+    :param distfun: distance function
+    :param options: further settings changing the result (e.g. EOF variance)
+
+    :return str: key
+    """
+    desc = '|'.join(str(p) for p in (key, nanalog, seasonwin, timewin, distfun) + options)
+    return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+
+def covers_period(archive, period):
+    """
+    checks that a prepared archive covers the reference period without missing
+    years (e.g. of a failed download), before it is stored for the period
+
+    :param archive: Archive
+    :param period: [start, end] dates of the reference period
+
+    :return bool: True if the archive is complete
+    """
+    start, end = [int(p.isoformat().strip().split("T")[0].replace('-', '')) for p in period]
+    dates = np.asarray(archive.dates)
+    if dates.size == 0 or dates.min() > start or dates.max() < end:
+        return False
+    years = np.unique(dates[(dates >= start) & (dates <= end)] // 10000)
+    return len(years) == end // 10000 - start // 10000 + 1
+
+
+def store_path():
+    """
+    returns the directory of the archive store in the cache
+    """
+    return os.path.join(config.cache_path(), 'analogs_archive')
+
+
+def archive_path(key):
+    return os.path.join(store_path(), '%s.npz' % key)
+
+
+def load_archive(key):
+    """
+    loads a prepared archive from the store
+
+    :param key: archive key (see archive_key)
+
+    :return Archive: prepared archive or None if not in the store
+    """
+    filename = archive_path(key)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as npz:
+            cycle = npz['cycle']
+            dates = npz['dates']
+            doy = npz['doy'] if 'doy' in npz.files else dayofyear(dates)
+            ranks = npz['ranks'] if 'ranks' in npz.files else None
+            archive = Archive(data=npz['data'], dates=dates, lat=npz['lat'], lon=npz['lon'],
+                              cycle=cycle if cycle.size > 0 else None, doy=doy, ranks=ranks)
+        LOGGER.info('archive %s loaded from store', key)
+        touch(filename)
+    except Exception:
+        LOGGER.exception('failed to load archive %s from store', key)
+        archive = None
+    return archive
+
+
+def _write_npz(filename, **arrays):
+    """
+    writes arrays to a .npz file in the store
+    """
+    directory = store_path()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    # write to a temporary file first, so concurrent requests never read a partial file
+    tmp_file = os.path.join(directory, '%s.npz' % uuid.uuid1())
+    np.savez(tmp_file, **arrays)
+    os.rename(tmp_file, filename)
+    return filename
+
+
+def store_archive(key, archive):
+    """
+    writes a prepared archive to the store
+
+    :param key: archive key (see archive_key)
+    :param archive: Archive
+
+    :return str: path to the stored archive
+    """
+    cycle = archive.cycle if archive.cycle is not None else np.zeros(0)
+    ranks = {'ranks': archive.ranks} if archive.ranks is not None else {}
+    filename = _write_npz(archive_path(key),
+                          data=np.asarray(archive.data, dtype=np.float32),
+                          dates=np.asarray(archive.dates, dtype=np.int32),
+                          lat=np.asarray(archive.lat), lon=np.asarray(archive.lon),
+                          cycle=np.asarray(cycle, dtype=np.float32),
+                          doy=np.asarray(archive.doy if archive.doy is not None else dayofyear(archive.dates),
+                                         dtype=np.int16),
+                          **ranks)
+    LOGGER.info('archive %s stored: %s', key, filename)
+    prune(keep=[filename])
+    return filename
+
+
+def basis_path(key, variance):
+    return os.path.join(store_path(), '%s_eof%03d.npz' % (key, int(round(variance * 1000))))
+
+
+def load_basis(key, variance):
+    """
+    loads the EOF basis of a prepared archive from the store
+
+    :param key: archive key (see archive_key)
+    :param variance: retained variance of the EOF basis
+
+    :return EOFBasis: EOF basis or None if not in the store
+    """
+    filename = basis_path(key, variance)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as npz:
+            basis = EOFBasis(mean=npz['mean'], eofs=npz['eofs'], pcs=npz['pcs'], valid=npz['valid'])
+        LOGGER.info('EOF basis of archive %s loaded from store', key)
+        touch(filename)
+    except Exception:
+        LOGGER.exception('failed to load EOF basis of archive %s from store', key)
+        basis = None
+    return basis
+
+
+def store_basis(key, variance, basis):
+    """
+    writes the EOF basis of a prepared archive to the store
+
+    :param key: archive key (see archive_key)
+    :param variance: retained variance of the EOF basis
+    :param basis: EOFBasis (see blackswan.analogsearch.eof_basis)
+
+    :return str: path to the stored basis
+    """
+    filename = _write_npz(basis_path(key, variance),
+                          mean=basis.mean, eofs=basis.eofs, pcs=basis.pcs, valid=basis.valid)
+    LOGGER.info('EOF basis of archive %s stored: %s', key, filename)
+    return filename
+
+
+def index_path(key, variance):
+    return os.path.join(store_path(), '%s_eof%03d_index.pkl' % (key, int(round(variance * 1000))))
+
+
+def load_index(key, variance):
+    """
+    loads the nearest neighbour index of a prepared archive from the store
+
+    :param key: archive key (see archive_key)
+    :param variance: retained variance of the EOF basis the index is built on
+
+    :return AnalogIndex: index or None if not in the store
+    """
+    filename = index_path(key, variance)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as fp:
+            index = pickle.load(fp)
+        LOGGER.info('analogs index of archive %s loaded from store', key)
+        touch(filename)
+    except Exception:
+        LOGGER.exception('failed to load analogs index of archive %s from store', key)
+        index = None
+    return index
+
+
+def store_index(key, variance, index):
+    """
+    writes the nearest neighbour index of a prepared archive to the store
+
+    :param key: archive key (see archive_key)
+    :param variance: retained variance of the EOF basis the index is built on
+    :param index: AnalogIndex (see blackswan.analogindex)
+
+    :return str: path to the stored index
+    """
+    directory = store_path()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    filename = index_path(key, variance)
+    tmp_file = os.path.join(directory, '%s.pkl' % uuid.uuid1())
+    with open(tmp_file, 'wb') as fp:
+        pickle.dump(index, fp, protocol=2)
+    os.rename(tmp_file, filename)
+    LOGGER.info('analogs index of archive %s stored: %s', key, filename)
+    return filename
+
+
+def result_path(key):
+    return os.path.join(store_path(), '%s_analogs.npz' % key)
+
+
+def load_result(key):
+    """
+    loads the analogs of a previous search from the store
+
+    :param key: search key (see search_key)
+
+    :return Analogs: analogs (dates as integers YYYYMMDD) or None if not in the store
+    """
+    filename = result_path(key)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as npz:
+            cors = npz['correlations']
+            result = Analogs(dates=npz['dates'], index=npz['index'], analogs=npz['analogs'],
+                             distances=npz['distances'], correlations=cors if cors.size > 0 else None)
+        LOGGER.info('analogs of search %s loaded from store', key)
+        touch(filename)
+    except Exception:
+        LOGGER.exception('failed to load analogs of search %s from store', key)
+        result = None
+    return result
+
+
+def store_result(key, result):
+    """
+    writes the analogs of a search to the store
+
+    :param key: search key (see search_key)
+    :param result: Analogs (see blackswan.analogsearch.find_analogs)
+
+    :return str: path to the stored analogs
+    """
+    from blackswan.analogsearch import date_ints
+
+    cors = result.correlations if result.correlations is not None else np.zeros(0)
+    analogs = date_ints(np.ravel(result.analogs)).reshape(np.shape(result.analogs))
+    filename = _write_npz(result_path(key), dates=date_ints(result.dates), index=result.index,
+                          analogs=analogs, distances=result.distances, correlations=cors)
+    LOGGER.info('analogs of search %s stored: %s', key, filename)
+    return filename
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import fnmatch
+
+from collections import namedtuple
+
+from blackswan import config
+from blackswan import catalogue
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# files of the cache manager and the catalogue, never evicted
+_OWN_FILES = ['pinned.json', 'catalogue.sqlite', 'catalogue.sqlite-journal']
+
+# sidecar files are evicted together with the file they belong to
+_SIDECARS = ['.http.json', '.part']
+
+CacheEntry = namedtuple('CacheEntry', ['name', 'files', 'size', 'accessed', 'pinned'])
+CacheEntry.__doc__ = """
+Cached file with its sidecar files.
+
+name: path relative to the cache path
+files: paths of the file and its sidecar files
+size: size of all files in bytes
+accessed: last access (or modification) time in seconds since the epoch
+pinned: True if the file is never evicted
+"""
+
+
+def parse_size(size):
+    """
+    converts a size given as number of bytes or with unit (e.g. '50gb') to bytes
+
+    :param size: size (int or str)
+
+    :return int: bytes
+    """
+    size = str(size).strip().lower()
+    factor = 1
+    for unit, value in [('kb', 1024), ('mb', 1024 ** 2), ('gb', 1024 ** 3), ('tb', 1024 ** 4)]:
+        if size.endswith(unit):
+            size, factor = size[:-len(unit)], value
+            break
+    return int(float(size) * factor)
+
+
+def _pins_path():
+    return os.path.join(config.cache_path(), 'pinned.json')
+
+
+def pinned():
+    """
+    returns the glob patterns of pinned files, configured (see config.cache_pinned)
+    and added with pin
+
+    :return list: patterns relative to the cache path
+    """
+    patterns = config.cache_pinned()
+    try:
+        with open(_pins_path()) as fp:
+            patterns.extend(p for p in json.load(fp) if p not in patterns)
+    except (IOError, OSError, ValueError):
+        pass
+    return patterns
+
+
+def _store_pins(patterns):
+    filename = _pins_path()
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    tmp_file = '%s.%s' % (filename, os.getpid())
+    with open(tmp_file, 'w') as fp:
+        json.dump(sorted(set(patterns)), fp)
+    os.rename(tmp_file, filename)
+
+
+def _own_pins():
+    try:
+        with open(_pins_path()) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def pin(pattern):
+    """
+    pins cached files, so they are never evicted
+
+    :param pattern: glob pattern relative to the cache path (e.g. 'www.esrl.noaa.gov/*/slp.2018.nc')
+    """
+    patterns = _own_pins()
+    if pattern not in patterns:
+        _store_pins(patterns + [pattern])
+        LOGGER.info('pinned in cache: %s', pattern)
+
+
+def unpin(pattern):
+    """
+    removes a pin added with pin (configured pins are kept)
+
+    :param pattern: glob pattern as given to pin
+    """
+    patterns = _own_pins()
+    if pattern in patterns:
+        _store_pins([p for p in patterns if p != pattern])
+        LOGGER.info('unpinned in cache: %s', pattern)
+
+
+def touch(path):
+    """
+    records the access of a cached file for the LRU eviction; the access time
+    is set explicitly, since file systems are often mounted with noatime or relatime.
+    The modification time is kept.
+
+    :param path: path to the cached file
+    """
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        LOGGER.debug('failed to record access of %s', path)
+
+
+def _name(filename):
+    # e.g. the validators of a partial download: file.nc.part.http.json
+    for suffix in _SIDECARS:
+        if filename.endswith(suffix):
+            return _name(filename[:-len(suffix)])
+    return filename
+
+
+def entries():
+    """
+    returns the files in the cache
+
+    :return list: CacheEntry of each file, least recently used first
+    """
+    root = config.cache_path()
+    patterns = pinned()
+    grouped = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for f in filenames:
+            path = os.path.join(dirpath, f)
+            name = os.path.relpath(_name(path), root)
+            if name in _OWN_FILES:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            grouped.setdefault(name, []).append((path, stat))
+
+    result = []
+    for name, files in grouped.items():
+        result.append(CacheEntry(name=name,
+                                 files=[path for path, stat in files],
+                                 size=sum(stat.st_size for path, stat in files),
+                                 accessed=max(max(stat.st_atime, stat.st_mtime) for path, stat in files),
+                                 pinned=any(fnmatch.fnmatch(name, p) for p in patterns)))
+    return sorted(result, key=lambda e: e.accessed)
+
+
+def usage():
+    """
+    returns the disk usage of the cache
+
+    :return tuple: size of all files, size of pinned files (bytes), number of files
+    """
+    cached = entries()
+    return sum(e.size for e in cached), sum(e.size for e in cached if e.pinned), len(cached)
+
+
+def prune(budget=None, grace=None, dry_run=False, keep=None):
+    """
+    evicts the least recently used files until the cache fits in the budget.
+    Pinned files and files used within the grace period are kept. The catalogue
+    entries of files which do not exist anymore are removed (see catalogue.prune).
+
+    Running processes do not hold a lock on their files: the files are touched
+    when they are fetched (see utils.download_files and datafetch.reanalyses),
+    and the grace period (config.cache_grace, 6 hours by default) is meant to
+    cover the longest process run after that. Prolong it for longer runs.
+
+    :param budget: size of the cache in bytes (default: config.cache_size, 0 for no limit)
+    :param grace: seconds after the last access a file is kept in any case
+                  (default: config.cache_grace)
+    :param dry_run: if True, only returns the files which would be evicted
+    :param keep: paths of cached files which are kept in any case (e.g. the files
+                 of the current request, which may be older than the grace period)
+
+    :return list: CacheEntry of the evicted files
+    """
+    if budget is None:
+        budget = config.cache_size()
+    if not budget:
+        if not dry_run:
+            catalogue.prune()
+        return []
+
+    if grace is None:
+        grace = config.cache_grace()
+
+    root = config.cache_path()
+    keep = set(os.path.relpath(path, root) for path in keep or [] if path is not None)
+    cached = entries()
+    total = sum(e.size for e in cached)
+    limit = time.time() - grace
+    evicted = []
+    for entry in cached:
+        if total <= budget:
+            break
+        if entry.pinned or entry.accessed > limit or entry.name in keep:
+            continue
+        if not dry_run:
+            try:
+                for path in entry.files:
+                    os.remove(path)
+            except OSError:
+                LOGGER.exception('failed to evict %s from cache', entry.name)
+                continue
+        total -= entry.size
+        evicted.append(entry)
+
+    if evicted:
+        LOGGER.info('%s files (%s bytes) evicted from cache, %s bytes left',
+                    len(evicted), sum(e.size for e in evicted), total)
+    if total > budget:
+        LOGGER.warning('cache exceeds budget of %s bytes with %s bytes', budget, total)
+    if not dry_run:
+        catalogue.prune()
+    return evicted
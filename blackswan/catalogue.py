@@ -0,0 +1,170 @@
+import os
+import json
+import sqlite3
+
+import numpy as np
+
+from blackswan import config
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+)
+"""
+
+
+def catalogue_path():
+    """
+    returns the path of the catalogue database in the cache
+    """
+    return os.path.join(config.cache_path(), 'catalogue.sqlite')
+
+
+def _connect():
+    filename = catalogue_path()
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    connection = sqlite3.connect(filename, timeout=30)
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def scan(path):
+    """
+    reads the metadata of a netCDF file
+
+    :param path: path to the netCDF file
+
+    :return dict: metadata with the keys
+                  variables (variable name: dimensions),
+                  variable (detected data variable, see utils.get_variable, or None),
+                  time_values, time_units and time_calendar (None if not given),
+                  coords (dimension name: coordinate values, e.g. lat, lon and levels)
+    """
+    from netCDF4 import Dataset
+
+    ds = Dataset(path)
+    try:
+        entry = {'variables': dict((name, list(var.dimensions)) for name, var in ds.variables.items()),
+                 'variable': None, 'time_values': None, 'time_units': None, 'time_calendar': None}
+        if 'time' in ds.variables:
+            time = ds.variables['time']
+            entry['time_values'] = np.ma.filled(time[:].astype(float), np.nan).tolist()
+            entry['time_units'] = getattr(time, 'units', None)
+            entry['time_calendar'] = getattr(time, 'calendar', None)
+        coords = {}
+        for name in ds.dimensions:
+            if name != 'time' and name in ds.variables and ds.variables[name].ndim == 1:
+                coords[name] = np.ma.filled(ds.variables[name][:].astype(float), np.nan).tolist()
+        entry['coords'] = coords
+    finally:
+        ds.close()
+    return entry
+
+
+def _key(path):
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def entry(path):
+    """
+    returns the metadata of a netCDF file from the catalogue, the file is
+    scanned and added if it is not in the catalogue or changed since
+
+    :param path: path to the netCDF file
+
+    :return dict: metadata (see scan) or None if the file can not be catalogued
+    """
+    try:
+        path, mtime, size = _key(path)
+        connection = _connect()
+        try:
+            row = connection.execute('SELECT mtime, size, metadata FROM files WHERE path = ?',
+                                     (path,)).fetchone()
+            if row is not None and row[0] == mtime and row[1] == size:
+                return json.loads(row[2])
+            metadata = scan(path)
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO files (path, mtime, size, metadata) VALUES (?, ?, ?, ?)',
+                                   (path, mtime, size, json.dumps(metadata)))
+            LOGGER.debug('file added to catalogue: %s', path)
+            return metadata
+        finally:
+            connection.close()
+    except Exception:
+        LOGGER.debug('file not catalogued: %s', path, exc_info=True)
+        return None
+
+
+def entries(resource):
+    """
+    returns the metadata of netCDF files from the catalogue
+
+    :param resource: netCDF file or list of files
+
+    :return list: metadata of the files (see scan) or None if a file can not be catalogued
+    """
+    if not isinstance(resource, list):
+        resource = [resource]
+    result = [entry(path) for path in resource]
+    if not result or any(e is None for e in result):
+        return None
+    return result
+
+
+def prune():
+    """
+    removes the entries of files which do not exist anymore
+    (e.g. evicted cache files or temporary files of requests)
+
+    :return int: number of removed entries
+    """
+    try:
+        connection = _connect()
+        try:
+            missing = [(row[0],) for row in connection.execute('SELECT path FROM files').fetchall()
+                       if not os.path.exists(row[0])]
+            if missing:
+                with connection:
+                    connection.executemany('DELETE FROM files WHERE path = ?', missing)
+                LOGGER.debug('%s entries of missing files removed from catalogue', len(missing))
+        finally:
+            connection.close()
+    except Exception:
+        LOGGER.debug('failed to prune catalogue', exc_info=True)
+        return 0
+    return len(missing)
+
+
+def update(path, **metadata):
+    """
+    adds metadata found by other means (e.g. the detected variable) to the
+    entry of a file in the catalogue
+
+    :param path: path to the netCDF file
+    :param metadata: metadata to add
+    """
+    current = entry(path)
+    if current is None:
+        return
+    current.update(metadata)
+    try:
+        path, mtime, size = _key(path)
+        connection = _connect()
+        try:
+            with connection:
+                connection.execute('UPDATE files SET metadata = ? WHERE path = ? AND mtime = ? AND size = ?',
+                                   (json.dumps(current), path, mtime, size))
+        finally:
+            connection.close()
+    except Exception:
+        LOGGER.debug('failed to update catalogue entry: %s', path, exc_info=True)
@@ -6,6 +6,7 @@
 ###########################################################
 
 import os
+import time
 import psutil
 import click
 from jinja2 import Environment, PackageLoader
@@ -73,6 +74,24 @@ def run_process_action(action=None):
     click.echo(msg)
 
 
+def _load_config(config=None):
+    cfgfiles = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
+    if config:
+        cfgfiles.append(config)
+    if 'PYWPS_CFG' in os.environ:
+        cfgfiles.append(os.environ['PYWPS_CFG'])
+    configuration.load_configuration(cfgfiles)
+
+
+def _format_size(size):
+    if size < 1024:
+        return "{} bytes".format(size)
+    for unit in ['KB', 'MB', 'GB', 'TB']:
+        size /= 1024.
+        if size < 1024 or unit == 'TB':
+            return "{:.1f} {}".format(size, unit)
+
+
 def _run(application, bind_host=None, daemon=False):
     from werkzeug.serving import run_simple
     # call this *after* app is initialized ... needs pywps config.
@@ -178,3 +197,62 @@ def start(config, bind_host, daemon, hostname, port,
     else:
         # no daemon
         _run(app, bind_host=bind_host)
+
+
+@cli.group()
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+def cache(config):
+    """Report and prune the cache of downloaded and derived data."""
+    _load_config(config)
+
+
+@cache.command()
+@click.option('--files', '-f', is_flag=True, help='list the cached files, least recently used first.')
+def usage(files):
+    """Show disk usage of the cache"""
+    from blackswan import cachemanager, config
+    if files:
+        for entry in cachemanager.entries():
+            click.echo("{} {:>12} {}{}".format(
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.accessed)),
+                _format_size(entry.size), entry.name, ' (pinned)' if entry.pinned else ''))
+    total, pinned, count = cachemanager.usage()
+    budget = config.cache_size()
+    click.echo("{}: {} in {} files, {} pinned, budget {}".format(
+        config.cache_path(), _format_size(total), count, _format_size(pinned),
+        _format_size(budget) if budget else 'unlimited'))
+
+
+@cache.command()
+@click.option('--budget', metavar='SIZE', default=None,
+              help='size of the cache in bytes or with unit, e.g. 50gb (default: cache_size in configuration).')
+@click.option('--grace', metavar='SECONDS', default=None, type=float,
+              help='keep files used within this time (default: cache_grace in configuration).')
+@click.option('--dry-run', '-n', is_flag=True, help='only show the files which would be evicted.')
+def prune(budget, grace, dry_run):
+    """Evict the least recently used files from the cache"""
+    from blackswan import cachemanager, config
+    budget = config.cache_size() if budget is None else cachemanager.parse_size(budget)
+    if not budget:
+        click.echo('No cache budget configured, nothing to prune.')
+        return
+    evicted = cachemanager.prune(budget=budget, grace=grace, dry_run=dry_run)
+    for entry in evicted:
+        click.echo("{} {:>12} {}".format('would evict' if dry_run else 'evicted', _format_size(entry.size), entry.name))
+    click.echo("{} files, {}".format(len(evicted), _format_size(sum(e.size for e in evicted))))
+
+
+@cache.command()
+@click.argument('pattern')
+def pin(pattern):
+    """Pin cached files (glob pattern relative to the cache path)"""
+    from blackswan import cachemanager
+    cachemanager.pin(pattern)
+
+
+@cache.command()
+@click.argument('pattern')
+def unpin(pattern):
+    """Remove a pin added with the pin command"""
+    from blackswan import cachemanager
+    cachemanager.unpin(pattern)
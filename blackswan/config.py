@@ -8,6 +8,65 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
+def analogs_eof_variance():
+    """
+    returns the variance retained by the EOFs of the archive for the reduced
+    analogs search of the Python engine (0 for search on full fields)
+    """
+    variance = configuration.get_config_value("extra", "analogs_eof_variance")
+    if not variance:
+        LOGGER.warn("No analogs EOF variance configured. Using default value.")
+        variance = 0
+    return float(variance)
+
+
+def analogs_index():
+    """
+    returns True if the analogs of the EOF reduced search are picked with a
+    nearest neighbour index of the archive
+    """
+    index = configuration.get_config_value("extra", "analogs_index")
+    if not index:
+        LOGGER.warn("No analogs index option configured. Using default value.")
+        index = False
+    return str(index).lower() in ['true', 'yes', '1']
+
+
+def analogs_rerank():
+    """
+    returns the number of candidates found on the EOFs, which are ranked
+    again with the distances of the full fields
+    """
+    rerank = configuration.get_config_value("extra", "analogs_rerank")
+    if not rerank:
+        LOGGER.warn("No analogs rerank option configured. Using default value.")
+        rerank = 0
+    return int(rerank)
+
+
+def analogs_workers():
+    """
+    returns the maximum number of analogs searches (CASTf90 calls) run concurrently
+    """
+    workers = configuration.get_config_value("extra", "analogs_workers")
+    if not workers:
+        LOGGER.warn("No analogs workers configured. Using default value.")
+        workers = 2
+    return int(workers)
+
+
+def cache_grace():
+    """
+    returns the time in seconds after the last access a cached file is never
+    evicted, which covers the longest process run using the file
+    """
+    grace = configuration.get_config_value("extra", "cache_grace")
+    if not grace:
+        LOGGER.warn("No cache grace configured. Using default value.")
+        grace = 21600
+    return float(grace)
+
+
 def cache_path():
     cache_path = configuration.get_config_value("cache", "cache_path")
     if not cache_path:
@@ -16,10 +75,64 @@ def cache_path():
     return cache_path
 
 
+def cache_pinned():
+    """
+    returns the glob patterns (relative to the cache path) of cached files
+    which are never evicted, e.g. 'www.esrl.noaa.gov/*/slp.2018.nc'
+    """
+    pinned = configuration.get_config_value("extra", "cache_pinned")
+    if not pinned:
+        LOGGER.warn("No pinned cache files configured. Using default value.")
+        pinned = ''
+    return [p.strip() for p in str(pinned).replace('\n', ',').split(',') if p.strip()]
+
+
+def cache_size():
+    """
+    returns the size budget of the cache in bytes (0 for no limit),
+    configured as number of bytes or with unit (e.g. '50gb')
+    """
+    size = configuration.get_config_value("extra", "cache_size")
+    if not size:
+        LOGGER.warn("No cache size configured. Using default value.")
+        size = 0
+    from blackswan.cachemanager import parse_size
+    return parse_size(size)
+
+
+def cache_ttl(dataset=None):
+    """
+    returns the time in seconds after which cached downloads (e.g. the current
+    year of a reanalyses dataset) are validated again with the server
+
+    :param dataset: dataset with its own setting (e.g. 'NCEP' for cache_ttl_NCEP)
+    """
+    ttl = None
+    if dataset:
+        ttl = configuration.get_config_value("extra", "cache_ttl_%s" % dataset)
+    if not ttl:
+        ttl = configuration.get_config_value("extra", "cache_ttl")
+    if not ttl:
+        LOGGER.warn("No cache ttl configured. Using default value.")
+        ttl = 86400
+    return float(ttl)
+
+
 def data_path():
     return os.path.join(_PATH, 'data')
 
 
+def download_workers():
+    """
+    returns the number of files downloaded concurrently (e.g. years of reanalyses data)
+    """
+    workers = configuration.get_config_value("extra", "download_workers")
+    if not workers:
+        LOGGER.warn("No download workers configured. Using default value.")
+        workers = 4
+    return int(workers)
+
+
 def esgfsearch_distrib():
     distrib = configuration.get_config_value("extra", "esgfsearch_distrib")
     if distrib is None:
@@ -36,6 +149,18 @@ def esgfsearch_url():
     return url
 
 
+def localdims_threads():
+    """
+    returns the number of BLAS threads of the local dimensions calculation
+    (0 for the number of CPUs)
+    """
+    threads = configuration.get_config_value("extra", "localdims_threads")
+    if not threads:
+        LOGGER.warn("No local dimensions threads configured. Using default value.")
+        threads = 0
+    return int(threads)
+
+
 def masks_path():
     # TODO: currently this folder is not used
     return os.path.join(data_path(), 'masks')
@@ -56,10 +181,6 @@ def output_url():
     return url
 
 
-def Rsrc_dir():
-    return os.path.join(_PATH, 'Rsrc')
-
-
 def shapefiles_path():
     return os.path.join(data_path(), 'shapefiles')
 
@@ -1,4 +1,5 @@
-from blackswan.utils import download
+from blackswan.utils import download_files
+from blackswan.cachemanager import touch
 from datetime import datetime as dt
 from datetime import timedelta
 
@@ -81,6 +82,54 @@ _PRESSUREDATA_ = [
 #  ],
 #
 
+def reanalyses_url(year, variable='slp', dataset='NCEP', timres='day'):
+    """
+    returns the URL of the reanalysis data file of a year
+
+    :param year: year
+    :param variable: variable name (default='slp'), geopotential height is given as e.g. z700
+    :param dataset: default='NCEP'
+    :param timres: time resolution ('day' or '6h', for 20CR)
+
+    :return str: URL or None if the dataset or variable is not known
+    """
+    url = None
+    if dataset == 'NCEP':
+        if variable == 'slp':
+            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/surface/%s.%s.nc' % (variable, year)  # noqa
+        if variable == 'pr_wtr':
+            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/surface/pr_wtr.eatm.%s.nc' % (year)  # noqa
+        if 'z' in variable:
+            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/pressure/hgt.%s.nc' % (year)  # noqa
+    elif dataset == '20CRV2':
+        if variable == 'prmsl':
+            if timres == '6h':
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/monolevel/prmsl.%s.nc' % year  # noqa
+            else:
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/Dailies/monolevel/prmsl.%s.nc' % year  # noqa
+        if 'z' in variable:
+            if timres == '6h':
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/pressure/hgt.%s.nc' % (year)  # noqa
+            else:
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/Dailies/pressure/hgt.%s.nc' % (year)  # noqa
+    elif dataset == '20CRV2c':
+        if variable == 'prmsl':
+            if timres == '6h':
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/monolevel/prmsl.%s.nc' % year  # noqa
+            else:
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/Dailies/monolevel/prmsl.%s.nc' % year  # noqa
+        if 'z' in variable:
+            if timres == '6h':
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/pressure/hgt.%s.nc' % (year)  # noqa
+            else:
+                url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/Dailies/pressure/hgt.%s.nc' % (year)  # noqa
+    else:
+        LOGGER.debug('Dataset %s not known' % dataset)
+    if url is None:
+        LOGGER.debug('no url for %s %s' % (dataset, variable))
+    return url
+
+
 def reanalyses(start=1948, end=None, variable='slp', dataset='NCEP', timres='day', getlevel=True):
     """
     Fetches the reanalysis data (NCEP, 20CR or ERA_20C) to local file system
@@ -92,7 +141,7 @@ def reanalyses(start=1948, end=None, variable='slp', dataset='NCEP', timres='day
     """
     # used for NETCDF convertion
     from netCDF4 import Dataset
-    from os import path, system, remove
+    from os import path, system
     from blackswan.ocgis_module import call
     from shutil import move
     # used for NETCDF convertion
@@ -120,98 +169,59 @@ def reanalyses(start=1948, end=None, variable='slp', dataset='NCEP', timres='day
         level = None
 
     LOGGER.info('level: %s' % level)
-    cur_year = dt.now().year
-    cur_month = dt.now().month
-    cur_day = dt.now().day
     try:
+        from calendar import timegm
+        from blackswan import config
+
+        urls = []
+        finals = []
         for year in range(start, end + 1):
-            LOGGER.debug('fetching single file for %s year %s ' % (dataset, year))
+            url = reanalyses_url(year, variable=variable, dataset=dataset, timres=timres)
+            if url is None:
+                continue
+            urls.append(url)
+            # a year changes on the server until its end, files checked after it are never validated again
+            finals.append(timegm((year + 1, 1, 1, 0, 0, 0)))
+
+        # the years are downloaded (or validated in the cache) concurrently
+        files = download_files(urls, cache=True, ttl=config.cache_ttl(dataset), final=finals)
+        failed = [url for url, df in zip(urls, files) if df is None]
+        if failed:
+            raise Exception('failed to download %s of %s years: %s' % (len(failed), len(urls), ', '.join(failed)))
+
+        for url, df in zip(urls, files):
+            LOGGER.debug('single file fetched %s ' % url)
+            # convert to NETCDF4_CLASSIC
             try:
-                if dataset == 'NCEP':
-                    if variable == 'slp':
-                        url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/surface/%s.%s.nc' % (variable, year)  # noqa
-                    if variable == 'pr_wtr':
-                        url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/surface/pr_wtr.eatm.%s.nc' % (year)  # noqa
-                    if 'z' in variable:
-                        url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/ncep.reanalysis.dailyavgs/pressure/hgt.%s.nc' % (year)  # noqa
-                elif dataset == '20CRV2':
-                    if variable == 'prmsl':
-                        if timres == '6h':
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/monolevel/prmsl.%s.nc' % year  # noqa
-                        else:
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/Dailies/monolevel/prmsl.%s.nc' % year  # noqa
-                    if 'z' in variable:
-                        if timres == '6h':
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/pressure/hgt.%s.nc' % (year)  # noqa
-                        else:
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2/Dailies/pressure/hgt.%s.nc' % (year)  # noqa
-                elif dataset == '20CRV2c':
-                    if variable == 'prmsl':
-                        if timres == '6h':
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/monolevel/prmsl.%s.nc' % year  # noqa
-                        else:
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/Dailies/monolevel/prmsl.%s.nc' % year  # noqa
-                    if 'z' in variable:
-                        if timres == '6h':
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/pressure/hgt.%s.nc' % (year)  # noqa
-                        else:
-                            url = 'https://www.esrl.noaa.gov/psd/thredds/fileServer/Datasets/20thC_ReanV2c/Dailies/pressure/hgt.%s.nc' % (year)  # noqa
+                ds = Dataset(df)
+                df_time = ds.variables['time']
+                # Here, need to check not just calendar, but that file is ncdf_classic already...
+                if (hasattr(df_time, 'calendar')) is False:
+                    p, f = path.split(path.abspath(df))
+                    LOGGER.debug("path = %s , file %s " % (p, f))
+                    # May be an issue if several users are working at the same time
+                    move(df, f)
+                    conv = call(resource=f,
+                                output_format_options={'data_model': 'NETCDF4_CLASSIC'},
+                                dir_output=p,
+                                prefix=f.replace('.nc', ''))
+                    obs_data.append(conv)
+                    LOGGER.debug('file %s to NETCDF4_CLASSIC converted' % conv)
+                    # Cleaning, could be 50gb... for each (!) user
+                    # TODO Check how links work
+                    cmdrm = 'rm -f %s' % (f)
+                    system(cmdrm)
                 else:
-                    LOGGER.debug('Dataset %s not known' % dataset)
-                LOGGER.debug('url: %s' % url)
+                    obs_data.append(df)
+                ds.close()
             except:
-                msg = "could not set url"
-                LOGGER.exception(msg)
-            try:
-                # force updating of the current year dataset
-                if year == cur_year:
-                    # import urlparse
-                    from blackswan import config
-                    # parsed_url = urlparse.urlparse(url)
-                    parsed_url = urlparse(url)
-                    cur_filename = path.join(config.cache_path(), parsed_url.netloc, parsed_url.path.strip('/'))
-                    if path.exists(cur_filename):
-                        fn_time = dt.fromtimestamp(path.getmtime(cur_filename))
-                        LOGGER.debug('Rean data for %s year creation time: %s' % (year, fn_time))
-                        if (fn_time.year == cur_year) and (fn_time.month == cur_month) and (fn_time.day == cur_day):
-                            LOGGER.debug('Rean data for %s year is up-to-date' % year)
-                        else:
-                            LOGGER.debug('Rean data for %s year forced to update' % year)
-                            remove(cur_filename)
-                # ###########################################
-                df = download(url, cache=True)
-                LOGGER.debug('single file fetched %s ' % year)
-                # convert to NETCDF4_CLASSIC
-                try:
-                    ds = Dataset(df)
-                    df_time = ds.variables['time']
-                    # Here, need to check not just calendar, but that file is ncdf_classic already...
-                    if (hasattr(df_time, 'calendar')) is False:
-                        p, f = path.split(path.abspath(df))
-                        LOGGER.debug("path = %s , file %s " % (p, f))
-                        # May be an issue if several users are working at the same time
-                        move(df, f)
-                        conv = call(resource=f,
-                                    output_format_options={'data_model': 'NETCDF4_CLASSIC'},
-                                    dir_output=p,
-                                    prefix=f.replace('.nc', ''))
-                        obs_data.append(conv)
-                        LOGGER.debug('file %s to NETCDF4_CLASSIC converted' % conv)
-                        # Cleaning, could be 50gb... for each (!) user
-                        # TODO Check how links work
-                        cmdrm = 'rm -f %s' % (f)
-                        system(cmdrm)
-                    else:
-                        obs_data.append(df)
-                    ds.close()
-                except:
-                    LOGGER.exception('failed to convert into NETCDF4_CLASSIC')
-            except:
-                msg = "download failed on {0}.".format(url)
-                LOGGER.exception(msg)
+                LOGGER.exception('failed to convert into NETCDF4_CLASSIC')
+        # the conversion may take long, the files are protected by the grace period of the cache from now on
+        for f in obs_data:
+            touch(f)
         LOGGER.info('Reanalyses data fetched for %s files' % len(obs_data))
-    except:
-        msg = "get reanalyses module failed to fetch data"
+    except Exception as e:
+        msg = "get reanalyses module failed to fetch data: %s" % e
         LOGGER.exception(msg)
         raise Exception(msg)
 
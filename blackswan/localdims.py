@@ -1,122 +1,512 @@
+import os
+import hashlib
+import uuid
+import warnings
+
 import numpy as np
 
-from os import environ
+from collections import namedtuple
+from contextlib import contextmanager
 
 from scipy.spatial.distance import cdist
-from scipy.stats.mstats import mquantiles
 
+from blackswan import config
+from blackswan.cachemanager import touch
 from blackswan.utils import get_values, get_index_lat, get_index_lon, get_variable
 
 import ctypes
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 
-def _calc_dist(sp_vector):
-    _distance = cdist(sp_vector, glob_dat, metric=glob_distance) 
-    _logdista = -np.log(_distance)
-    _x = _logdista[~np.isinf(_logdista)]
-    _logdista = _x[~np.isnan(_x)]
-    _thresh = mquantiles(_logdista, glob_quanti, alphap=glob_abal, betap=glob_abal)
-    # NOT ORIGINAL
-    _logdista = -np.log(_distance)[0]
-    
-    _Li = [i for i in range(len(_logdista)) if (_logdista[i] > _thresh)and(_logdista[i]<0)]
-    _Ti = np.diff(_Li)
-    _N = len(_Ti)
-    _q = 1.-glob_quanti
-    _Si = _Ti-1
-    _Ncc = [i for i in range(len(_Si)) if (_Si[i] > 0)]
-    _Nc = len(_Ncc)
+import logging
+LOGGER = logging.getLogger("PYWPS")
 
-    _theta = (sum(_q*_Si)+_N+_Nc-np.sqrt(((sum(_q*_Si)+_N+_Nc)**2)-8*_Nc*sum(_q*_Si)))/(2*sum(_q*_Si))
-    _logdista = np.sort(_logdista)
 
-    _findidx = [i for i in range(len(_logdista)) if (_logdista[i] > _thresh)and(_logdista[i]<0)]
+def _thresholds(logdista, quanti, ap):
+    """
+    Quantiles of the finite values of each column as calculated by
+    scipy.stats.mstats.mquantiles(alphap=ap, betap=ap), with one partial sort
+    for all quantiles.
 
-    _logextr = _logdista[_findidx[0]:len(_logdista)-1]
-    _dim = 1/np.mean(_logextr-_thresh)
+    :param logdista: negative log-distances (N, columns)
+    :param quanti: quantiles (quantiles)
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
 
-    return _dim, _theta
+    :return array: thresholds (quantiles, columns)
+    """
+    quanti = np.atleast_1d(quanti).astype(float)
+    finite = np.isfinite(logdista)
+    nfinite = finite.sum(axis=0)
+    values = np.where(finite, logdista, np.inf)
+    thresh = np.full((len(quanti), logdista.shape[1]), np.nan)
+    m = ap + quanti * (1. - ap - ap)
+
+    # columns with the same number of finite values share the order statistics
+    for nf in np.unique(nfinite):
+        cols = np.flatnonzero(nfinite == nf)
+        if nf == 0:
+            continue
+        elif nf == 1:
+            thresh[:, cols] = values[:, cols].min(axis=0)
+            continue
+        aleph = nf * quanti + m
+        k = np.floor(np.clip(aleph, 1, nf - 1)).astype(int)
+        gamma = np.clip(aleph - k, 0, 1)[:, None]
+        part = np.partition(values[:, cols], np.unique(np.concatenate([k - 1, k])), axis=0)
+        thresh[:, cols] = (1. - gamma) * part[k - 1] + gamma * part[k]
+    return thresh
+
+
+def _dim_theta(dist, quanti=0.98, ap=0.5, insample=True):
+    """
+    Local dimensions and persistence (extremal index) of the points of the
+    columns of a distance matrix. Vectorized version of the loop in localdims
+    giving the same results.
+
+    :param dist: distances of all points (N) to the points of interest (N, columns)
+    :param quanti: quantile defining the recurrences or list of quantiles
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
+    :param insample: True if the points of interest are part of the series, their
+                     distance to themselves is then not counted as recurrence.
+                     False for new points, which use all exceedances.
+
+    :return 2 arrays: local dimensions and persistence (columns),
+                      or (quantiles, columns) for a list of quantiles
+    """
+    npoints = dist.shape[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logdista = -np.log(dist)
+    thresholds = _thresholds(logdista, quanti, ap)
+
+    rows = np.arange(npoints)[:, None]
+    nnan = np.isnan(logdista).sum(axis=0)
+    ninf = np.isposinf(logdista).sum(axis=0)
+    finite = np.isfinite(logdista)
+    with np.errstate(invalid='ignore'):
+        negative = logdista < 0
+
+    dim = np.empty(thresholds.shape)
+    theta = np.empty(thresholds.shape)
+    for i, thresh in enumerate(thresholds):
+        with np.errstate(invalid='ignore'):
+            above = logdista > thresh
+        exceed = above & negative
+
+        # persistence from the gaps between the exceedances
+        nexceed = exceed.sum(axis=0)
+        first = np.where(exceed, rows, npoints).min(axis=0)
+        last = np.where(exceed, rows, -1).max(axis=0)
+        adjacent = (exceed[1:] & exceed[:-1]).sum(axis=0)
+        N = np.maximum(nexceed - 1, 0)
+        Nc = N - adjacent
+        q = 1. - np.atleast_1d(quanti)[i]
+        S = np.where(nexceed > 0, q * ((last - first) - N), 0.)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            theta[i] = (S + N + Nc - np.sqrt(((S + N + Nc) ** 2) - 8 * Nc * S)) / (2 * S)
+
+        # mean excess of the sorted log-distances above the threshold,
+        # without the largest value (the point itself)
+        finite_above = above & finite
+        count = finite_above.sum(axis=0)
+        excess = np.where(finite_above, logdista - thresh, 0.).sum(axis=0)
+        largest = np.where(finite_above, logdista, -np.inf).max(axis=0)
+
+        # nan and inf sort last: one of them takes the place of the largest value
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if insample:
+                mean = np.select([nnan > 1, nnan + ninf > 1, nnan + ninf == 1],
+                                 [np.nan, np.inf, excess / count],
+                                 (excess - (largest - thresh)) / (count - 1))
+            else:
+                mean = np.select([nnan > 0, ninf > 0], [np.nan, np.inf], excess / count)
+            dim[i] = 1. / mean
+        # no exceedance at all
+        dim[i, nexceed == 0] = np.nan
+
+    if np.ndim(quanti) == 0:
+        return dim[0], theta[0]
+    return dim, theta
 
 
-def localdims_par(resource, ap=0.5, variable=None, distance='euclidean'):
+def slab_size(npoints, memory=None, fraction=0.25):
     """
-    calculating of a local dimentions and persistence
+    returns the number of reference points processed at once, so that the
+    distances of a slab against the whole series and the temporary arrays of
+    the reduction fit in the available memory
 
-    :param resource: str or list of str containing the netCDF file path
+    :param npoints: number of points of the series
+    :param memory: memory for a slab in bytes (default: fraction of the available memory)
+    :param fraction: fraction of the available memory used for a slab
+
+    :return int: number of reference points
+    """
+    if memory is None:
+        import psutil
+        memory = psutil.virtual_memory().available * fraction
+    # distances, log-distances and about eight temporaries of the same size
+    return int(min(max(memory // (npoints * 8 * 10), 1), npoints))
 
-    :return 2 arrays: local dimentions and persistence
+
+@contextmanager
+def blas_threads(threads=None):
     """
+    limits the number of threads of the BLAS library while the context is active
+
+    :param threads: number of threads (0: number of CPUs, None: library default)
 
-    # ===================================================
-    # only for linux
+    :return: context manager
+    """
+    if threads is None:
+        yield None
+        return
+    threads = int(threads) if threads > 0 else cpu_count()
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        threadpool_limits = None
+    if threadpool_limits is not None:
+        with threadpool_limits(limits=threads, user_api='blas'):
+            yield threads
+        return
+    # without threadpoolctl only MKL can be set
     try:
         mkl_rt = ctypes.CDLL('libmkl_rt.so')
-        nth = mkl_rt.mkl_get_max_threads()
-        mkl_rt.mkl_set_num_threads(ctypes.byref(ctypes.c_int(64)))
-        nth = mkl_rt.mkl_get_max_threads()
-        environ['MKL_NUM_THREADS'] = str(nth)
-        environ['OMP_NUM_THREADS'] = str(nth)
-    except:
-        pass
-    # ================================================================
+        previous = mkl_rt.mkl_get_max_threads()
+        mkl_rt.mkl_set_num_threads(ctypes.byref(ctypes.c_int(threads)))
+    except Exception as e:
+        LOGGER.debug('Failed to set BLAS threads: %s', e)
+        yield None
+        return
+    try:
+        yield threads
+    finally:
+        mkl_rt.mkl_set_num_threads(ctypes.byref(ctypes.c_int(previous)))
 
-    if variable is None:
-        variable = get_variable(resource)
 
-    data = get_values(resource, variable=variable)
+def _series(dat, distance, dtype=np.float64, center=None):
+    """
+    returns the series prepared for the distance kernel and, for euclidean
+    distances, the squared norms of its points
+    """
+    x = np.asarray(dat, dtype=dtype)
+    if distance != 'euclidean':
+        return x, None
+    # centered points keep the rounding errors of the Gram matrix small
+    if center is None:
+        center = _center(x)
+    x = x - center.astype(x.dtype)
+    return x, np.einsum('ij,ij->i', x, x)
 
-    lat_index = get_index_lat(resource, variable=variable)
-    lon_index = get_index_lon(resource, variable=variable)
 
-    # TODO: should be 3D with TIME first.
-    # Think how to operate with 4D and unknown stucture (lat,lon,level,time) for expample.
+def _center(x):
+    """
+    mean of the points of a series, ignoring missing values
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        center = np.nanmean(x, axis=0)
+    center[np.isnan(center)] = 0
+    return center
 
-    # dat=data.reshape((data.shape[0],data.shape[1]*data.shape[2]))
-    global glob_dat
-    glob_dat=data.reshape((data.shape[0],data.shape[lat_index]*data.shape[lon_index]))
 
-    # Quantile definition
-    global glob_quanti
-    glob_quanti=0.98
+def _cross_distances(x, norms, y, y_norms, distance='euclidean'):
+    """
+    distances of the points of a series to other points.
+    Euclidean distances are calculated from the Gram matrix (|x|^2 + |y|^2 - 2 x.y)
+    with a BLAS matrix product, other metrics with cdist.
+
+    :param x: series of points (time, gridpoints), see _series
+    :param norms: squared norms of the points or None for cdist
+    :param y: other points (points, gridpoints), prepared as the series
+    :param y_norms: squared norms of the other points or None for cdist
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+
+    :return array: distances (time, points)
+    """
+    if norms is None:
+        return cdist(x, y, metric=distance)
+    dist = np.dot(x, y.T)
+    dist *= -2
+    dist += norms[:, None]
+    dist += y_norms
+    # rounding errors give small negatives for nearby points
+    np.maximum(dist, 0, out=dist)
+    return np.sqrt(dist, out=dist)
+
+
+def _distances(x, norms, start, stop, distance='euclidean'):
+    """
+    distances of all points of the series to the reference points start:stop
+
+    :return array: distances (time, stop - start)
+    """
+    if norms is None:
+        return cdist(x, x[start:stop], metric=distance)
+    dist = _cross_distances(x, norms, x[start:stop], norms[start:stop])
+    # the distance of a point to itself is exactly 0 as with cdist
+    cols = np.arange(stop - start)
+    dist[start + cols, cols] = np.where(np.isnan(dist[start + cols, cols]), np.nan, 0)
+    return dist
+
+
+def local_dims(dat, quanti=0.98, ap=0.5, distance='euclidean', slab=None, dtype=np.float64, threads=None):
+    """
+    Local dimensions and persistence of the points of a series. The distances
+    are calculated for a slab of reference points against the whole series and
+    reduced right away, so the full distance matrix is never held in memory.
+
+    :param dat: series of points (time, gridpoints)
+    :param quanti: quantile defining the recurrences or list of quantiles
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+    :param slab: number of reference points processed at once (default: see slab_size)
+    :param dtype: precision of the euclidean distances (numpy.float32 or numpy.float64)
+    :param threads: number of BLAS threads (0: number of CPUs, None: library default)
+
+    :return 2 arrays: local dimensions and persistence (time),
+                      or (quantiles, time) for a list of quantiles
+    """
+    npoints = dat.shape[0]
+    slab = slab_size(npoints) if slab is None else int(slab)
+    LOGGER.debug('local dimensions of %s points in slabs of %s', npoints, slab)
+
+    x, norms = _series(dat, distance, dtype=dtype)
+    dim = np.empty(np.shape(quanti) + (npoints,))
+    theta = np.empty(np.shape(quanti) + (npoints,))
+    with blas_threads(threads):
+        for start in range(0, npoints, slab):
+            stop = min(start + slab, npoints)
+            dist = _distances(x, norms, start, stop, distance=distance)
+            dim[..., start:stop], theta[..., start:stop] = _dim_theta(dist, quanti=quanti, ap=ap)
+    return dim, theta
+
 
-    # npoints=np.size(dat,0)
-    # npoints=np.size(data,0)
-    npoints=len(data[:,0])
+_shared = {}
 
-    dim=np.empty((npoints))
-    dim.fill(np.nan)
-    theta=np.empty((npoints))
-    theta.fill(np.nan)
 
-    global glob_abal
-    glob_abal=ap
-    global glob_distance
-    glob_distance=distance
+def _init_shared(buf, shape, dtype, quanti, ap, distance, threads):
+    """
+    initializer of the pool processes: keeps a view of the shared series and the settings
+    """
+    x = np.frombuffer(buf, dtype=dtype).reshape(shape)
+    _shared['dat'] = x
+    _shared['norms'] = np.einsum('ij,ij->i', x, x) if distance == 'euclidean' else None
+    _shared['options'] = dict(quanti=quanti, ap=ap)
+    _shared['distance'] = distance
+    _shared['threads'] = threads
 
-    # global dat as list to be used by pool.map
-    l_dat = [glob_dat[i,:].reshape(1,-1) for i in range(npoints)]
 
-    # multi CPU 
-    pool = Pool()
-    res_p=pool.map(_calc_dist, l_dat)
-    pool.close()
-    pool.join()
+def _shared_rows(rows):
+    """
+    local dimensions and persistence of a range of rows of the shared series
+    """
+    start, stop = rows
+    with blas_threads(_shared['threads']):
+        dist = _distances(_shared['dat'], _shared['norms'], start, stop, distance=_shared['distance'])
+    dim, theta = _dim_theta(dist, **_shared['options'])
+    return start, dim, theta
 
-    # collect results
-    for i,j in enumerate(res_p): 
-        dim[i]=res_p[i][0]
-        theta[i]=res_p[i][1]
 
+def local_dims_shared(dat, quanti=0.98, ap=0.5, distance='euclidean', workers=None, chunk=None,
+                      dtype=np.float64, threads=None):
+    """
+    Local dimensions and persistence of the points of a series calculated by a
+    pool of processes. The series is copied once into shared memory and the
+    processes get contiguous ranges of reference points.
+
+    :param dat: series of points (time, gridpoints)
+    :param quanti: quantile defining the recurrences or list of quantiles
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+    :param workers: number of processes (default: number of CPUs)
+    :param chunk: number of reference points of a range (default: from the available memory)
+    :param dtype: precision of the euclidean distances (numpy.float32 or numpy.float64)
+    :param threads: number of BLAS threads shared by the processes (0: number of CPUs)
+
+    :return 2 arrays: local dimensions and persistence (time),
+                      or (quantiles, time) for a list of quantiles
+    """
+    from multiprocessing.sharedctypes import RawArray
+
+    npoints = dat.shape[0]
+    workers = cpu_count() if workers is None else max(int(workers), 1)
+    if chunk is None:
+        # a few ranges per process to balance the load, each within its share of memory
+        chunk = min(slab_size(npoints, fraction=0.25 / workers), -(-npoints // (4 * workers)))
+    chunk = max(int(chunk), 1)
+    threads = max((threads or cpu_count()) // workers, 1)
+
+    x, _ = _series(dat, distance, dtype=dtype)
+    buf = RawArray('f' if x.dtype == np.float32 else 'd', x.size)
+    np.frombuffer(buf, dtype=x.dtype)[:] = np.ravel(x)
+    ranges = [(start, min(start + chunk, npoints)) for start in range(0, npoints, chunk)]
+    LOGGER.debug('local dimensions of %s points in %s ranges on %s processes', npoints, len(ranges), workers)
+
+    dim = np.empty(np.shape(quanti) + (npoints,))
+    theta = np.empty(np.shape(quanti) + (npoints,))
+    pool = Pool(workers, initializer=_init_shared,
+                initargs=(buf, x.shape, x.dtype, quanti, ap, distance, threads))
+    try:
+        for start, range_dim, range_theta in pool.imap_unordered(_shared_rows, ranges):
+            dim[..., start:start + range_dim.shape[-1]] = range_dim
+            theta[..., start:start + range_theta.shape[-1]] = range_theta
+    finally:
+        pool.close()
+        pool.join()
     return dim, theta
 
 
-def localdims(resource, ap=0.5, variable=None, distance='euclidean'):
+Reference = namedtuple('Reference', ['data', 'norms', 'center', 'distance'])
+Reference.__doc__ = """
+Reference series prepared for the local dimensions of new points.
+
+data: points of the series (time, gridpoints), centered for euclidean distances
+norms: squared norms of the centered points or None (other metrics)
+center: mean point removed from the series or None (other metrics)
+distance: distance metric (see scipy.spatial.distance.cdist)
+"""
+
+
+def prepare_reference(dat, distance='euclidean', dtype=np.float64):
     """
-    calculating of a local dimentions and persistence
+    prepares a reference series for the local dimensions of new points,
+    see local_dims_new
+
+    :param dat: series of points (time, gridpoints)
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+    :param dtype: precision of the euclidean distances (numpy.float32 or numpy.float64)
+
+    :return Reference: prepared reference series
+    """
+    dat = np.asarray(dat, dtype=dtype)
+    center = _center(dat) if distance == 'euclidean' else None
+    x, norms = _series(dat, distance, dtype=dtype, center=center)
+    return Reference(data=x, norms=norms, center=center, distance=distance)
+
+
+def local_dims_new(reference, new, quanti=0.98, ap=0.5):
+    """
+    Local dimensions and persistence of new points (e.g. the last days) relative
+    to a reference series. Only the distances of the new points to the reference
+    series are calculated, the recurrences and their persistence are taken in
+    the reference series. The new points are not part of the reference, so all
+    their recurrences are counted.
+
+    :param reference: Reference series (see prepare_reference)
+    :param new: new points (points, gridpoints)
+    :param quanti: quantile defining the recurrences or list of quantiles
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
+
+    :return 2 arrays: local dimensions and persistence of the new points (points),
+                      or (quantiles, points) for a list of quantiles
+    """
+    new = np.atleast_2d(new)
+    y, y_norms = _series(new, reference.distance, dtype=reference.data.dtype, center=reference.center)
+    dist = _cross_distances(reference.data, reference.norms, y, y_norms, distance=reference.distance)
+    return _dim_theta(dist, quanti=quanti, ap=ap, insample=False)
+
+
+def distance_key(dat, distance='euclidean'):
+    """
+    returns the key of the distance matrix of a series in the cache
+
+    :param dat: series of points (time, gridpoints)
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+
+    :return str: key
+    """
+    dat = np.ascontiguousarray(dat, dtype=np.float64)
+    sha = hashlib.sha1(('%s|%s|' % (distance, dat.shape)).encode('utf-8'))
+    sha.update(dat.tobytes())
+    return sha.hexdigest()
+
+
+def distance_path(key):
+    return os.path.join(config.cache_path(), 'localdims', '%s.f32' % key)
+
+
+def distance_matrix(dat, distance='euclidean', slab=None, threads=None):
+    """
+    Distance matrix of a series as float32 memory map in the cache. The matrix
+    is calculated once in slabs and later opened from the cache, keyed by the
+    series and the distance metric.
+
+    :param dat: series of points (time, gridpoints)
+    :param distance: distance metric (see scipy.spatial.distance.cdist)
+    :param slab: number of reference points calculated at once (default: see slab_size)
+    :param threads: number of BLAS threads (0: number of CPUs, None: library default)
+
+    :return numpy.memmap: read-only distance matrix (time, time)
+    """
+    import psutil
+
+    npoints = dat.shape[0]
+    filename = distance_path(distance_key(dat, distance))
+    size = npoints * npoints * 4
+    if os.path.exists(filename) and os.path.getsize(filename) == size:
+        LOGGER.info('distance matrix loaded from cache: %s', filename)
+        touch(filename)
+        return np.memmap(filename, dtype=np.float32, mode='r', shape=(npoints, npoints))
+
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    if psutil.disk_usage(directory).free < size:
+        msg = 'not enough disk space for the distance matrix of %s points (%s bytes)' % (npoints, size)
+        LOGGER.error(msg)
+        raise Exception(msg)
+
+    # write to a temporary file first, so concurrent requests never read a partial matrix
+    tmp_file = os.path.join(directory, '%s.f32' % uuid.uuid1())
+    matrix = np.memmap(tmp_file, dtype=np.float32, mode='w+', shape=(npoints, npoints))
+    slab = slab_size(npoints) if slab is None else int(slab)
+    x, norms = _series(dat, distance)
+    with blas_threads(threads):
+        for start in range(0, npoints, slab):
+            stop = min(start + slab, npoints)
+            # the matrix is symmetric: the slab is written as rows
+            matrix[start:stop] = _distances(x, norms, start, stop, distance=distance).T
+    matrix.flush()
+    del matrix
+    os.rename(tmp_file, filename)
+    LOGGER.info('distance matrix of %s points stored in cache: %s', npoints, filename)
+    return np.memmap(filename, dtype=np.float32, mode='r', shape=(npoints, npoints))
+
+
+def local_dims_matrix(dist, quanti=0.98, ap=0.5, slab=None):
+    """
+    Local dimensions and persistence of the points of a series from its
+    (memory mapped) distance matrix, streamed in slabs
+
+    :param dist: distance matrix (time, time), see distance_matrix
+    :param quanti: quantile defining the recurrences or list of quantiles
+    :param ap: plotting positions parameter (0.5 = Python and Mathlab, 1 = R)
+    :param slab: number of reference points processed at once (default: see slab_size)
+
+    :return 2 arrays: local dimensions and persistence (time),
+                      or (quantiles, time) for a list of quantiles
+    """
+    npoints = dist.shape[0]
+    slab = slab_size(npoints) if slab is None else int(slab)
+    dim = np.empty(np.shape(quanti) + (npoints,))
+    theta = np.empty(np.shape(quanti) + (npoints,))
+    for start in range(0, npoints, slab):
+        stop = min(start + slab, npoints)
+        # rows are contiguous in the file, the matrix is symmetric
+        dim[..., start:stop], theta[..., start:stop] = _dim_theta(np.asarray(dist[start:stop]).T,
+                                                                  quanti=quanti, ap=ap)
+    return dim, theta
+
+
+def localdims_par(resource, ap=0.5, variable=None, distance='euclidean', workers=None, quanti=0.98):
+    """
+    calculating of a local dimentions and persistence with a pool of processes
 
     :param resource: str or list of str containing the netCDF file path
+    :param workers: number of processes (default: number of CPUs)
+    :param quanti: quantile defining the recurrences or list of quantiles
 
-    :return 2 arrays: local dimentions and persistence
+    :return 2 arrays: local dimentions and persistence (time),
+                      or (quantiles, time) for a list of quantiles
     """
 
     if variable is None:
@@ -130,58 +520,50 @@ def localdims(resource, ap=0.5, variable=None, distance='euclidean'):
     # TODO: should be 3D with TIME first.
     # Think how to operate with 4D and unknown stucture (lat,lon,level,time) for expample.
 
-    # dat=data.reshape((data.shape[0],data.shape[1]*data.shape[2]))
     dat=data.reshape((data.shape[0],data.shape[lat_index]*data.shape[lon_index]))
 
-    # Quantile definition
-    quanti=0.98
-
-    # npoints=np.size(dat,0)
-    # npoints=np.size(data,0)
-    npoints=len(data[:,0])
+    return local_dims_shared(dat, quanti=quanti, ap=ap, distance=distance, workers=workers,
+                             threads=config.localdims_threads())
 
-    dim=np.empty((npoints))
-    dim.fill(np.nan)
-    theta=np.empty((npoints))
-    theta.fill(np.nan)
 
-    l=0
-
-    # Calculation of total distance matrix
-
-    dist=cdist(dat, dat, metric=distance)
-    # print np.shape(dist)
+def localdims(resource, ap=0.5, variable=None, distance='euclidean', slab=None, quanti=0.98,
+              cache=False):
+    """
+    calculating of a local dimentions and persistence
 
-    # 0.5 = Python and Mathlab, 1 = R
-    abal=ap
-    # abal=0.5
+    :param resource: str or list of str containing the netCDF file path
+    :param slab: number of days for which the distances are calculated at once
+                 (default: from the available memory, see slab_size)
+    :param quanti: quantile defining the recurrences or list of quantiles
+                   (all calculated from the same distances)
+    :param cache: keep the distance matrix as float32 memory map in the cache
+                  and reuse it for the same data and distance (see distance_matrix)
+
+    :return 2 arrays: local dimentions and persistence (time),
+                      or (quantiles, time) for a list of quantiles
+    """
 
-    for l in range(npoints):
+    if variable is None:
+        variable = get_variable(resource)
 
-        distance=dist[:,l]
+    data = get_values(resource, variable=variable)
 
-        logdista=-np.log(distance)
-        x = logdista[~np.isinf(logdista)]
-        logdista = x[~np.isnan(x)]
-        thresh=mquantiles(logdista, quanti, alphap=abal, betap=abal)
-        # NOT ORIGINAL
-        logdista=-np.log(distance)
-        Li = [i for i in range(len(logdista)) if (logdista[i] > thresh)and(logdista[i]<0)]
-        Ti=np.diff(Li)
-        N=len(Ti)
-        q=1.-quanti
-        Si=Ti-1
-        Ncc=[i for i in range(len(Si)) if (Si[i] > 0)]
-        Nc=len(Ncc)
+    lat_index = get_index_lat(resource, variable=variable)
+    lon_index = get_index_lon(resource, variable=variable)
 
-        theta[l]=(sum(q*Si)+N+Nc-np.sqrt(((sum(q*Si)+N+Nc)**2)-8*Nc*sum(q*Si)))/(2*sum(q*Si))
-        logdista=np.sort(logdista)
+    # TODO: should be 3D with TIME first.
+    # Think how to operate with 4D and unknown stucture (lat,lon,level,time) for expample.
 
-        findidx=[i for i in range(len(logdista)) if (logdista[i] > thresh)and(logdista[i]<0)]
+    # dat=data.reshape((data.shape[0],data.shape[1]*data.shape[2]))
+    dat=data.reshape((data.shape[0],data.shape[lat_index]*data.shape[lon_index]))
 
-        logextr=logdista[findidx[0]:len(logdista)-1]
-        # logextr=logdista[findidx[[1]]:(length(logdista)-1)]
+    # 0.5 = Python and Mathlab, 1 = R
+    abal=ap
+    # abal=0.5
 
-        dim[l]=1/np.mean(logextr-thresh)
+    if cache:
+        dist = distance_matrix(dat, distance=distance, slab=slab, threads=config.localdims_threads())
+        return local_dims_matrix(dist, quanti=quanti, ap=abal, slab=slab)
 
-    return dim, theta
+    return local_dims(dat, quanti=quanti, ap=abal, distance=distance, slab=slab,
+                      threads=config.localdims_threads())
@@ -169,6 +169,16 @@ class AnalogscompareProcess(Process):
                          # allowed_values=['reanalyses', 'model']
                          ),
 
+            LiteralInput("engine", "Analogs engine",
+                         abstract="Search the analogues with the external CASTf90 program"
+                                  " or in-process with Python",
+                         default='CASTf90',
+                         data_type='string',
+                         min_occurs=0,
+                         max_occurs=1,
+                         allowed_values=['CASTf90', 'Python']
+                         ),
+
             LiteralInput("plot", "Plot",
                          abstract="Plot simulations and Mean/Best/Last analogs?",
                          default='No',
@@ -317,6 +327,7 @@ class AnalogscompareProcess(Process):
 
         normalize = request.inputs['normalize'][0].data
         plot = request.inputs['plot'][0].data
+        engine = request.inputs['engine'][0].data
         distance = request.inputs['dist'][0].data
         outformat = request.inputs['outformat'][0].data
         timewin = request.inputs['timewin'][0].data
@@ -725,25 +736,36 @@ class AnalogscompareProcess(Process):
         environ['LD_LIBRARY_PATH'] = hdflib
         # ################################################################################
 
-        try:
-            response.update_status('execution of CASTf90', 70)
-            cmd = 'analogue.out %s' % path.relpath(config_file)
-            # system(cmd)
-            args = shlex.split(cmd)
-            output, error = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-                ).communicate()
-            LOGGER.info('analogue.out info:\n %s ' % output)
-            LOGGER.exception('analogue.out errors:\n %s ' % error)
-            response.update_status('**** CASTf90 suceeded', 80)
-        except:
-            msg = 'CASTf90 failed'
-            LOGGER.exception(msg)
-            raise Exception(msg)
-
-        LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
+        if engine == 'Python':
+            try:
+                response.update_status('execution of analogs search', 70)
+                analogs.run_analogs(config_file)
+                response.update_status('**** analogs search suceeded', 80)
+            except Exception:
+                msg = 'analogs search failed'
+                LOGGER.exception(msg)
+                raise Exception(msg)
+            LOGGER.debug("analogs search took %s seconds.", time.time() - start_time)
+        else:
+            try:
+                response.update_status('execution of CASTf90', 70)
+                cmd = 'analogue.out %s' % path.relpath(config_file)
+                # system(cmd)
+                args = shlex.split(cmd)
+                output, error = subprocess.Popen(
+                    args,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                    ).communicate()
+                LOGGER.info('analogue.out info:\n %s ' % output)
+                LOGGER.exception('analogue.out errors:\n %s ' % error)
+                response.update_status('**** CASTf90 suceeded', 80)
+            except Exception:
+                msg = 'CASTf90 failed'
+                LOGGER.exception(msg)
+                raise Exception(msg)
+
+            LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
 
         # TODO: Add try - except for pdfs
         if plot == 'Yes':
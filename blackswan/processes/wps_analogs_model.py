@@ -160,6 +160,16 @@ class AnalogsmodelProcess(Process):
                          max_occurs=1,
                          ),
 
+            LiteralInput("engine", "Analogs engine",
+                         abstract="Search the analogues with the external CASTf90 program"
+                                  " or in-process with Python",
+                         default='CASTf90',
+                         data_type='string',
+                         min_occurs=0,
+                         max_occurs=1,
+                         allowed_values=['CASTf90', 'Python']
+                         ),
+
             LiteralInput("plot", "Plot",
                          abstract="Plot simulations and Mean/Best/Last analogs?",
                          default='No',
@@ -320,6 +330,7 @@ class AnalogsmodelProcess(Process):
 
             normalize = request.inputs['normalize'][0].data
             plot = request.inputs['plot'][0].data
+            engine = request.inputs['engine'][0].data
             distance = request.inputs['dist'][0].data
             outformat = request.inputs['outformat'][0].data
             timewin = request.inputs['timewin'][0].data
@@ -615,21 +626,31 @@ class AnalogsmodelProcess(Process):
         environ['LD_LIBRARY_PATH'] = hdflib
         # ################################################################################
 
-        try:
-            # response.update_status('execution of CASTf90', 50)
-            cmd = 'analogue.out %s' % path.relpath(config_file)
-            # system(cmd)
-            args = shlex.split(cmd)
-            output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            LOGGER.info('analogue.out info:\n %s ' % output)
-            LOGGER.debug('analogue.out errors:\n %s ' % error)
-            response.update_status('**** CASTf90 suceeded', 70)
-        except Exception as e:
-            msg = 'CASTf90 failed %s ' % e
-            LOGGER.error(msg)
-            raise Exception(msg)
-
-        LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
+        if engine == 'Python':
+            try:
+                analogs.run_analogs(config_file)
+                response.update_status('**** analogs search suceeded', 70)
+            except Exception as e:
+                msg = 'analogs search failed %s ' % e
+                LOGGER.exception(msg)
+                raise Exception(msg)
+            LOGGER.debug("analogs search took %s seconds.", time.time() - start_time)
+        else:
+            try:
+                # response.update_status('execution of CASTf90', 50)
+                cmd = 'analogue.out %s' % path.relpath(config_file)
+                # system(cmd)
+                args = shlex.split(cmd)
+                output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+                LOGGER.info('analogue.out info:\n %s ' % output)
+                LOGGER.debug('analogue.out errors:\n %s ' % error)
+                response.update_status('**** CASTf90 suceeded', 70)
+            except Exception as e:
+                msg = 'CASTf90 failed %s ' % e
+                LOGGER.error(msg)
+                raise Exception(msg)
+
+            LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
 
         # TODO: Add try - except for pdfs
         if plot == 'Yes':
@@ -25,6 +25,10 @@ from blackswan.datafetch import _PRESSUREDATA_
 from blackswan.datafetch import reanalyses as rl
 from blackswan.ocgis_module import call
 from blackswan import analogs
+from blackswan import archivestore
+from blackswan import config
+from blackswan.analogsearch import eof_basis, write_analogs
+from blackswan.analogindex import AnalogIndex
 
 # from blackswan.utils import rename_complexinputs
 from blackswan.utils import get_variable, get_files_size
@@ -163,6 +167,16 @@ class AnalogsreanalyseProcess(Process):
                          max_occurs=1,
                          ),
 
+            LiteralInput("engine", "Analogs engine",
+                         abstract="Search the analogues with the external CASTf90 program"
+                                  " or in-process with Python",
+                         default='CASTf90',
+                         data_type='string',
+                         min_occurs=0,
+                         max_occurs=1,
+                         allowed_values=['CASTf90', 'Python']
+                         ),
+
             LiteralInput("plot", "Plot",
                          abstract="Plot simulations and Mean/Best/Last analogs?",
                          default='No',
@@ -310,6 +324,7 @@ class AnalogsreanalyseProcess(Process):
             normalize = request.inputs['normalize'][0].data
             detrend = request.inputs['detrend'][0].data
             plot = request.inputs['plot'][0].data
+            engine = request.inputs['engine'][0].data
             distance = request.inputs['dist'][0].data
             outformat = request.inputs['outformat'][0].data
             timewin = request.inputs['timewin'][0].data
@@ -384,6 +399,24 @@ class AnalogsreanalyseProcess(Process):
             LOGGER.exception(msg)
             raise Exception(msg)
 
+        ##########################################
+        # look up the prepared archive in the store
+        ##########################################
+
+        # The prepared archive can only be reused by the Python engine, if the archive
+        # does not depend on the simulation (normalization) and no archive file is needed (plot)
+        stored_archive = None
+        use_store = (engine == 'Python' and detrend == 'None' and normalize in ['None', 'base'] and plot == 'No')
+        if use_store:
+            archive_key = archivestore.archive_key('%s_%s' % (model, timres), var, level, bbox,
+                                                   [refSt, refEn], normalize)
+            stored_archive = archivestore.load_archive(archive_key)
+            if stored_archive is not None:
+                # only the simulation period needs to be fetched
+                start = dateSt
+                end = dateEn
+                LOGGER.info('prepared archive found in store: %s' % archive_key)
+
         ##########################################
         # fetch Data from original data archive
         ##########################################
@@ -537,9 +570,12 @@ class AnalogsreanalyseProcess(Process):
                                 % (bbox[0], bbox[2], bbox[1], bbox[3])
             simNameString = "sim_" + var + "_" + simDatesString + '_%.1f_%.1f_%.1f_%.1f' \
                             % (bbox[0], bbox[2], bbox[1], bbox[3])
-            archive = call(resource=model_subset,
-                           time_range=[refSt, refEn],
-                           prefix=archiveNameString)
+            if stored_archive is not None:
+                archive = archivestore.archive_path(archive_key)
+            else:
+                archive = call(resource=model_subset,
+                               time_range=[refSt, refEn],
+                               prefix=archiveNameString)
             simulation = call(resource=model_subset, time_range=[dateSt, dateEn],
                               prefix=simNameString)
             LOGGER.info('archive and simulation files generated: %s, %s'
@@ -550,7 +586,10 @@ class AnalogsreanalyseProcess(Process):
             raise Exception(msg)
 
         try:
-            if seacyc is True:
+            if seacyc is True and stored_archive is not None:
+                # the seasonal cycle of the reference period is kept in the store
+                seasoncyc_base = seasoncyc_sim = archive
+            elif seacyc is True:
                 LOGGER.info('normalization function with method: %s '
                             % normalize)
                 seasoncyc_base, seasoncyc_sim = analogs.seacyc(
@@ -626,19 +665,63 @@ class AnalogsreanalyseProcess(Process):
         os.environ['LD_LIBRARY_PATH'] = hdflib
         # ################################################################################
 
-        response.update_status('Start CASTf90 call', 50)
-        try:
-            # response.update_status('execution of CASTf90', 50)
-            cmd = ['analogue.out', config_file]
-            LOGGER.debug("castf90 command: %s", cmd)
-            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            LOGGER.info('analogue output:\n %s', output)
-            response.update_status('**** CASTf90 suceeded', 60)
-        except CalledProcessError as e:
-            msg = 'CASTf90 failed:\n{0}'.format(e.output)
-            LOGGER.exception(msg)
-            raise Exception(msg)
-        LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
+        if engine == 'Python':
+            response.update_status('Start in-process analogs search', 50)
+            try:
+                basis = None
+                ann_index = None
+                previous = None
+                rerank = config.analogs_rerank()
+                if use_store and stored_archive is None:
+                    stored_archive = analogs.prepare_archive(archive, var, seasoncyc_base=seasoncyc_base)
+                    if archivestore.covers_period(stored_archive, [refSt, refEn]):
+                        archivestore.store_archive(archive_key, stored_archive)
+                    else:
+                        # nothing is stored under the key of the full reference period
+                        LOGGER.warning('archive does not cover the reference period, not stored: %s', archive_key)
+                        use_store = False
+                if use_store:
+                    # EOF reduced search on the stored archive
+                    eof_variance = config.analogs_eof_variance()
+                    if eof_variance > 0:
+                        basis = archivestore.load_basis(archive_key, eof_variance)
+                        if basis is None:
+                            basis = eof_basis(stored_archive.data, variance=eof_variance)
+                            archivestore.store_basis(archive_key, eof_variance, basis)
+                        if config.analogs_index():
+                            ann_index = archivestore.load_index(archive_key, eof_variance)
+                            if ann_index is None:
+                                ann_index = AnalogIndex(basis.pcs, stored_archive.dates, doy=stored_archive.doy)
+                                archivestore.store_index(archive_key, eof_variance, ann_index)
+                    # only the simulation days not found in the previous search are searched
+                    search_key = archivestore.search_key(archive_key, nanalog, seasonwin, timewin, distance,
+                                                         eof_variance, rerank, ann_index is not None)
+                    previous = archivestore.load_result(search_key)
+                result = analogs.search_analogs(config_file, archive=stored_archive, basis=basis,
+                                                rerank=rerank, ann_index=ann_index, previous=previous)
+                if use_store:
+                    archivestore.store_result(search_key, result)
+                write_analogs(result, output_file, binary=True)
+                response.update_status('**** analogs search suceeded', 60)
+            except Exception as e:
+                msg = 'analogs search failed: %s ' % e
+                LOGGER.exception(msg)
+                raise Exception(msg)
+            LOGGER.debug("analogs search took %s seconds.", time.time() - start_time)
+        else:
+            response.update_status('Start CASTf90 call', 50)
+            try:
+                # response.update_status('execution of CASTf90', 50)
+                cmd = ['analogue.out', config_file]
+                LOGGER.debug("castf90 command: %s", cmd)
+                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+                LOGGER.info('analogue output:\n %s', output)
+                response.update_status('**** CASTf90 suceeded', 60)
+            except CalledProcessError as e:
+                msg = 'CASTf90 failed:\n{0}'.format(e.output)
+                LOGGER.exception(msg)
+                raise Exception(msg)
+            LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
 
         # TODO: Add try - except for pdfs
         if plot == 'Yes':
@@ -653,9 +736,16 @@ class AnalogsreanalyseProcess(Process):
         response.outputs['config'].file = config_file
         response.outputs['analogs'].file = output_file
         response.outputs['output_netcdf'].file = simulation
-        response.outputs['target_netcdf'].file = archive
 
-        if seacyc is True:
+        if archive.endswith('.nc'):
+            response.outputs['target_netcdf'].file = archive
+        else:
+            dummy_target = 'dummy_target.nc'
+            with open(dummy_target, 'a'):
+                os.utime(dummy_target, None)
+            response.outputs['target_netcdf'].file = dummy_target
+
+        if seacyc is True and seasoncyc_base.endswith('.nc'):
             response.outputs['base_netcdf'].file = seasoncyc_base
             response.outputs['sim_netcdf'].file = seasoncyc_sim
         else:
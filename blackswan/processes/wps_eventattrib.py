@@ -201,6 +201,16 @@ class EventAttributionProcess(Process):
                          max_occurs=1,
                          ),
 
+            LiteralInput("engine", "Analogs engine",
+                         abstract="Search the analogues with the external CASTf90 program"
+                                  " or in-process with Python",
+                         default='CASTf90',
+                         data_type='string',
+                         min_occurs=0,
+                         max_occurs=1,
+                         allowed_values=['CASTf90', 'Python']
+                         ),
+
             LiteralInput("plot", "Plot",
                          abstract="Plot simulations and Mean/Best/Last analogs?",
                          default='No',
@@ -424,6 +434,7 @@ class EventAttributionProcess(Process):
             normalize = request.inputs['normalize'][0].data
             detrend = request.inputs['detrend'][0].data
             plot = request.inputs['plot'][0].data
+            engine = request.inputs['engine'][0].data
             distance = request.inputs['dist'][0].data
             outformat = request.inputs['outformat'][0].data
             timewin = request.inputs['timewin'][0].data
@@ -775,26 +786,39 @@ class EventAttributionProcess(Process):
         os.environ['LD_LIBRARY_PATH'] = hdflib
         # ################################################################################
 
-        response.update_status('Start CASTf90 call for 1st ref period', 50)
-        try:
-            cmd = ['analogue.out', config_file1]
-            LOGGER.debug("castf90 command: %s", cmd)
-            output1 = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            LOGGER.info('analogue output:\n %s', output1)
-            response.update_status('**** CASTf90 1st suceeded', 60)
-
-            cmd = ['analogue.out', config_file2]
-            LOGGER.debug("castf90 command: %s", cmd)
-            output2 = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            LOGGER.info('analogue output:\n %s', output2)
-            response.update_status('**** CASTf90 2nd suceeded', 70)
-
-        except CalledProcessError as e:
-            msg = 'CASTf90 failed:\n{0}'.format(e.output)
-            LOGGER.exception(msg)
-            raise Exception(msg)
-
-        LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
+        if engine == 'Python':
+            response.update_status('Start analogs search for both ref periods', 50)
+            try:
+                analogs.run_analogs_batch([config_file1, config_file2])
+                response.update_status('**** analogs search suceeded', 70)
+            except Exception as e:
+                msg = 'analogs search failed: %s ' % e
+                LOGGER.exception(msg)
+                raise Exception(msg)
+            LOGGER.debug("analogs search took %s seconds.", time.time() - start_time)
+        else:
+            response.update_status('Start CASTf90 calls for both ref periods', 50)
+            try:
+                # both reference periods are independent and run concurrently
+                finished = []
+
+                def castf90_status(i):
+                    finished.append(i)
+                    response.update_status('**** CASTf90 for ref period %s suceeded' % (i + 1),
+                                           50 + 10 * len(finished))
+
+                output1, output2 = analogs.call_castf90([config_file1, config_file2],
+                                                        workers=config.analogs_workers(),
+                                                        status=castf90_status)
+                LOGGER.info('analogue output 1st ref period:\n %s', output1)
+                LOGGER.info('analogue output 2nd ref period:\n %s', output2)
+
+            except CalledProcessError as e:
+                msg = 'CASTf90 failed:\n{0}'.format(e.output)
+                LOGGER.exception(msg)
+                raise Exception(msg)
+
+            LOGGER.debug("castf90 took %s seconds.", time.time() - start_time)
 
         # TODO: Add try - except for pdfs
 
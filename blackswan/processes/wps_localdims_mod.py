@@ -5,17 +5,14 @@ from datetime import time as dt_time
 # from datetime import date
 import time  # performance test
 
-import subprocess
-import uuid
 # later goes to utils
 from netCDF4 import Dataset
 
-from numpy import savetxt, loadtxt, column_stack
+from numpy import savetxt, column_stack
 from scipy.stats.mstats import mquantiles
 
 from blackswan import analogs
 from blackswan import visualisation
-from blackswan import config
 
 from blackswan.ocgis_module import call
 from blackswan.datafetch import get_level
@@ -111,7 +108,9 @@ class LocaldimsModProcess(Process):
                          ),
 
             LiteralInput("method", "Method",
-                         abstract="Method of calculation: Python(full dist matrix at once), R(full dist matrix at once), R_wrap(dist matrix row by row on multiCPUs)",
+                         abstract="Method of calculation: Python(dist matrix in slabs), "
+                                  "Python_wrap(dist matrix in ranges on multiCPUs), "
+                                  "R and R_wrap(as Python and Python_wrap with the quantiles of R)",
                          default='Python_wrap',
                          data_type='string',
                          min_occurs=0,
@@ -441,8 +440,6 @@ class LocaldimsModProcess(Process):
         LOGGER.debug('Calculation of the dims with: %s' % (method))
 
         dim_filename = '%s.txt' % model_id
-        tmp_dim_fn = '%s.txt' % uuid.uuid1()
-        Rsrc = config.Rsrc_dir()
 
         if (method == 'Python'):
             try:
@@ -458,53 +455,20 @@ class LocaldimsModProcess(Process):
             except:
                 LOGGER.exception('NO! output returned from Python call')
 
+        # same estimator as the R scripts, with the quantile definition of R
         if (method == 'R'):
-            # from os.path import join
-            Rfile = 'localdimension_persistence_fullD.R'
-            args = ['Rscript', path.join(Rsrc, Rfile),
-                    '%s' % res_tmp, '%s' % variable,
-                    '%s' % tmp_dim_fn]
-            LOGGER.info('Rcall builded')
-            LOGGER.debug('ARGS: %s' % (args))
-
             try:
-                output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-                LOGGER.info('R outlog info:\n %s ' % output)
-                LOGGER.exception('R outlog errors:\n %s ' % error)
-                if len(output) > 0:
-                    response.update_status('**** Dims with R suceeded', 60)
-                else:
-                    LOGGER.exception('NO! output returned from R call')
-                # HERE READ DATA FROM TEXT FILES
-                R_resdim = loadtxt(fname=tmp_dim_fn, delimiter=',')
-                l_theta = R_resdim[:, 0]
-                l_dist = R_resdim[:, 1]
+                l_dist, l_theta = localdims(resource=res_tmp, variable=variable, distance=str(distance), ap=1)
+                response.update_status('**** Dims with R quantiles suceeded', 60)
             except:
                 msg = 'Dim with R'
                 LOGGER.exception(msg)
                 raise Exception(msg)
 
         if (method == 'R_wrap'):
-            # from os.path import join
-            Rfile = 'localdimension_persistence_serrD.R'
-            args = ['Rscript', path.join(Rsrc, Rfile),
-                    '%s' % res_tmp, '%s' % variable,
-                    '%s' % tmp_dim_fn]
-            LOGGER.info('Rcall builded')
-            LOGGER.debug('ARGS: %s' % (args))
-
             try:
-                output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-                LOGGER.info('R outlog info:\n %s ' % output)
-                LOGGER.exception('R outlog errors:\n %s ' % error)
-                if len(output) > 0:
-                    response.update_status('**** Dims with R_wrap suceeded', 60)
-                else:
-                    LOGGER.exception('NO! output returned from R call')
-                # HERE READ DATA FROM TEXT FILES
-                R_resdim = loadtxt(fname=tmp_dim_fn, delimiter=',')
-                l_theta = R_resdim[:, 0]
-                l_dist = R_resdim[:, 1]
+                l_dist, l_theta = localdims_par(resource=res_tmp, variable=variable, distance=str(distance), ap=1)
+                response.update_status('**** Dims with R_wrap quantiles suceeded', 60)
             except:
                 msg = 'Dim with R_wrap'
                 LOGGER.exception(msg)
@@ -549,40 +513,21 @@ class LocaldimsModProcess(Process):
         seas_dim_filename = season + '_' + dim_filename
         savetxt(seas_dim_filename, sf, fmt='%s', delimiter=',')
 
-        # -------------------------- plot with R ---------------
-        R_plot_file = 'plot_csv.R'
+        # -------------------------- plot ---------------
         ld2_pdf = '%s_local_dims.pdf' % model_id
         ld2_html = '%s_local_dims.html' % model_id
         ld2_seas_pdf = season + '_' + ld2_pdf
         ld2_seas_html = season + '_' + ld2_html
 
-        args = ['Rscript', path.join(Rsrc, R_plot_file),
-                '%s' % dim_filename,
-                '%s' % ld2_pdf,
-                '%s' % ld2_html]
-        try:
-            output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            LOGGER.info('R outlog info:\n %s ' % output)
-            LOGGER.exception('R outlog errors:\n %s ' % error)
-        except:
-            msg = 'Could not produce plot'
-            LOGGER.exception(msg)
-            # TODO: Here need produce empty pdf to pass to output
-
-        args = ['Rscript', path.join(Rsrc, R_plot_file),
-                '%s' % seas_dim_filename,
-                '%s' % ld2_seas_pdf,
-                '%s' % ld2_seas_html]
         try:
-            output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            LOGGER.info('R outlog info:\n %s ' % output)
-            LOGGER.exception('R outlog errors:\n %s ' % error)
+            visualisation.pdf_local_dims(l_dist, l_theta, output=ld2_pdf)
+            visualisation.html_local_dims(l_dist, l_theta, output=ld2_html)
+            visualisation.pdf_local_dims(l_dist[ind], l_theta[ind], output=ld2_seas_pdf)
+            visualisation.html_local_dims(l_dist[ind], l_theta[ind], output=ld2_seas_html)
         except:
             msg = 'Could not produce plot'
             LOGGER.exception(msg)
             # TODO: Here need produce empty pdf(s) to pass to output
-        # 
-
         # ====================================================
 
 
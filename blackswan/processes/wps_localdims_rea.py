@@ -3,14 +3,13 @@ import os
 from datetime import datetime as dt
 from scipy.stats.mstats import mquantiles
 import time  # performance test
-import subprocess
 # from subprocess import CalledProcessError
 import uuid
 import psutil
 
 from netCDF4 import Dataset
 
-from numpy import squeeze, savetxt, loadtxt, column_stack
+from numpy import squeeze, savetxt, column_stack
 
 from pywps import Process
 from pywps import LiteralInput, LiteralOutput
@@ -107,7 +106,9 @@ class LocaldimsReaProcess(Process):
                          ),
 
             LiteralInput("method", "Method",
-                         abstract="Method of calculation: Python(full dist matrix at once), R(full dist matrix at once), R_wrap(dist matrix row by row on multiCPUs)",
+                         abstract="Method of calculation: Python(dist matrix in slabs), "
+                                  "Python_wrap(dist matrix in ranges on multiCPUs), "
+                                  "R and R_wrap(as Python and Python_wrap with the quantiles of R)",
                          default='Python_wrap',
                          data_type='string',
                          min_occurs=0,
@@ -447,9 +448,6 @@ class LocaldimsReaProcess(Process):
         LOGGER.debug('Calculation of the dims with: %s' % (method))
 
         dim_filename = '%s.txt' % model
-        tmp_dim_fn = '%s.txt' % uuid.uuid1()
-
-        Rsrc = config.Rsrc_dir()
 
         if (method == 'Python'):
             try:
@@ -465,53 +463,20 @@ class LocaldimsReaProcess(Process):
             except:
                 LOGGER.exception('NO! output returned from Python call')
 
+        # same estimator as the R scripts, with the quantile definition of R
         if (method == 'R'):
-            # from os.path import join
-            Rfile = 'localdimension_persistence_fullD.R'
-            args = ['Rscript', os.path.join(Rsrc, Rfile),
-                    '%s' % model_subset, '%s' % var,
-                    '%s' % tmp_dim_fn]
-            LOGGER.info('Rcall builded')
-            LOGGER.debug('ARGS: %s' % (args))
-
             try:
-                output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-                LOGGER.info('R outlog info:\n %s ' % output)
-                LOGGER.exception('R outlog errors:\n %s ' % error)
-                if len(output) > 0:
-                    response.update_status('**** Dims with R suceeded', 60)
-                else:
-                    LOGGER.exception('NO! output returned from R call')
-                # HERE READ DATA FROM TEXT FILES
-                R_resdim = loadtxt(fname=tmp_dim_fn, delimiter=',')
-                l_theta = R_resdim[:, 0]
-                l_dist = R_resdim[:, 1]
+                l_dist, l_theta = localdims(resource=model_subset, variable=var, distance=str(distance), ap=1)
+                response.update_status('**** Dims with R quantiles suceeded', 60)
             except:
                 msg = 'Dim with R'
                 LOGGER.exception(msg)
                 raise Exception(msg)
 
         if (method == 'R_wrap'):
-            # from os.path import join
-            Rfile = 'localdimension_persistence_serrD.R'
-            args = ['Rscript', os.path.join(Rsrc, Rfile),
-                    '%s' % model_subset, '%s' % var,
-                    '%s' % tmp_dim_fn]
-            LOGGER.info('Rcall builded')
-            LOGGER.debug('ARGS: %s' % (args))
-
             try:
-                output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-                LOGGER.info('R outlog info:\n %s ' % output)
-                LOGGER.exception('R outlog errors:\n %s ' % error)
-                if len(output) > 0:
-                    response.update_status('**** Dims with R_wrap suceeded', 60)
-                else:
-                    LOGGER.exception('NO! output returned from R call')
-                # HERE READ DATA FROM TEXT FILES
-                R_resdim = loadtxt(fname=tmp_dim_fn, delimiter=',')
-                l_theta = R_resdim[:, 0]
-                l_dist = R_resdim[:, 1]
+                l_dist, l_theta = localdims_par(resource=model_subset, variable=var, distance=str(distance), ap=1)
+                response.update_status('**** Dims with R_wrap quantiles suceeded', 60)
             except:
                 msg = 'Dim with R_wrap'
                 LOGGER.exception(msg)
@@ -556,40 +521,21 @@ class LocaldimsReaProcess(Process):
         seas_dim_filename = season + '_' + dim_filename
         savetxt(seas_dim_filename, sf, fmt='%s', delimiter=',')
 
-        # -------------------------- plot with R ---------------
-        R_plot_file = 'plot_csv.R'
+        # -------------------------- plot ---------------
         ld2_pdf = '%s_local_dims.pdf' % model
         ld2_html = '%s_local_dims.html' % model
         ld2_seas_pdf = season + '_' + ld2_pdf
         ld2_seas_html = season + '_' + ld2_html
 
-        args = ['Rscript', os.path.join(Rsrc, R_plot_file),
-                '%s' % dim_filename,
-                '%s' % ld2_pdf,
-                '%s' % ld2_html]
-        try:
-            output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            LOGGER.info('R outlog info:\n %s ' % output)
-            LOGGER.exception('R outlog errors:\n %s ' % error)
-        except:
-            msg = 'Could not produce plot'
-            LOGGER.exception(msg)
-            # TODO: Here need produce empty pdf(s) to pass to output
-
-        # TODO check whether remove Rdat.pdf at this step
-        args = ['Rscript', os.path.join(Rsrc, R_plot_file),
-                '%s' % seas_dim_filename,
-                '%s' % ld2_seas_pdf,
-                '%s' % ld2_seas_html]
         try:
-            output, error = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            LOGGER.info('R outlog info:\n %s ' % output)
-            LOGGER.exception('R outlog errors:\n %s ' % error)
+            visualisation.pdf_local_dims(l_dist, l_theta, output=ld2_pdf)
+            visualisation.html_local_dims(l_dist, l_theta, output=ld2_html)
+            visualisation.pdf_local_dims(l_dist[ind], l_theta[ind], output=ld2_seas_pdf)
+            visualisation.html_local_dims(l_dist[ind], l_theta[ind], output=ld2_seas_html)
         except:
             msg = 'Could not produce plot'
             LOGGER.exception(msg)
             # TODO: Here need produce empty pdf(s) to pass to output
-        # 
         # ====================================================
 
 
@@ -10,7 +10,8 @@ def analogs_generator(anafile, yfile, nsim=20):
     """
     Simulates nsim values of the variable y using analogues for all the dates present in the file anafile
     
-    :param anafile: path to a file with the results of the analogues
+    :param anafile: path to a file with the results of the analogues (text or binary,
+                    see blackswan.analogsearch.load_analogs)
     :param yfile: path to the file containing the data. The file should have two columns:
      - the first with the date with the following for format yyyymmdd
      - the second with the variable of interest y, columns are separated by spaces and are supposed to have headers
@@ -38,16 +39,14 @@ def analogs_generator(anafile, yfile, nsim=20):
         weights = np.random.multinomial(nsim, dat.dist / sum(dat.dist))
         return random.sample(list(np.repeat(dat.iloc[:, 0], weights)), nsim)
 
+    from blackswan.analogsearch import load_analogs
+
     ytable = pandas.read_table(yfile, sep=" ", skipinitialspace=True)
-    anatable = pandas.read_table(anafile, sep=" ", skipinitialspace=True)
-    nanalogs = len([s for s in anatable.columns if "dis" in s])
-    disttable = anatable.iloc[:, [0] + list(range(nanalogs + 1, 2 * nanalogs + 1))].copy()
-    cortable = anatable.iloc[:, [0] + list(range(2 * nanalogs + 1, 3 * nanalogs + 1))].copy()
-    anatable = anatable.iloc[:, 0:(nanalogs + 1)].copy()
+    result = load_analogs(anafile)
+    dates = pandas.Index(result.dates.astype(np.int64), name='date')
+    anatable = pandas.DataFrame(result.analogs.astype(np.int64), index=dates)
+    disttable = pandas.DataFrame(result.distances.astype(float), index=dates)
     ytable = ytable.set_index('date')
-    disttable = disttable.set_index('date')
-    cortable = cortable.set_index('date')
-    anatable = anatable.set_index('date')
     condys = list(map(generate_cond_ymean, anatable.index, np.repeat(nsim, len(anatable.index))))
     condys = pandas.DataFrame(condys)
     condys = condys.transpose()
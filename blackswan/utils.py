@@ -1,7 +1,7 @@
 import six
 import os
+import errno
 import requests
-import shutil
 from datetime import datetime as dt
 import time
 from ocgis import RequestDataset  # does not support NETCDF4
@@ -13,6 +13,8 @@ from netCDF4 import MFDataset  # does not support NETCDF4
 # from pyesgf.search import TYPE_FILE
 
 from blackswan import config
+from blackswan import catalogue
+from blackswan import cachemanager
 
 # python 2.7 - 3.#
 try:
@@ -223,7 +225,7 @@ def check_creationtime(path, url):
     """
 
     try:
-        req = requests.head(url)
+        req = http_session().head(url, timeout=60)
         LOGGER.debug('headers: %s', req.headers.keys())
         if 'Last-Modified' not in req.headers:
             return False
@@ -248,10 +250,99 @@ def check_creationtime(path, url):
     return newer
 
 
-def download(url, cache=False):
+def _validators_path(filename):
+    return filename + '.http.json'
+
+
+def _load_validators(filename):
+    """
+    returns the HTTP validators (ETag, Last-Modified) stored with a cached file
+    and the time of their last check, or an empty dict
+    """
+    import json
+
+    try:
+        with open(_validators_path(filename)) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _store_validators(filename, url, headers, previous=None):
+    """
+    stores the HTTP validators of a response with a cached file
+    """
+    import json
+    import uuid
+
+    validators = dict(previous or {})
+    validators.update(url=url, checked=time.time())
+    for key, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')]:
+        if headers.get(header):
+            validators[key] = headers[header]
+    tmp_file = '%s.%s' % (_validators_path(filename), uuid.uuid1())
+    with open(tmp_file, 'w') as fp:
+        json.dump(validators, fp)
+    os.rename(tmp_file, _validators_path(filename))
+    return validators
+
+
+def validate_cache(filename, url, ttl=None, final=None):
+    """
+    Validates a cached file with a conditional GET (If-None-Match / If-Modified-Since)
+    and downloads it again if it changed on the server. Files checked within the
+    freshness time are not validated.
+
+    :param filename: path to the cached file
+    :param url: URL of the file
+    :param ttl: freshness time in seconds (default: see config.cache_ttl, negative: never validate again)
+    :param final: time in seconds since the epoch after which the file does not change on the
+                  server anymore (e.g. the end of a reanalyses year). Once it passed, the file is
+                  validated once more, unless it was already checked after it, and never again.
+
+    :returns boolean: True if the file was downloaded again, False if it is fresh, not modified
+                      or can not be validated (e.g. server not reachable)
+    """
+    from email.utils import formatdate
+
+    ttl = config.cache_ttl() if ttl is None else ttl
+    validators = _load_validators(filename)
+    checked = validators.get('checked', 0)
+    if final is not None and time.time() >= final:
+        fresh = checked >= final
+    else:
+        fresh = ttl < 0 or time.time() - checked < ttl
+    if validators and fresh:
+        LOGGER.debug('file in cache is fresh: %s', os.path.basename(filename))
+        return False
+
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    # files cached without validators are compared by their modification time
+    headers['If-Modified-Since'] = validators.get('last_modified') or \
+        formatdate(os.path.getmtime(filename), usegmt=True)
+    try:
+        response = _get_file(url, filename, headers=headers)
+    except (requests.RequestException, IOError, OSError) as e:
+        # like check_creationtime, the cached file is used if the server is not reachable
+        LOGGER.warning('failed to validate file in cache, using cached file %s: %s', os.path.basename(filename), e)
+        return False
+    changed = response.status_code != 304
+    if changed:
+        LOGGER.info('file in cache changed on server, downloaded again: %s', os.path.basename(filename))
+    else:
+        LOGGER.info('file in cache is up-to-date: %s', os.path.basename(filename))
+    _store_validators(filename, url, response.headers, previous=validators)
+    return changed
+
+
+def download(url, cache=False, ttl=None, final=None):
     """
     Downloads URL using the Python requests module to the current directory.
     :param cache: if True then files will be downloaded to a cache directory.
+    :param ttl: freshness time of a cached file in seconds, see validate_cache
+    :param final: time after which the file does not change anymore, see validate_cache
     """
     try:
         if cache:
@@ -260,24 +351,80 @@ def download(url, cache=False):
             filename = os.path.join(config.cache_path(), parsed_url.netloc, parsed_url.path.strip('/'))
             if os.path.exists(filename):
                 LOGGER.info('file already in cache: %s', os.path.basename(filename))
-                if check_creationtime(filename, url):
-                    LOGGER.info('file in cache older than archive file, downloading: %s ', os.path.basename(filename))
-                    os.remove(filename)
-                    filename = download_file(url, out=filename)
+                validate_cache(filename, url, ttl=ttl, final=final)
+                cachemanager.touch(filename)
             else:
-                if not os.path.exists(os.path.dirname(filename)):
-                    os.makedirs(os.path.dirname(filename))
+                make_dirs(os.path.dirname(filename))
                 LOGGER.info('downloading: %s', url)
-                filename = download_file(url, out=filename)
+                response = _get_file(url, filename)
+                _store_validators(filename, url, response.headers)
                 # make softlink to current dir
                 # os.symlink(filename, os.path.basename(filename))
 # filename = os.path.basename(filename)
         else:
             filename = download_file(url)
     except Exception:
-        LOGGER.exception('failed to download data')
+        msg = 'failed to download data: %s' % url
+        LOGGER.exception(msg)
+        raise Exception(msg)
     return filename
 
+
+def download_files(urls, cache=False, workers=None, retries=2, backoff=1., ttl=None, final=None):
+    """
+    Downloads several URLs concurrently with a bounded pool of threads,
+    see download.
+
+    :param urls: list of URLs
+    :param cache: if True then files will be downloaded to a cache directory.
+    :param workers: number of concurrent downloads (default: see config.download_workers)
+    :param retries: number of further attempts for a failed download
+    :param backoff: seconds to wait before the first retry, doubled for each further one
+    :param ttl: freshness time of the cached files in seconds, or list with one per URL,
+                see validate_cache
+    :param final: time after which the files do not change anymore, or list with one per URL,
+                  see validate_cache
+
+    :returns list: downloaded files in the order of the URLs (None for failed downloads)
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if workers is None:
+        workers = config.download_workers()
+    workers = max(1, min(int(workers), len(urls)))
+
+    ttls = ttl if isinstance(ttl, (list, tuple)) else [ttl] * len(urls)
+    finals = final if isinstance(final, (list, tuple)) else [final] * len(urls)
+
+    def _fetch(args):
+        url, url_ttl, url_final = args
+        for attempt in range(retries + 1):
+            try:
+                return download(url, cache=cache, ttl=url_ttl, final=url_final), None
+            except Exception as e:
+                error = e
+                if attempt < retries:
+                    LOGGER.info('download of %s failed, retrying: %s', url, e)
+                    time.sleep(backoff * 2 ** attempt)
+        return None, error
+
+    if not urls:
+        return []
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_fetch, list(zip(urls, ttls, finals)))
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = ['%s (%s)' % (url, error) for url, (_, error) in zip(urls, results) if error is not None]
+    if failed:
+        LOGGER.error('failed to download %s of %s files: %s', len(failed), len(urls), ', '.join(failed))
+    files = [filename for filename, _ in results]
+    if cache:
+        cachemanager.prune(keep=files)
+    return files
+
 # will be in == eggshell ==
 # now we use ocgis elsewhere...
 # def calc_grouping(grouping):
@@ -343,16 +490,116 @@ def download(url, cache=False):
 #     return calc_grouping
 
 
-def download_file(url, out=None, verify=False):
+_SESSION = {}
+
+
+def http_session():
+    """
+    returns the HTTP session shared by the downloads of this process, keeping
+    the connections to the data servers alive
+
+    :returns requests.Session: session
+    """
+    if 'session' not in _SESSION:
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(config.download_workers(), 10))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _SESSION['session'] = session
+    return _SESSION['session']
+
+
+def download_file(url, out=None, verify=False, chunk_size=1024 * 1024):
+    """
+    Downloads an URL to a file. The data is written to a ``.part`` file, which
+    is renamed when it is complete (size as given by Content-Length). An
+    interrupted download is continued from its ``.part`` file with an HTTP
+    Range request.
+
+    :param url: URL
+    :param out: path of the file (default: name of the URL in the current directory)
+    :param verify: verify the SSL certificate of the server
+    :param chunk_size: size of the chunks written in bytes
+
+    :returns str: path of the file
+    """
     if out:
         local_filename = out
     else:
         local_filename = url.split('/')[-1]
-    r = requests.get(url, stream=True, verify=verify)
-    with open(local_filename, 'wb') as fp:
-        shutil.copyfileobj(r.raw, fp)
+    _get_file(url, local_filename, verify=verify, chunk_size=chunk_size)
     return local_filename
 
+
+def _get_file(url, local_filename, verify=False, chunk_size=1024 * 1024, headers=None):
+    """
+    GET request of an URL written to a file, see download_file
+
+    :param headers: further request headers (e.g. conditional headers)
+
+    :returns requests.Response: response (status 304: file not modified and not written)
+    """
+    part_filename = local_filename + '.part'
+    session = http_session()
+
+    # no content encoding: the size of the file is the Content-Length
+    request_headers = dict(headers or {}, **{'Accept-Encoding': 'identity'})
+    if headers:
+        # a partial file may belong to another version than the validated one
+        if os.path.exists(part_filename):
+            os.remove(part_filename)
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+    if offset > 0:
+        # the range is only sent back if the file on the server is still the version
+        # the partial file was started with, otherwise the whole file is
+        validators = _load_validators(part_filename)
+        if validators.get('etag') and not validators['etag'].startswith('W/'):
+            request_headers['If-Range'] = validators['etag']
+        elif validators.get('last_modified'):
+            request_headers['If-Range'] = validators['last_modified']
+        else:
+            offset = 0
+        if offset > 0:
+            request_headers['Range'] = 'bytes=%s-' % offset
+    r = session.get(url, stream=True, verify=verify, headers=request_headers, timeout=60)
+    if r.status_code == 304:
+        r.close()
+        return r
+    mismatch = r.status_code == 416 or \
+        (r.status_code == 206 and not r.headers.get('Content-Range', '').startswith('bytes %s-' % offset))
+    if offset > 0 and mismatch:
+        # the partial file does not match the file on the server anymore
+        r.close()
+        LOGGER.info('partial download not resumable, starting again: %s', url)
+        os.remove(part_filename)
+        return _get_file(url, local_filename, verify=verify, chunk_size=chunk_size, headers=headers)
+    r.raise_for_status()
+    if offset > 0 and r.status_code == 206:
+        LOGGER.info('resuming download at %s bytes: %s', offset, url)
+        mode = 'ab'
+    else:
+        offset = 0
+        mode = 'wb'
+        _store_validators(part_filename, url, r.headers)
+    length = r.headers.get('Content-Length')
+    expected = offset + int(length) if length is not None else None
+
+    try:
+        with open(part_filename, mode) as fp:
+            for chunk in r.raw.stream(chunk_size, decode_content=False):
+                fp.write(chunk)
+    finally:
+        r.close()
+    size = os.path.getsize(part_filename)
+    if expected is not None and size != expected:
+        # the partial file is kept to resume the download
+        raise IOError('incomplete download of %s: %s of %s bytes' % (url, size, expected))
+    os.rename(part_filename, local_filename)
+    if os.path.exists(_validators_path(part_filename)):
+        os.remove(_validators_path(part_filename))
+    return r
+
 # == eggshell ==
 # 
 # def drs_filename(resource, skip_timestamp=False, skip_format=False,
@@ -460,8 +707,12 @@ def make_dirs(directory):
 
     :param direcory: directory path
     """
-    if not os.path.exists(directory):
+    # several threads or processes may create the directory at the same time
+    try:
         os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
 
 
 def prepare_static_folder():
@@ -485,6 +736,10 @@ def get_calendar(resource, variable=None):
     if type(resource) != list:
         resource = [resource]
 
+    entry = catalogue.entry(resource[0])
+    if entry is not None and entry['time_values'] is not None:
+        return str(entry['time_calendar']), str(entry['time_units'])
+
     try:
         if len(resource) > 1:
             ds = MFDataset(resource)
@@ -594,6 +849,26 @@ def get_frequency(resource):
     return frequency
 
 
+def _dimensions(resource, variable):
+    """
+    returns the dimension names of a variable, from the catalogue if possible
+    """
+    if type(resource) != list:
+        resource = [resource]
+
+    entry = catalogue.entry(resource[0])
+    if entry is not None and variable in entry['variables']:
+        return list(entry['variables'][variable])
+
+    if len(resource) == 1:
+        ds = Dataset(resource[0])
+    else:
+        ds = MFDataset(resource)
+    dims = list(ds.variables[variable].dimensions)
+    ds.close()
+    return dims
+
+
 def get_index_lat(resource, variable=None):
     """
     returns the dimension index of the latitude values
@@ -606,15 +881,7 @@ def get_index_lat(resource, variable=None):
 
     if variable is None:
         variable = get_variable(resource)
-    if type(resource) != list:
-        resource = [resource]
-    if len(resource) == 1:
-        ds = Dataset(resource[0])
-    else:
-        ds = MFDataset(resource)
-
-    var = ds.variables[variable]
-    dims = list(var.dimensions)
+    dims = _dimensions(resource, variable)
 
     if 'rlat' in dims:
         index = dims.index('rlat')
@@ -639,15 +906,7 @@ def get_index_lon(resource, variable=None):
 
     if variable is None:
         variable = get_variable(resource)
-    if type(resource) != list:
-        resource = [resource]
-    if len(resource) == 1:
-        ds = Dataset(resource[0])
-    else:
-        ds = MFDataset(resource)
-
-    var = ds.variables[variable]
-    dims = list(var.dimensions)
+    dims = _dimensions(resource, variable)
 
     if 'rlon' in dims:
         index = dims.index('rlon')
@@ -660,6 +919,30 @@ def get_index_lon(resource, variable=None):
     return index
 
 
+def _catalogued_time(resource):
+    """
+    returns the time values, units and calendar of netCDF file(s) from the catalogue
+
+    :param resource: list of path(s) to netCDF file(s)
+
+    :return tuple: values, units, calendar or None if not all files are catalogued
+    """
+    entries = catalogue.entries(resource)
+    if entries is None or any(e['time_values'] is None for e in entries):
+        return None
+    values = [v for e in entries for v in e['time_values']]
+    # like MFDataset, the attributes of the first file apply to all
+    return values, entries[0]['time_units'], entries[0]['time_calendar']
+
+
+def _num2date(values, units, calendar):
+    if units is not None and calendar is not None:
+        return num2date(values, units, calendar)
+    elif units is not None:
+        return num2date(values, units)
+    return num2date(values)
+
+
 def get_timerange(resource):
     """
     returns from/to timestamp of given netcdf file(s).
@@ -675,6 +958,20 @@ def get_timerange(resource):
         resource = [resource]
     LOGGER.debug('length of recources: %s files' % len(resource))
 
+    cached = _catalogued_time(resource)
+    if cached is not None:
+        values, units, calendar = cached
+        try:
+            s = _num2date(values[0], units, calendar)
+            e = _num2date(values[-1], units, calendar)
+        except Exception:
+            msg = 'failed to get time range'
+            LOGGER.exception(msg)
+            raise Exception(msg)
+        start = '%s%s%s' % (s.year, str(s.month).zfill(2), str(s.day).zfill(2))
+        end = '%s%s%s' % (e.year, str(e.month).zfill(2), str(e.day).zfill(2))
+        return start, end
+
     try:
         if len(resource) > 1:
             ds = MFDataset(resource)
@@ -719,6 +1016,11 @@ def get_time(resource):
     if type(resource) != list:
         resource = [resource]
 
+    cached = _catalogued_time(resource)
+    if cached is not None:
+        timestamps = _num2date(*cached)
+        return [dt.strptime(str(i), '%Y-%m-%d %H:%M:%S') for i in timestamps]
+
     try:
         if len(resource) > 1:
             ds = MFDataset(resource)
@@ -778,8 +1080,16 @@ def get_variable(resource):
 
     :returns str: variable name
     """
+    first = resource[0] if type(resource) == list else resource
+    entry = catalogue.entry(first)
+    if entry is not None and entry.get('variable'):
+        return entry['variable']
+
     rds = RequestDataset(resource)
-    return rds.variable
+    variable = rds.variable
+    if entry is not None:
+        catalogue.update(first, variable=variable)
+    return variable
 
 
 def get_values(resource, variable=None):
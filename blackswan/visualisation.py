@@ -615,6 +615,97 @@ def pdf_pie_ld(NAOp, NAOn, BLO, AR, MIX, output='wr_dist.pdf'):
     return pdffilename
 
 
+def _fig_local_dims(dim, theta, limits=True):
+    """
+    scatter plot of local dimensions and persistence with density contours
+    and the 0.15 and 0.85 quantiles as dotted lines
+
+    :param dim: local dimensions
+    :param theta: persistence
+    :param limits: fixed axes limits (dimension 0 - 26, persistence 0.3 - 0.9)
+
+    :return: matplotlib figure
+    """
+    from matplotlib.colors import LinearSegmentedColormap
+    from scipy.stats import gaussian_kde
+    from scipy.stats.mstats import mquantiles
+
+    dim = np.asarray(dim, dtype=float)
+    theta = np.asarray(theta, dtype=float)
+    valid = np.isfinite(dim) & np.isfinite(theta)
+    x, y = dim[valid], theta[valid]
+
+    fig = plt.figure(figsize=(35 / 2.54, 20 / 2.54))
+    ax = fig.add_subplot(111)
+    ax.scatter(x, y, s=6, c='k')
+    try:
+        kde = gaussian_kde(np.vstack([x, y]))
+        xx, yy = np.mgrid[x.min():x.max():100j, y.min():y.max():100j]
+        density = kde(np.vstack([xx.ravel(), yy.ravel()])).reshape(xx.shape)
+        cmap = LinearSegmentedColormap.from_list('density', ['green', 'red'])
+        filled = ax.contourf(xx, yy, density, 8, cmap=cmap, alpha=0.5)
+        ax.contour(xx, yy, density, filled.levels, colors='k', linewidths=0.5)
+        fig.colorbar(filled, ax=ax, label='Density')
+    except Exception as e:
+        LOGGER.debug('no density contours for local dimensions: %s', e)
+
+    # quantiles as quantile(type=5) in R
+    if x.size > 0:
+        for q in mquantiles(x, [0.15, 0.85], alphap=0.5, betap=0.5):
+            ax.axvline(q, linestyle=':', color='k')
+        for q in mquantiles(y, [0.15, 0.85], alphap=0.5, betap=0.5):
+            ax.axhline(q, linestyle=':', color='k')
+
+    ax.set_xlabel('Local dimension')
+    ax.set_ylabel('Persistence')
+    if limits:
+        ax.set_xlim(0, 26)
+        ax.set_ylim(0.3, 0.9)
+    return fig
+
+
+def pdf_local_dims(dim, theta, output='local_dims.pdf'):
+    """
+    plots local dimensions against persistence with density contours
+
+    :param dim: local dimensions
+    :param theta: persistence
+    :param output: path of the pdf file
+
+    :return str: path to the pdf file
+    """
+    fig = _fig_local_dims(dim, theta)
+    fig.savefig(output, dpi=300)
+    plt.close(fig)
+    return output
+
+
+def html_local_dims(dim, theta, output='local_dims.html'):
+    """
+    html page with the plot of local dimensions against persistence
+    (axes limits from the data)
+
+    :param dim: local dimensions
+    :param theta: persistence
+    :param output: path of the html file
+
+    :return str: path to the html file
+    """
+    from io import BytesIO
+
+    fig = _fig_local_dims(dim, theta, limits=False)
+    svg = BytesIO()
+    fig.savefig(svg, format='svg')
+    plt.close(fig)
+    # inline svg element without the xml declaration and doctype of the svg file
+    svg = svg.getvalue().decode('utf-8')
+    svg = svg[svg.index('<svg'):]
+    with open(output, 'w') as fp:
+        fp.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Local dimensions</title></head>\n'
+                 '<body>\n%s\n</body>\n</html>\n' % svg)
+    return output
+
+
 # == eggshell ==
 # def map_gbifoccurrences(latlon, dir='.', file_extension='png'):
 #     """
@@ -0,0 +1,35 @@
+import numpy as np
+
+from datetime import date, timedelta
+
+from blackswan import analogsearch
+from blackswan import analogindex
+
+
+def test_find_analogs_index():
+    rng = np.random.RandomState(7)
+    arc = rng.normal(size=(1200, 30))
+    sim = rng.normal(size=(15, 30))
+    arc_dates = [date(1980, 1, 1) + timedelta(days=i) for i in range(1200)]
+    sim_dates = [date(2015, 12, 20) + timedelta(days=i) for i in range(15)]
+
+    basis = analogsearch.eof_basis(arc, variance=0.6)
+    index = analogindex.AnalogIndex(basis.pcs, arc_dates, bucket=7)
+    # same analogs as the exact search on the principal components
+    reduced = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5, seasonwin=20, basis=basis)
+    result = analogindex.find_analogs_index(sim, arc, sim_dates, arc_dates, index, basis, nanalog=5,
+                                            seasonwin=20)
+    assert (result.index == reduced.index).all()
+    assert np.allclose(result.distances, reduced.distances)
+
+    # the candidates of the time window are picked on the first day only
+    reduced = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5, seasonwin=20,
+                                        timewin=2, basis=basis, rerank=40)
+    result = analogindex.find_analogs_index(sim, arc, sim_dates, arc_dates, index, basis, nanalog=5,
+                                            seasonwin=20, timewin=2, rerank=40)
+    assert analogindex.recall(result, reduced) > 0.5
+
+    exact = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5, seasonwin=20, timewin=1)
+    result = analogindex.find_analogs_index(sim, arc, sim_dates, arc_dates, index, basis, nanalog=5,
+                                            seasonwin=20, rerank=200)
+    assert 0 < analogindex.recall(result, exact) <= 1
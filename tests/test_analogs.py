@@ -0,0 +1,107 @@
+import os
+import sys
+
+from multiprocessing import cpu_count
+
+import numpy as np
+import pytest
+
+from netCDF4 import Dataset
+
+from blackswan import analogs, config
+from blackswan.analogsearch import load_analogs
+
+
+def _write(filename, days, seed, lat='lat', lon='lon'):
+    rng = np.random.RandomState(seed)
+    ds = Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+    ds.createDimension('time', None)
+    ds.createDimension(lat, 4)
+    ds.createDimension(lon, 5)
+    time = ds.createVariable('time', 'f8', ('time',))
+    time.units = 'days since 2000-01-01 00:00:00'
+    time.calendar = 'standard'
+    time[:] = days
+    ds.createVariable(lat, 'f4', (lat,))[:] = [40, 45, 50, 55]
+    ds.createVariable(lon, 'f4', (lon,))[:] = [-20, -10, 0, 10, 20]
+    ds.createVariable('slp', 'f4', ('time', lat, lon))[:] = rng.normal(size=(len(days), 4, 5))
+    ds.close()
+    return filename
+
+
+def test_run_analogs_archive(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    _write('archive.nc', np.arange(730), 0)
+    _write('simulation.nc', np.arange(730, 760), 1)
+    config_file = analogs.get_configfile(['archive.nc', 'simulation.nc', 'analogs.txt'], nanalog=5,
+                                         seasoncyc_base='archive.nc', seasoncyc_sim='simulation.nc',
+                                         config_file='config.txt')
+    expected = load_analogs(analogs.run_analogs(config_file))
+
+    archive = analogs.prepare_archive('archive.nc', 'slp')
+    output = analogs.run_analogs(config_file, archive=archive)
+    result = load_analogs(output)
+    # read from the binary file written with the text file
+    assert result.distances.dtype == np.float32
+    assert result.analogs.shape == (30, 5)
+    assert np.array_equal(result.dates, expected.dates)
+    assert np.array_equal(result.analogs, expected.analogs)
+    assert np.allclose(result.distances, expected.distances)
+    assert result.analogs[0, 0] // 10000 in [2000, 2001]
+
+
+def test_prepare_archive_coordinates(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    filename = _write(str(tmpdir.join('latitude.nc')), np.arange(10), 0, lat='latitude', lon='longitude')
+    archive = analogs.prepare_archive(filename, 'slp')
+    assert list(archive.lat) == [40, 45, 50, 55]
+    assert list(archive.lon) == [-20, -10, 0, 10, 20]
+
+    filename = _write(str(tmpdir.join('unknown.nc')), np.arange(10), 0, lat='j', lon='i')
+    with pytest.raises(Exception):
+        analogs.prepare_archive(filename, 'slp')
+
+
+_CASTF90 = '''#!%s
+import os
+import sys
+import time
+
+config = sys.argv[1]
+running = os.path.join(os.path.dirname(config), 'running')
+marker = os.path.join(running, os.path.basename(config))
+open(marker, 'w').close()
+time.sleep(0.5)
+concurrent = len(os.listdir(running))
+os.remove(marker)
+if 'fail' in config:
+    sys.exit('analogs search failed')
+with open(config + '.out', 'w') as fp:
+    fp.write('%%s %%s %%s' %% (config, os.environ['OMP_NUM_THREADS'], concurrent))
+'''
+
+
+def test_call_castf90(tmpdir, monkeypatch):
+    bindir = tmpdir.mkdir('bin')
+    castf90 = bindir.join('analogue.out')
+    castf90.write(_CASTF90 % sys.executable)
+    castf90.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    tmpdir.mkdir('running')
+
+    configfiles = [str(tmpdir.join('config%s.txt' % i)) for i in range(4)]
+    finished = []
+    analogs.call_castf90(configfiles, workers=2, status=finished.append)
+    assert sorted(finished) == [0, 1, 2, 3]
+    concurrent = []
+    for config_file in configfiles:
+        name, threads, running = open(config_file + '.out').read().split()
+        assert name == config_file
+        assert int(threads) == max(1, cpu_count() // 2)
+        concurrent.append(int(running))
+    assert max(concurrent) == 2
+
+    with pytest.raises(Exception):
+        analogs.call_castf90(configfiles[:1] + [str(tmpdir.join('config_fail.txt'))], workers=2)
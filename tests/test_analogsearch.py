@@ -0,0 +1,178 @@
+import numpy as np
+
+from datetime import date, timedelta
+
+from blackswan import analogsearch
+
+
+def _dates(start, n):
+    return [start + timedelta(days=i) for i in range(n)]
+
+
+def _brute_force(sim, arc, sim_dates, arc_dates, nanalog, seasonwin, timewin):
+    sim = sim.reshape(sim.shape[0], -1)
+    arc = arc.reshape(arc.shape[0], -1)
+    sim_doy = analogsearch.dayofyear(sim_dates)
+    arc_doy = analogsearch.dayofyear(arc_dates)
+    index = []
+    for i in range(len(sim)):
+        win = min(timewin, len(sim) - i)
+        cands = []
+        for j in range(len(arc) - win + 1):
+            diff = abs(sim_doy[i] - arc_doy[j])
+            if min(diff, 366 - diff) > seasonwin:
+                continue
+            dist = np.mean([np.sqrt(np.mean((sim[i + k] - arc[j + k]) ** 2)) for k in range(win)])
+            cands.append((dist, j))
+        cands.sort()
+        index.append([j for _, j in cands[:nanalog]])
+    return np.array(index)
+
+
+def test_find_analogs():
+    rng = np.random.RandomState(42)
+    arc = rng.normal(size=(1500, 5, 7))
+    sim = rng.normal(size=(20, 5, 7))
+    arc_dates = _dates(date(1990, 1, 1), 1500)
+    sim_dates = _dates(date(2010, 12, 20), 20)
+
+    for timewin in [1, 3]:
+        result = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5,
+                                           seasonwin=15, timewin=timewin, block=6)
+        expected = _brute_force(sim, arc, sim_dates, arc_dates, 5, 15, timewin)
+        assert (result.index == expected).all()
+        assert (np.diff(result.distances, axis=1) >= 0).all()
+        assert result.correlations.shape == (20, 5)
+
+
+def test_find_analogs_self():
+    rng = np.random.RandomState(0)
+    arc = rng.normal(size=(400, 4, 4))
+    arc_dates = _dates(date(2000, 1, 1), 400)
+
+    for distfun in analogsearch._DISTANCES_:
+        result = analogsearch.find_analogs(arc[100:110], arc, arc_dates[100:110], arc_dates,
+                                           nanalog=3, distfun=distfun)
+        assert (result.index[:, 0] == np.arange(100, 110)).all()
+        assert np.allclose(result.correlations[:, 0], 1.)
+
+
+def test_write_analogs(tmpdir):
+    rng = np.random.RandomState(1)
+    arc = rng.normal(size=(200, 3, 3))
+    arc_dates = _dates(date(2000, 1, 1), 200)
+    result = analogsearch.find_analogs(arc[:5], arc, arc_dates[:5], arc_dates, nanalog=4)
+    output = analogsearch.write_analogs(result, str(tmpdir.join('output.txt')))
+    lines = open(output).read().splitlines()
+    assert len(lines) == 6
+    assert lines[0].split()[0] == 'date'
+    assert len(lines[1].split()) == 1 + 3 * 4
+    assert lines[1].split()[0] == '20000101'
+
+
+def test_find_analogs_eof():
+    rng = np.random.RandomState(3)
+    # fields with a few dominant patterns
+    patterns = rng.normal(size=(4, 60))
+    arc = np.dot(rng.normal(size=(800, 4)), patterns) + 0.05 * rng.normal(size=(800, 60))
+    sim = np.dot(rng.normal(size=(10, 4)), patterns) + 0.05 * rng.normal(size=(10, 60))
+    arc_dates = _dates(date(1990, 1, 1), 800)
+    sim_dates = _dates(date(2010, 1, 1), 10)
+
+    basis = analogsearch.eof_basis(arc, variance=0.95)
+    assert basis.eofs.shape[0] <= 5
+    exact = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5, timewin=2)
+    reduced = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=5, timewin=2,
+                                        basis=basis, rerank=30)
+    assert (reduced.index == exact.index).all()
+    assert np.allclose(reduced.distances, exact.distances)
+
+
+def test_reusable_days():
+    rng = np.random.RandomState(5)
+    arc = rng.normal(size=(600, 4, 4))
+    sim = rng.normal(size=(12, 4, 4))
+    arc_dates = _dates(date(1990, 1, 1), 600)
+    sim_dates = _dates(date(2010, 3, 1), 12)
+
+    full = analogsearch.find_analogs(sim[1:], arc, sim_dates[1:], arc_dates, nanalog=3, timewin=3)
+    previous = analogsearch.find_analogs(sim[:10], arc, sim_dates[:10], arc_dates, nanalog=3, timewin=3)
+    rows = analogsearch.reusable_days(previous, sim_dates[1:], timewin=3)
+    assert (rows == np.arange(1, 8)).all()
+
+    new = analogsearch.find_analogs(sim[8:], arc, sim_dates[8:], arc_dates, nanalog=3, timewin=3)
+    result = analogsearch.concat_analogs([analogsearch.take_days(previous, rows), new])
+    assert (result.dates == analogsearch.date_ints(full.dates)).all()
+    assert (result.index == full.index).all()
+    assert np.allclose(result.distances, full.distances)
+
+
+def test_find_analogs_batch():
+    rng = np.random.RandomState(11)
+    arcs = [rng.normal(size=(500, 4, 5)), rng.normal(size=(400, 4, 5))]
+    arcs_dates = [_dates(date(1950, 1, 1), 500), _dates(date(1990, 6, 1), 400)]
+    sims = [rng.normal(size=(9, 4, 5))]
+    sims_dates = [_dates(date(2015, 1, 1), 9)]
+
+    for distfun in ['rms', 'mahalanobis']:
+        results = analogsearch.find_analogs_batch(sims, arcs, sims_dates, arcs_dates, nanalog=4,
+                                                  timewin=2, distfun=distfun, block=4)
+        for arc, arc_dates, result in zip(arcs, arcs_dates, results[0]):
+            single = analogsearch.find_analogs(sims[0], arc, sims_dates[0], arc_dates, nanalog=4,
+                                               timewin=2, distfun=distfun, block=4)
+            assert (result.index == single.index).all()
+            assert np.allclose(result.distances, single.distances)
+            assert np.allclose(result.correlations, single.correlations)
+
+
+def test_find_analogs_tiles():
+    rng = np.random.RandomState(8)
+    arc = rng.normal(size=(700, 4, 4))
+    sim = rng.normal(size=(12, 4, 4))
+    arc_dates = _dates(date(1990, 1, 1), 700)
+    sim_dates = _dates(date(2010, 1, 10), 12)
+
+    for distfun in ['rms', 'mahalanobis', 'S1']:
+        full = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=6, timewin=3,
+                                         distfun=distfun, tile=700)
+        tiled = analogsearch.find_analogs(sim, arc, sim_dates, arc_dates, nanalog=6, timewin=3,
+                                          distfun=distfun, block=5, tile=4)
+        assert (tiled.index == full.index).all()
+        assert np.allclose(tiled.distances, full.distances)
+    assert analogsearch.tile_size(100, memory=3200 * 100) == 100
+
+
+def test_dayofyear_calendars():
+    assert (analogsearch.dayofyear(np.array([20010228, 20010301, 20001231])) == [59, 61, 366]).all()
+    doy = analogsearch.dayofyear(np.array([19500101, 19500230, 19500301, 19501230]), calendar='360_day')
+    assert (doy == [1, 61, 62, 366]).all()
+
+    runs = analogsearch.season_runs(np.tile(np.arange(1, 367), 3), np.array([1]), 5)
+    assert runs == [(0, 6), (361, 372), (727, 738), (1093, 1098)]
+
+
+def test_analog_correlations():
+    rng = np.random.RandomState(2)
+    arc = rng.normal(size=(300, 25))
+    arc_dates = _dates(date(2000, 1, 1), 300)
+    result = analogsearch.find_analogs(arc[50:60], arc, arc_dates[50:60], arc_dates, nanalog=5)
+    cached = analogsearch.find_analogs(arc[50:60], arc, arc_dates[50:60], arc_dates, nanalog=5,
+                                       arc_ranks=analogsearch.field_ranks(arc))
+    expected = [analogsearch.rank_correlation(arc[50 + i], arc[result.index[i]]) for i in range(10)]
+    assert np.allclose(result.correlations, expected)
+    assert np.allclose(cached.correlations, expected)
+
+
+def test_load_analogs(tmpdir):
+    rng = np.random.RandomState(4)
+    arc = rng.normal(size=(200, 3, 3))
+    arc_dates = _dates(date(2000, 1, 1), 200)
+    result = analogsearch.find_analogs(arc[:5], arc, arc_dates[:5], arc_dates, nanalog=4)
+    text = analogsearch.load_analogs(analogsearch.write_analogs(result, str(tmpdir.join('output.txt'))))
+    binary = analogsearch.load_analogs(analogsearch.save_analogs(result, str(tmpdir.join('output.npz'))))
+    for loaded in [text, binary]:
+        assert (loaded.dates == analogsearch.date_ints(result.dates)).all()
+        assert (loaded.analogs[0] == analogsearch.date_ints(result.analogs[0])).all()
+        assert np.allclose(loaded.distances, result.distances, atol=1e-6)
+        assert np.allclose(loaded.correlations, result.correlations, atol=1e-6)
+    assert binary.distances.dtype == np.float32
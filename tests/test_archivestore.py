@@ -0,0 +1,43 @@
+import numpy as np
+
+from datetime import date
+
+from blackswan import archivestore
+
+
+def test_store_archive(tmpdir, monkeypatch):
+    monkeypatch.setattr(archivestore.config, 'cache_path', lambda: str(tmpdir))
+    key = archivestore.archive_key('NCEP', 'slp', None, [-20, 30, 40, 70],
+                                   [date(1948, 1, 1), date(2016, 12, 31)], 'None')
+    assert key != archivestore.archive_key('NCEP', 'slp', None, [-20, 30, 40, 70],
+                                           [date(1948, 1, 1), date(2016, 12, 31)], 'base')
+    assert archivestore.load_archive(key) is None
+
+    archive = archivestore.Archive(data=np.ones((3, 2, 2)), dates=np.array([19480101, 19480102, 19480103]),
+                                   lat=np.array([30., 40.]), lon=np.array([0., 10.]), cycle=None)
+    archivestore.store_archive(key, archive)
+    loaded = archivestore.load_archive(key)
+    assert loaded.data.dtype == np.float32
+    assert (loaded.dates == archive.dates).all()
+    assert loaded.cycle is None
+
+    from blackswan.analogsearch import eof_basis
+    basis = eof_basis(np.random.RandomState(0).normal(size=(50, 6)), variance=0.8)
+    assert archivestore.load_basis(key, 0.8) is None
+    archivestore.store_basis(key, 0.8, basis)
+    assert (archivestore.load_basis(key, 0.8).eofs == basis.eofs).all()
+
+    from blackswan.analogindex import AnalogIndex
+    archivestore.store_index(key, 0.8, AnalogIndex(basis.pcs, archive.dates.repeat(17)[:50]))
+    assert len(archivestore.load_index(key, 0.8)) == 50
+
+
+def test_covers_period():
+    period = [date(1948, 1, 1), date(1950, 12, 31)]
+    dates = np.array([19480101, 19480615, 19481231, 19490101, 19491231, 19500101, 19501231])
+    archive = archivestore.Archive(data=None, dates=dates, lat=None, lon=None, cycle=None)
+    assert archivestore.covers_period(archive, period)
+    # a missing year (failed download) or a short period is rejected
+    assert not archivestore.covers_period(archive._replace(dates=dates[[0, 1, 2, 5, 6]]), period)
+    assert not archivestore.covers_period(archive._replace(dates=dates[:-1]), period)
+    assert not archivestore.covers_period(archive._replace(dates=dates[1:]), period)
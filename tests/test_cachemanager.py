@@ -0,0 +1,58 @@
+import os
+import time
+
+from blackswan import cachemanager
+
+
+def test_prune(tmpdir, monkeypatch):
+    cache = tmpdir.mkdir('cache')
+    monkeypatch.setattr(cachemanager.config, 'cache_path', lambda: str(cache))
+    monkeypatch.setattr(cachemanager.config, 'cache_pinned', lambda: ['host/*/slp.2001.nc'])
+    monkeypatch.setattr(cachemanager.config, 'cache_grace', lambda: 600)
+    data = cache.mkdir('host').mkdir('data')
+    for i, year in enumerate(range(2000, 2005)):
+        f = data.join('slp.%s.nc' % year)
+        f.write('x' * 1000)
+        data.join('slp.%s.nc.http.json' % year).write('{}')
+        os.utime(str(f), (1000. * i, 1000. * i))
+        os.utime(str(f) + '.http.json', (1000. * i, 1000. * i))
+    # recent access of the oldest file
+    cachemanager.touch(str(data.join('slp.2000.nc')))
+    cachemanager.pin('host/data/slp.2003.nc')
+
+    entries = cachemanager.entries()
+    assert [e.name for e in entries][:4] == ['host/data/slp.%s.nc' % y for y in [2001, 2002, 2003, 2004]]
+    assert entries[0].size == 1002 and len(entries[0].files) == 2
+    assert cachemanager.usage() == (5010, 2004, 5)
+
+    assert cachemanager.prune(budget=0) == []
+    evicted = cachemanager.prune(budget=3500, dry_run=True)
+    assert [e.name for e in evicted] == ['host/data/slp.2002.nc', 'host/data/slp.2004.nc']
+    assert cachemanager.usage()[2] == 5
+
+    # files of the current request are kept
+    evicted = cachemanager.prune(budget=3500, dry_run=True, keep=[str(data.join('slp.2002.nc'))])
+    assert [e.name for e in evicted] == ['host/data/slp.2004.nc']
+
+    cachemanager.unpin('host/data/slp.2003.nc')
+    evicted = cachemanager.prune(budget=3500)
+    assert [e.name for e in evicted] == ['host/data/slp.2002.nc', 'host/data/slp.2003.nc']
+    assert sorted(os.listdir(str(data))) == ['slp.%s.nc%s' % (y, s) for y in [2000, 2001, 2004]
+                                             for s in ['', '.http.json']]
+    assert cachemanager.parse_size('1.5kb') == 1536
+
+
+def test_prune_grace(tmpdir, monkeypatch):
+    cache = tmpdir.mkdir('cache')
+    monkeypatch.setattr(cachemanager.config, 'cache_path', lambda: str(cache))
+    monkeypatch.setattr(cachemanager.config, 'cache_pinned', lambda: [])
+    f = cache.join('slp.2000.nc')
+    f.write('x' * 1000)
+    # used by a process started two hours ago
+    os.utime(str(f), (time.time() - 7200, time.time() - 7200))
+
+    monkeypatch.setattr(cachemanager.config, 'cache_grace', lambda: 21600)
+    assert cachemanager.prune(budget=10, dry_run=True) == []
+    monkeypatch.setattr(cachemanager.config, 'cache_grace', lambda: 3600)
+    assert [e.name for e in cachemanager.prune(budget=10, dry_run=True)] == ['slp.2000.nc']
+    assert cachemanager.prune(budget=10, grace=21600, dry_run=True) == []
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+from netCDF4 import Dataset
+
+from blackswan import catalogue
+
+
+def _write(filename, days, units='days since 2000-01-01', calendar='standard'):
+    ds = Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+    ds.createDimension('time', None)
+    ds.createDimension('level', 2)
+    ds.createDimension('lat', 3)
+    ds.createDimension('lon', 4)
+    time = ds.createVariable('time', 'f8', ('time',))
+    time.units = units
+    time.calendar = calendar
+    time[:] = days
+    ds.createVariable('level', 'f4', ('level',))[:] = [500, 1000]
+    ds.createVariable('lat', 'f4', ('lat',))[:] = [40, 50, 60]
+    ds.createVariable('lon', 'f4', ('lon',))[:] = [-20, -10, 0, 10]
+    slp = ds.createVariable('slp', 'f4', ('time', 'level', 'lat', 'lon'))
+    slp[:] = np.zeros((len(days), 2, 3, 4))
+    ds.close()
+    return filename
+
+
+def test_catalogue(tmpdir, monkeypatch):
+    monkeypatch.setattr(catalogue.config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    first = _write(str(tmpdir.join('slp.2000.nc')), np.arange(366))
+    second = _write(str(tmpdir.join('slp.2001.nc')), np.arange(366, 731))
+
+    entry = catalogue.entry(first)
+    assert entry['variables']['slp'] == ['time', 'level', 'lat', 'lon']
+    assert entry['coords'] == {'level': [500, 1000], 'lat': [40, 50, 60], 'lon': [-20, -10, 0, 10]}
+    assert entry['time_values'][-1] == 365
+    assert (entry['time_units'], entry['time_calendar']) == ('days since 2000-01-01', 'standard')
+
+    # read from the catalogue as long as the file does not change
+    monkeypatch.setattr(catalogue, 'scan', None)
+    assert catalogue.entries([first, second]) is None
+    assert catalogue.entry(first) == entry
+    catalogue.update(first, variable='slp')
+    assert catalogue.entry(first)['variable'] == 'slp'
+
+    monkeypatch.undo()
+    monkeypatch.setattr(catalogue.config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    _write(first, np.arange(10), calendar='noleap')
+    entry = catalogue.entry(first)
+    assert entry['variable'] is None
+    assert len(entry['time_values']) == 10 and entry['time_calendar'] == 'noleap'
+
+    # entries of removed files are pruned
+    assert catalogue.entry(second) is not None
+    os.remove(second)
+    assert catalogue.prune() == 1
+    assert catalogue.prune() == 0
+
+
+def test_utils_catalogued(tmpdir, monkeypatch):
+    from blackswan import utils
+
+    monkeypatch.setattr(catalogue.config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    first = _write(str(tmpdir.join('slp.2000.nc')), np.arange(366))
+    second = _write(str(tmpdir.join('slp.2001.nc')), np.arange(366, 731))
+
+    def helpers(resource):
+        return (utils.get_timerange(resource), utils.get_time(resource), utils.get_calendar(resource),
+                utils.get_index_lat(resource, 'slp'), utils.get_index_lon(resource, 'slp'),
+                utils.get_variable(resource))
+
+    for resource in [first, [first, second]]:
+        with monkeypatch.context() as m:
+            m.setattr(catalogue, 'entry', lambda path: None)
+            expected = helpers(resource)
+        # added to the catalogue, then read from it
+        assert helpers(resource) == expected
+        assert helpers(resource) == expected
+    assert expected[0] == ('20000101', '20011231')
+
+    # the files are not opened again
+    with monkeypatch.context() as m:
+        for name in ['Dataset', 'MFDataset', 'RequestDataset']:
+            m.setattr(utils, name, None)
+        assert helpers([first, second]) == expected
+
+    # a changed file is read again
+    _write(first, np.arange(10), calendar='noleap')
+    assert utils.get_calendar(first) == ('noleap', 'days since 2000-01-01')
+    assert utils.get_timerange(first) == ('20000101', '20000110')
+    assert len(utils.get_time(first)) == 10
@@ -0,0 +1,15 @@
+import pytest
+
+from blackswan import datafetch
+
+
+def test_reanalyses_failed_year(tmpdir, monkeypatch):
+    fetched = str(tmpdir.join('slp.2000.nc'))
+
+    def download_files(urls, **kwargs):
+        return [fetched] + [None] * (len(urls) - 1)
+
+    monkeypatch.setattr(datafetch, 'download_files', download_files)
+    with pytest.raises(Exception) as e:
+        datafetch.reanalyses(start=2000, end=2001, variable='slp', dataset='NCEP')
+    assert 'slp.2001.nc' in str(e.value)
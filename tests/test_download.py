@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+
+from six.moves import BaseHTTPServer, SimpleHTTPServer, socketserver
+
+from blackswan import utils
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _serve(directory, monkeypatch):
+    monkeypatch.chdir(directory)
+    server = _Server(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%s' % server.server_address[1]
+
+
+def test_download_files(tmpdir, monkeypatch):
+    served = tmpdir.mkdir('served')
+    for year in range(1948, 1954):
+        served.join('slp.%s.nc' % year).write('data %s' % year)
+    cache = tmpdir.mkdir('cache')
+    monkeypatch.setattr(utils.config, 'cache_path', lambda: str(cache))
+    server, base = _serve(str(served), monkeypatch)
+    try:
+        urls = ['%s/slp.%s.nc' % (base, year) for year in range(1948, 1954)] + ['%s/missing.nc' % base]
+        files = utils.download_files(urls, cache=True, workers=3, retries=1, backoff=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert files[-1] is None
+    assert [os.path.basename(f) for f in files[:-1]] == ['slp.%s.nc' % year for year in range(1948, 1954)]
+    assert open(files[0]).read() == 'data 1948'
+    assert not os.path.exists(os.path.join(os.path.dirname(files[0]), 'missing.nc'))
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    data = b'0123456789' * 1000
+    etag = '"v1"'
+    ranges = []
+
+    def do_GET(self):
+        start = 0
+        # ranges of another version are answered with the whole file
+        if 'Range' in self.headers and self.headers.get('If-Range', self.etag) == self.etag:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.ranges.append(start)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, len(self.data) - 1, len(self.data)))
+        else:
+            self.ranges.append(None)
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.data) - start))
+        self.end_headers()
+        self.wfile.write(self.data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download_file_resume(tmpdir, monkeypatch):
+    monkeypatch.setattr(_RangeHandler, 'ranges', [])
+    server = _Server(('127.0.0.1', 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%s/data.nc' % server.server_address[1]
+    out = str(tmpdir.join('data.nc'))
+    try:
+        # partial file of the current version
+        tmpdir.join('data.nc.part').write_binary(_RangeHandler.data[:4000])
+        utils._store_validators(out + '.part', url, {'ETag': '"v1"'})
+        filename = utils.download_file(url, out=out)
+        assert open(filename, 'rb').read() == _RangeHandler.data
+        # partial file of an older version: downloaded again from the start
+        tmpdir.join('data.nc.part').write_binary(b'abcdefghij' * 400)
+        utils._store_validators(out + '.part', url, {'ETag': '"v0"'})
+        utils.download_file(url, out=out)
+        assert open(filename, 'rb').read() == _RangeHandler.data
+        # partial file without validators: not resumed
+        tmpdir.join('data.nc.part').write_binary(b'abcdefghij' * 400)
+        utils.download_file(url, out=out)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert _RangeHandler.ranges == [4000, None, None]
+    assert open(filename, 'rb').read() == _RangeHandler.data
+    assert not os.path.exists(out + '.part')
+    assert not os.path.exists(out + '.part.http.json')
+
+
+class _ETagHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    version = ['v1']
+    requests = []
+
+    def do_GET(self):
+        etag = '"%s"' % self.version[0]
+        self.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        data = ('data %s' % self.version[0]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download_validation(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils.config, 'cache_path', lambda: str(tmpdir))
+    server = _Server(('127.0.0.1', 0), _ETagHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%s/slp.2019.nc' % server.server_address[1]
+    try:
+        filename = utils.download(url, cache=True)
+        # fresh or never validated again: no request
+        utils.download(url, cache=True, ttl=3600)
+        utils.download(url, cache=True, ttl=-1)
+        assert _ETagHandler.requests == [None]
+        # not modified
+        assert not utils.validate_cache(filename, url, ttl=0)
+        # modified
+        _ETagHandler.version[0] = 'v2'
+        assert utils.validate_cache(filename, url, ttl=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert _ETagHandler.requests == [None, '"v1"', '"v1"']
+    assert open(filename).read() == 'data v2'
+
+
+def test_download_year_rollover(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils.config, 'cache_path', lambda: str(tmpdir))
+    monkeypatch.setattr(_ETagHandler, 'version', ['v1'])
+    monkeypatch.setattr(_ETagHandler, 'requests', [])
+    server = _Server(('127.0.0.1', 0), _ETagHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%s/slp.2019.nc' % server.server_address[1]
+    try:
+        # cached during the year
+        filename = utils.download(url, cache=True, ttl=3600, final=time.time() + 3600)
+        utils.download(url, cache=True, ttl=3600, final=time.time() + 3600)
+        assert _ETagHandler.requests == [None]
+        # the year ended after the last check: validated once more, then never again
+        validators = utils._load_validators(filename)
+        final = validators['checked'] + 1
+        monkeypatch.setattr(time, 'time', lambda: final + 60)
+        _ETagHandler.version[0] = 'v2'
+        utils.download(url, cache=True, ttl=3600, final=final)
+        utils.download(url, cache=True, ttl=3600, final=final)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert _ETagHandler.requests == [None, '"v1"']
+    assert open(filename).read() == 'data v2'
+
+
+def test_download_server_down(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils.config, 'cache_path', lambda: str(tmpdir))
+    # port of a server which is not running anymore
+    server = _Server(('127.0.0.1', 0), _ETagHandler)
+    port = server.server_address[1]
+    server.server_close()
+    url = 'http://127.0.0.1:%s/slp.2019.nc' % port
+    cached = tmpdir.mkdir('127.0.0.1:%s' % port).join('slp.2019.nc')
+    cached.write('cached data')
+    utils._store_validators(str(cached), url, {'ETag': '"v1"'})
+
+    # stale file in the cache: the cached file is used
+    files = utils.download_files([url], cache=True, ttl=0, retries=0)
+    assert files == [str(cached)]
+    assert cached.read() == 'cached data'
@@ -0,0 +1,122 @@
+import numpy as np
+
+from scipy.spatial.distance import cdist
+from scipy.stats.mstats import mquantiles
+
+from blackswan import localdims
+
+
+def _reference(dist, quanti, ap):
+    # loop of the original implementation, column by column
+    dim = np.full(dist.shape[1], np.nan)
+    theta = np.full(dist.shape[1], np.nan)
+    for j in range(dist.shape[1]):
+        logdista = -np.log(dist[:, j])
+        x = logdista[~np.isinf(logdista)]
+        thresh = mquantiles(x[~np.isnan(x)], quanti, alphap=ap, betap=ap)
+        Li = [i for i in range(len(logdista)) if (logdista[i] > thresh) and (logdista[i] < 0)]
+        Si = np.diff(Li) - 1
+        N = len(Si)
+        Nc = len([s for s in Si if s > 0])
+        S = sum((1. - quanti) * Si)
+        theta[j] = (S + N + Nc - np.sqrt(((S + N + Nc) ** 2) - 8 * Nc * S)) / (2 * S)
+        logdista = np.sort(logdista)
+        findidx = [i for i in range(len(logdista)) if (logdista[i] > thresh) and (logdista[i] < 0)]
+        dim[j] = 1 / np.mean(logdista[findidx[0]:len(logdista) - 1] - thresh)
+    return dim, theta
+
+
+def test_dim_theta():
+    dat = np.random.RandomState(0).normal(size=(200, 10))
+    dat[5] = dat[7]
+    dist = cdist(dat, dat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ap in [0.5, 1.]:
+            dim, theta = localdims._dim_theta(dist, 0.98, ap)
+            ref_dim, ref_theta = _reference(dist, 0.98, ap)
+            assert np.allclose(dim, ref_dim, rtol=1e-10, equal_nan=True)
+            assert np.allclose(theta, ref_theta, rtol=1e-10, equal_nan=True)
+
+
+def test_local_dims_slabs():
+    dat = np.random.RandomState(1).normal(size=(150, 8))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dim, theta = localdims._dim_theta(cdist(dat, dat))
+        city_dim, city_theta = localdims._dim_theta(cdist(dat, dat, metric='cityblock'))
+        for slab in [1, 7, 150]:
+            gram_dim, gram_theta = localdims.local_dims(dat, slab=slab)
+            assert np.allclose(gram_dim, dim, rtol=1e-8, equal_nan=True)
+            assert np.allclose(gram_theta, theta, rtol=1e-8, equal_nan=True)
+            slab_dim, slab_theta = localdims.local_dims(dat, slab=slab, distance='cityblock')
+            assert np.array_equal(slab_dim, city_dim, equal_nan=True)
+            assert np.array_equal(slab_theta, city_theta, equal_nan=True)
+        single_dim, _ = localdims.local_dims(dat, dtype=np.float32)
+        assert np.allclose(single_dim, dim, rtol=1e-3, equal_nan=True)
+    assert localdims.slab_size(1000, memory=8e6) == 100
+    assert localdims.slab_size(1000, memory=1e12) == 1000
+
+
+def test_local_dims_shared():
+    dat = np.random.RandomState(2).normal(size=(120, 6))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dim, theta = localdims.local_dims(dat)
+        par_dim, par_theta = localdims.local_dims_shared(dat, workers=2, chunk=25)
+    assert np.allclose(par_dim, dim, rtol=1e-10, equal_nan=True)
+    assert np.allclose(par_theta, theta, rtol=1e-10, equal_nan=True)
+
+
+def _reference_new(dist, quanti, ap):
+    # brute force estimate for points outside the series: all exceedances count
+    dim = np.full(dist.shape[1], np.nan)
+    theta = np.full(dist.shape[1], np.nan)
+    for j in range(dist.shape[1]):
+        logdista = -np.log(dist[:, j])
+        thresh = mquantiles(logdista, quanti, alphap=ap, betap=ap)[0]
+        exceed = np.flatnonzero((logdista > thresh) & (logdista < 0))
+        Si = np.diff(exceed) - 1
+        N = len(Si)
+        Nc = np.count_nonzero(Si > 0)
+        S = (1. - quanti) * Si.sum()
+        theta[j] = (S + N + Nc - np.sqrt(((S + N + Nc) ** 2) - 8 * Nc * S)) / (2 * S)
+        dim[j] = 1. / np.mean(logdista[logdista > thresh] - thresh)
+    return dim, theta
+
+
+def test_local_dims_new():
+    dat = np.random.RandomState(3).normal(size=(300, 12))
+    reference = localdims.prepare_reference(dat[:-2])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dim, theta = localdims.local_dims_new(reference, dat[-2:])
+        ref_dim, ref_theta = _reference_new(cdist(dat[:-2], dat[-2:]), 0.98, 0.5)
+    assert dim.shape == (2,)
+    assert np.allclose(dim, ref_dim, rtol=1e-8)
+    assert np.allclose(theta, ref_theta, rtol=1e-8, equal_nan=True)
+
+
+def test_quantile_sweep():
+    dat = np.random.RandomState(4).normal(size=(200, 8))
+    quantiles = [0.95, 0.97, 0.98, 0.99]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dim, theta = localdims.local_dims(dat, quanti=quantiles, slab=64)
+        assert dim.shape == (4, 200)
+        for i, quanti in enumerate(quantiles):
+            ref_dim, ref_theta = _reference(cdist(dat, dat), quanti, 0.5)
+            assert np.allclose(dim[i], ref_dim, rtol=1e-8, equal_nan=True)
+            assert np.allclose(theta[i], ref_theta, rtol=1e-8, equal_nan=True)
+        par_dim, _ = localdims.local_dims_shared(dat, quanti=quantiles, workers=2)
+    assert np.allclose(par_dim, dim, rtol=1e-10, equal_nan=True)
+
+
+def test_distance_matrix(tmpdir, monkeypatch):
+    monkeypatch.setattr(localdims.config, 'cache_path', lambda: str(tmpdir))
+    dat = np.random.RandomState(5).normal(size=(100, 6))
+    dist = localdims.distance_matrix(dat, slab=30)
+    assert dist.dtype == np.float32
+    assert np.allclose(dist, cdist(dat, dat), atol=1e-5)
+    assert (np.diag(dist) == 0).all()
+    assert localdims.distance_matrix(dat).filename == dist.filename
+    assert localdims.distance_key(dat, 'cityblock') != localdims.distance_key(dat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dim, theta = localdims.local_dims_matrix(dist, quanti=[0.95, 0.98], slab=40)
+        ref_dim, ref_theta = localdims.local_dims(dat, quanti=[0.95, 0.98])
+    assert np.allclose(dim, ref_dim, rtol=1e-3, equal_nan=True)
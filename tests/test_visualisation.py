@@ -0,0 +1,21 @@
+import os
+
+import numpy as np
+
+from blackswan import visualisation
+
+
+def test_local_dims_plots(tmpdir):
+    rng = np.random.RandomState(0)
+    dim = rng.uniform(5, 20, 100)
+    theta = rng.uniform(0.4, 0.8, 100)
+    dim[3] = np.nan
+
+    pdf = visualisation.pdf_local_dims(dim, theta, output=str(tmpdir.join('local_dims.pdf')))
+    assert os.path.getsize(pdf) > 0
+    assert open(pdf, 'rb').read(5) == b'%PDF-'
+
+    html = visualisation.html_local_dims(dim, theta, output=str(tmpdir.join('local_dims.html')))
+    page = open(html).read()
+    assert page.startswith('<!DOCTYPE html>')
+    assert '<body>\n<svg' in page